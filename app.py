@@ -2,7 +2,13 @@
 
 import streamlit as st
 import database  # 作成した database.py をインポート
-import pandas as pd
+# qr_codes (qrcode, Pillow) はダッシュボードでだけ読み込む (QRコードからの閲覧を速く表示するため)
+
+# ダッシュボードの一覧の1ページあたりの件数
+PAGE_SIZE = 50
+
+# 0. 接続・キャッシュの準備とバックグラウンド更新を開始 (プロセスごとに1回だけ)
+database.start_background_tasks()
 
 # 1. URLのクエリパラメータを最初にチェック
 params = st.query_params
@@ -31,7 +37,8 @@ if "story_id" in params:
     story_id = params["story_id"]
     
     # データベースから該当IDのストーリーを取得
-    @st.cache_data(ttl=600) # 閲覧データもキャッシュ
+    # (database 側のメモリ上の索引から O(1) で取得でき、保存・更新時も該当IDだけが
+    #  書き換わるため、ここで個別にキャッシュする必要はない)
     def fetch_story(sid):
         return database.get_story(sid)
         
@@ -51,6 +58,8 @@ if "story_id" in params:
 # 【ダッシュボード機能】
 else:
     # story_id がない場合 (通常のアクセス時)
+    import qr_codes
+    
     st.set_page_config(page_title="ブランドストーリーダッシュボード", layout="wide")
     
     st.title("ブランドストーリー管理ダッシュボード 🚀")
@@ -59,12 +68,30 @@ else:
     st.divider()
     st.header("過去に作成したストーリー一覧")
     
-    # データベースから全ストーリーを取得
+    # データベースから一覧を1ページ分だけ取得 (検索語がある場合はタイトル・本文の検索結果)
+    # (一覧に必要な列だけを読む。本文や会話履歴は閲覧・再開時に1件ずつ読み込む)
     try:
-        df = database.get_all_stories()
+        query = st.text_input("ストーリーを検索", placeholder="タイトルや本文の言葉 (例: トマト 朝どれ)")
+        if st.session_state.get("dashboard_query") != query:
+            # 検索語が変わったら1ページ目に戻る
+            st.session_state.dashboard_query = query
+            st.session_state.dashboard_page = 1
+        
+        page = st.session_state.get("dashboard_page", 1)
+        total, df = database.search_stories(query, page, PAGE_SIZE)
+        if query.strip() and not database.is_search_ready():
+            st.caption("本文の検索を準備しています。準備ができるまではタイトルだけを検索しています。")
+        page_count = max(1, -(-total // PAGE_SIZE))
+        if page > page_count:
+            # 件数が減ってページがなくなった場合は最後のページを表示する
+            page = st.session_state.dashboard_page = page_count
+            total, df = database.search_stories(query, page, PAGE_SIZE)
         
         if df.empty:
-            st.info("まだ作成されたストーリーはありません。")
+            if query.strip():
+                st.info("一致するストーリーはありません。")
+            else:
+                st.info("まだ作成されたストーリーはありません。")
         else:
             # --- 修正・追加 (ここから) ---
             # リンク用のURLをDataFrameに新しい列として追加
@@ -99,6 +126,57 @@ else:
                 )
             else:
                 st.warning("データはありますが、表示できるカラム(created_at, title, story_id)がありません。")
+            
+            # ページ送り
+            col_page, col_count = st.columns([1, 3])
+            with col_page:
+                st.number_input("ページ", min_value=1, max_value=page_count, step=1, key="dashboard_page")
+            with col_count:
+                first = (page - 1) * PAGE_SIZE + 1
+                st.caption(f"{total}件中 {first}〜{first + len(df) - 1}件を表示 ({page}/{page_count} ページ)")
+            
+            # 保存先を月ごとに分けている場合、一覧は新しい月から読み込んでいるので、古い月は必要な時に読み込む
+            if not query.strip() and database.has_older_stories():
+                if st.button("以前のストーリーを読み込む"):
+                    with st.spinner("以前のストーリーを読み込んでいます..."):
+                        database.load_older_stories()
+                    st.rerun()
+
+            # 【QRコードの一括作成】(印刷用にまとめてダウンロード。表示中のページのストーリーから選ぶ)
+            with st.expander("QRコードの一括作成 (印刷用)"):
+                labels = {
+                    row["story_id"]: f"{row.get('title', '')} ({row.get('created_at', '')})"
+                    for row in df.to_dict("records")
+                }
+                selected_ids = st.multiselect(
+                    "QRコードを作成するストーリー", options=list(labels), format_func=labels.get
+                )
+                output_format = st.radio("形式", ["ZIP (PNG)", "PDF (印刷用)"], horizontal=True)
+
+                if st.button("QRコードを作成", disabled=not selected_ids):
+                    static_base_url = st.secrets.get("STATIC_BASE_URL", "")
+                    exported_ids = database.get_exported_story_ids(static_base_url)
+                    titles = dict(zip(df["story_id"], df["title"]))
+                    items = [
+                        {
+                            "story_id": story_id,
+                            "title": titles.get(story_id, ""),
+                            "url": qr_codes.story_url(story_id, static_base_url=static_base_url, exported_ids=exported_ids),
+                        }
+                        for story_id in selected_ids
+                    ]
+                    with st.spinner(f"{len(items)} 件のQRコードを作成中です..."):
+                        pngs, stats = qr_codes.generate_batch(items)
+                        if output_format.startswith("ZIP"):
+                            data, file_name, mime = qr_codes.pack_zip(items, pngs), "qr_codes.zip", "application/zip"
+                        else:
+                            data, file_name, mime = qr_codes.pack_pdf(items, pngs), "qr_codes.pdf", "application/pdf"
+
+                    st.caption(
+                        f"{stats['count']} 件 / {stats['seconds']:.2f} 秒 "
+                        f"({stats['codes_per_sec']:.1f} 件/秒, キャッシュ {stats['cache_hits']} 件)"
+                    )
+                    st.download_button("ダウンロード", data=data, file_name=file_name, mime=mime)
 
     except Exception as e:
         st.error(f"データの読み込みに失敗しました: {e}")
\ No newline at end of file
@@ -0,0 +1,384 @@
+# batch_generate.py
+#
+# ヒアリングの記録 (JSONL / CSV) からブランドストーリーをまとめて作成する、コマンドラインのバッチ処理。
+# 生産者団体の受け入れ時など、多くのヒアリング記録を一度に登録する場合に、
+# ストーリー作成ページの3つのタブを1件ずつ操作しなくて済むようにする。
+#
+#   1. ストーリーテラー (ページと同じプロンプト・同じ解析処理) で、タイトルと本文を並列に生成する
+#      (同時実行数と1分あたりのリクエスト数 (形式の直しの呼び出しも数える) を指定できる。同じ内容の生成結果は generation_cache から返す)
+#   2. 生成できたものを保存先にまとめて追加する (append_records。1件ずつ save_story を呼ばない)
+#   3. QRコードの PNG を 出力先/qr/<story_id>.png に書き出し、出力先/stories.csv に一覧を書き出す
+#      (STATIC_BASE_URL がある場合、QRコードは static_export.py で書き出し済みのストーリーだけを静的な HTML に向ける)
+#
+# 途中経過は 出力先/progress.jsonl に1件ずつ追記するので、途中で止まっても同じコマンドで再実行すれば
+# 保存済みのものは飛ばし、生成済みで未保存のものは生成し直さずに保存から続ける。
+#
+# 入力ファイルの形式 (1件 = 1回のヒアリング):
+#   JSONL: {"id": "...", "messages": [{"role": "user" | "assistant", "content": "..."}, ...]}
+#          または {"id": "...", "transcript": "ヒアリングの記録 (テキスト)"}
+#   CSV  : id, transcript の列 (1行目は見出し)
+#   id を省略した場合は、ファイル内の行番号 (1始まり) を使う。
+#
+# 実行方法 (リポジトリのルートで。保存先と APIキーの設定は .streamlit/secrets.toml から読む):
+#   python batch_generate.py interviews.jsonl --out batch_out
+#   python batch_generate.py interviews.csv --out batch_out --concurrency 8 --requests-per-minute 60
+#   python batch_generate.py interviews.jsonl --out batch_out --fake   # APIを呼ばずに流れだけ確認する
+
+import argparse
+import csv
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import llm
+import qr_codes
+from generation_cache import GenerationCache, make_key
+from prompts import MODEL_NAME, PROMPT_VERSION, STORYTELLER_JSON_PROMPT, STORYTELLER_PROMPT
+from scheduler import TokenBucket, call_api
+from static_export import load_exported_ids
+from storage import COLUMNS, SECRETS_PATH, create_backend, load_secrets
+
+PROGRESS_NAME = "progress.jsonl"
+STORIES_NAME = "stories.csv"
+QR_DIR = "qr"
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_MINUTE = 30
+
+# 保存先にまとめて追加する件数
+SAVE_BATCH = 100
+
+# 途中経過の状態
+GENERATED = "generated" # 生成済み (まだ保存していない)
+SAVED = "saved"
+FAILED = "failed" # 生成できなかった (再実行すると生成し直す)
+
+# -----------------------------------------------------------------
+#  入力と途中経過
+# -----------------------------------------------------------------
+
+def load_items(path):
+    """
+    入力ファイル (拡張子 .csv なら CSV、それ以外は JSONL) を読み、{"id", "messages"} のリストを返す。
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    items = []
+    seen = set()
+    for number, row in enumerate(rows, 1):
+        item_id = str(row.get("id") or number)
+        if item_id in seen:
+            raise ValueError(f"{path}: id '{item_id}' が重複しています。")
+        seen.add(item_id)
+
+        messages = row.get("messages")
+        if isinstance(messages, str): # CSV に JSON で書かれている場合
+            messages = json.loads(messages)
+        if not messages:
+            transcript = str(row.get("transcript") or "").strip()
+            if not transcript:
+                raise ValueError(f"{path}: id '{item_id}' に messages も transcript もありません。")
+            messages = [{"role": "user", "content": transcript}]
+        items.append({"id": item_id, "messages": messages})
+    return items
+
+
+def load_progress(out_dir):
+    """
+    途中経過 (progress.jsonl) を読み、id -> 最後の状態の dict を返す。
+    書きかけの最後の行 (強制終了した場合) は読み飛ばす。
+    """
+    progress = {}
+    path = os.path.join(out_dir, PROGRESS_NAME)
+    if not os.path.exists(path):
+        return progress
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            progress[entry["id"]] = entry
+    return progress
+
+
+class ProgressLog:
+    """
+    途中経過を1件ずつ progress.jsonl に追記する (書き込むたびにディスクに反映する)。
+    """
+
+    def __init__(self, out_dir):
+        self._file = open(os.path.join(out_dir, PROGRESS_NAME), "a", encoding="utf-8")
+
+    def write(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+# -----------------------------------------------------------------
+#  生成
+# -----------------------------------------------------------------
+
+def load_storyteller(secrets, fake=False):
+    """
+    ストーリーテラーのモデルを作る (ページの load_models() と同じプロンプト・同じ出力形式)。
+    """
+    story_format = secrets.get("STORY_OUTPUT_FORMAT", llm.DEFAULT_STORY_FORMAT)
+    if fake:
+        from fakes import fake_models
+        return fake_models(story_format=story_format)["storyteller"]
+
+    import google.generativeai as genai
+
+    genai.configure(api_key=secrets["GOOGLE_API_KEY"], transport='rest')
+    use_context_cache = secrets.get("USE_CONTEXT_CACHE", False)
+    if story_format == llm.STORY_FORMAT_JSON:
+        return llm.create_role_model(STORYTELLER_JSON_PROMPT, use_context_cache, llm.STORY_GENERATION_CONFIG)
+    return llm.create_role_model(STORYTELLER_PROMPT, use_context_cache)
+
+
+class RateLimitedModel:
+    """
+    model.generate_content を1回呼ぶごとに流量制限 (bucket) のトークンを使い、上限超過などのエラーを再試行するラッパー。
+    llm.generate_story は形式の直しでもう1回呼ぶことがあるので、生成1件ではなく AI の呼び出しごとに数える。
+    """
+
+    def __init__(self, model, bucket):
+        self.model = model
+        self.bucket = bucket
+
+    def generate_content(self, *args, **kwargs):
+        return call_api(lambda: self.model.generate_content(*args, **kwargs), self.bucket)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def generate_story(model, messages, bucket, cache, story_format=llm.DEFAULT_STORY_FORMAT):
+    """
+    ヒアリングの記録からストーリーを1件生成し、(title, body, from_cache) を返す。
+    上限超過などのエラーは再試行し、解析できない出力の場合は ValueError を投げる。
+    (構造化出力で読めなかった場合の形式の修正は llm.generate_story の中で1回だけ行う)
+    """
+    # ページと同じく、役割は system_instruction に設定済みなので、チャット履歴だけを送る
+    prompt = "Chat History:\n" + llm.format_history(messages)
+    cache_kind = "storyteller_json" if story_format == llm.STORY_FORMAT_JSON else "storyteller"
+    key = make_key(cache_kind, messages, PROMPT_VERSION, MODEL_NAME)
+
+    raw = cache.get(key) if cache is not None else None
+    from_cache = raw is not None
+    if from_cache:
+        result = llm.parse_output(raw, story_format)
+    else:
+        result = llm.generate_story(RateLimitedModel(model, bucket), prompt, story_format)
+
+    if result["error"] is not None:
+        raise ValueError(result["error"])
+    if cache is not None and not from_cache:
+        cache.put(key, result["raw"])
+    return result["title"], result["body"], from_cache
+
+
+def generate_all(items, model, log, concurrency, requests_per_minute, cache, story_format=llm.DEFAULT_STORY_FORMAT):
+    """
+    items を同時に concurrency 件ずつ生成し、1件終わるごとに途中経過に書き込む。
+    生成できたものの途中経過 (GENERATED) のリストを返す。
+    """
+    bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+    generated = []
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {
+            executor.submit(generate_story, model, item["messages"], bucket, cache, story_format): item
+            for item in items
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            item = futures[future]
+            try:
+                title, body, from_cache = future.result()
+            except Exception as e:
+                log.write({"id": item["id"], "status": FAILED, "error": f"{type(e).__name__}: {e}"})
+                print(f"[{done}/{len(items)}] {item['id']}: 生成に失敗しました ({e})")
+                continue
+
+            entry = {
+                "id": item["id"],
+                "status": GENERATED,
+                "story_id": str(uuid.uuid4()), # 保存前に決めておき、再実行でも同じIDで保存する
+                "title": title,
+                "body": body,
+                "chat_history": json.dumps(item["messages"]),
+                "created_at": datetime.now().isoformat(),
+            }
+            log.write(entry)
+            generated.append(entry)
+            print(f"[{done}/{len(items)}] {item['id']}: {title}" + (" (キャッシュ)" if from_cache else ""))
+    return generated
+
+# -----------------------------------------------------------------
+#  保存と QRコード
+# -----------------------------------------------------------------
+
+def save_all(backend, entries, log, resumed_ids=()):
+    """
+    生成済みのストーリーを SAVE_BATCH 件ずつまとめて保存先に追加し、途中経過を SAVED にする。
+    前回の実行で生成したもの (resumed_ids) は、保存の途中で止まった可能性があるので、
+    保存先にすでにあれば追加し直さない。
+    """
+    saved = []
+    pending = []
+    for entry in entries:
+        if entry["id"] in resumed_ids and backend.get_record(entry["story_id"]) is not None:
+            saved.append(dict(entry, status=SAVED))
+            log.write(saved[-1])
+        else:
+            pending.append(entry)
+
+    for start in range(0, len(pending), SAVE_BATCH):
+        batch = pending[start:start + SAVE_BATCH]
+        backend.append_records([
+            {col: entry.get(col, "") for col in COLUMNS} # history_summary は空 (再開時に作り直される)
+            for entry in batch
+        ])
+        if not backend.flush(timeout=600):
+            raise RuntimeError("保存先への書き込みが終わりませんでした。再実行すると続きから保存します。")
+        for entry in batch:
+            failed = backend.write_status(entry["story_id"])[1]
+            if failed:
+                raise RuntimeError(f"保存に失敗しました ({entry['id']}): {failed}")
+            saved.append(dict(entry, status=SAVED))
+            log.write(saved[-1])
+        print(f"{len(saved)}/{len(entries)} 件を保存しました。")
+    return saved
+
+
+def load_previous_urls(out_dir):
+    """
+    前回書き出した一覧 (stories.csv) の、QRコードの PNG -> URL。
+    """
+    path = os.path.join(out_dir, STORIES_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return {row["qr_png"]: row["url"] for row in csv.DictReader(f)}
+
+
+def write_outputs(out_dir, entries, app_url, static_base_url):
+    """
+    保存したストーリーの QRコード (qr/<story_id>.png) と一覧 (stories.csv) を書き出す。
+    PNG は、まだないものと、前回から URL が変わったもの (static_export.py で書き出され、
+    静的な HTML を指すようになったもの) だけを書き出す。
+    """
+    qr_dir = os.path.join(out_dir, QR_DIR)
+    os.makedirs(qr_dir, exist_ok=True)
+    exported_ids = load_exported_ids(static_base_url) if static_base_url else set()
+    previous_urls = load_previous_urls(out_dir)
+
+    items = [
+        {
+            "story_id": entry["story_id"],
+            "title": entry["title"],
+            "url": qr_codes.story_url(entry["story_id"], app_url, static_base_url, exported_ids),
+            # 入力ファイルの id はパスに使わない ("../" などを含められるので。story_id はこちらで振った UUID)
+            "path": os.path.join(qr_dir, f"{entry['story_id']}.png"),
+            "id": entry["id"],
+        }
+        for entry in entries
+    ]
+    missing = [
+        item for item in items
+        if not os.path.exists(item["path"])
+        or previous_urls.get(os.path.relpath(item["path"], out_dir)) != item["url"]
+    ]
+    if missing:
+        pngs, stats = qr_codes.generate_batch(missing)
+        for item, png in zip(missing, pngs):
+            with open(item["path"], "wb") as f:
+                f.write(png)
+        print(f"QRコードを {stats['count']} 件書き出しました ({stats['codes_per_sec']:.1f} 件/秒)。")
+
+    with open(os.path.join(out_dir, STORIES_NAME), "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "story_id", "title", "url", "qr_png"])
+        for item in items:
+            writer.writerow([item["id"], item["story_id"], item["title"], item["url"], os.path.relpath(item["path"], out_dir)])
+
+
+def run_batch(items, backend, model, out_dir, concurrency=DEFAULT_CONCURRENCY,
+              requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, cache=None,
+              app_url=qr_codes.DEFAULT_APP_URL, static_base_url="", story_format=llm.DEFAULT_STORY_FORMAT):
+    """
+    バッチ処理の本体。途中経過を読み、保存済みのものは飛ばして、生成・保存・QRコードの書き出しを行う。
+
+    戻り値: {"total", "skipped" (前回までに保存済み), "generated", "saved", "failed"} の件数
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    progress = load_progress(out_dir)
+    item_ids = {item["id"] for item in items}
+    done = [entry for entry in progress.values() if entry["status"] == SAVED and entry["id"] in item_ids]
+    resumed = [entry for entry in progress.values() if entry["status"] == GENERATED and entry["id"] in item_ids]
+    finished_ids = {entry["id"] for entry in done + resumed}
+    todo = [item for item in items if item["id"] not in finished_ids]
+    print(f"{len(items)} 件中、保存済み {len(done)} 件・生成済み {len(resumed)} 件・これから生成 {len(todo)} 件")
+
+    log = ProgressLog(out_dir)
+    try:
+        start = time.perf_counter()
+        generated = generate_all(todo, model, log, concurrency, requests_per_minute, cache, story_format)
+        print(f"生成: {len(generated)}/{len(todo)} 件 ({time.perf_counter() - start:.1f} 秒)")
+
+        saved = save_all(backend, resumed + generated, log, {entry["id"] for entry in resumed})
+    finally:
+        log.close()
+
+    write_outputs(out_dir, done + saved, app_url, static_base_url)
+    return {
+        "total": len(items),
+        "skipped": len(done),
+        "generated": len(generated),
+        "saved": len(saved),
+        "failed": len(todo) - len(generated),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ヒアリングの記録からブランドストーリーをまとめて作成する")
+    parser.add_argument("input", help="ヒアリングの記録 (JSONL または CSV)")
+    parser.add_argument("--out", default="batch_out", help="途中経過・QRコード・一覧の出力先 (既定: batch_out)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同時に生成する件数")
+    parser.add_argument("--requests-per-minute", type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="AIへの1分あたりのリクエスト数の上限 (0 で無制限)")
+    parser.add_argument("--fake", action="store_true", help="APIを呼ばない偽物のモデルを使う (動作確認用)")
+    parser.add_argument("--secrets", default=SECRETS_PATH, help=f"設定ファイル (既定: {SECRETS_PATH})")
+    args = parser.parse_args()
+
+    secrets = load_secrets(args.secrets)
+    items = load_items(args.input)
+    result = run_batch(
+        items,
+        create_backend(secrets),
+        load_storyteller(secrets, args.fake),
+        args.out,
+        concurrency=args.concurrency,
+        requests_per_minute=args.requests_per_minute,
+        cache=GenerationCache(secrets.get("GENERATION_CACHE_PATH", "generation_cache.sqlite3")),
+        static_base_url=secrets.get("STATIC_BASE_URL", ""),
+        story_format=secrets.get("STORY_OUTPUT_FORMAT", llm.DEFAULT_STORY_FORMAT),
+    )
+    print(f"完了: {result['total']} 件中、今回保存 {result['saved']} 件・保存済みで飛ばした {result['skipped']} 件・"
+          f"生成に失敗 {result['failed']} 件 (失敗したものは再実行すると生成し直します)")
+
+
+if __name__ == "__main__":
+    main()
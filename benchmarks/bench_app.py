@@ -0,0 +1,260 @@
+# benchmarks/bench_app.py
+#
+# Google Sheets と Gemini を使わずに、アプリ全体 (app.py とストーリー作成ページ) の応答時間を計測するベンチマーク。
+#   - 保存先: fakes.FakeWorksheet (メモリ上の偽物のワークシート。API 1回ごとの待ち時間を設定できる)
+#   - AI    : fakes.FakeGenerativeModel (応答までの待ち時間を設定できる)
+# を使い、Streamlit の AppTest でページを実行する。
+#
+# シナリオ (ストーリー件数ごとに実行):
+#   dashboard_cold: ダッシュボードの初回表示 (一覧を全件読み込む)
+#   dashboard_warm: ダッシュボードの2回目以降の表示
+#   qr_view       : QRコードからの閲覧 (?story_id=...)
+#   resume        : ストーリー作成ページで続きから再開 (?resume_id=...)
+#   interview     : ヒアリングで1回発言して、AIの応答を受け取る
+#   save          : 新規保存
+#   update        : 上書き保存
+#
+# 結果は JSON (シナリオごとの所要時間の中央値・最小・最大と、偽物のシートへの API 呼び出し回数) で書き出すので、
+# 前回の結果と比べて遅くなっていないかを確認できる。
+#
+# 実行方法 (リポジトリのルートで):
+#   python benchmarks/bench_app.py
+#   python benchmarks/bench_app.py --sizes 1000 10000 --repeat 5 --sheets-latency 0.05 --out report.json
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import streamlit as st  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import database  # noqa: E402
+import fakes  # noqa: E402
+import metrics  # noqa: E402
+from history_codec import encode_history  # noqa: E402
+from storage import COLUMNS, SHEET_COLUMNS  # noqa: E402
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_REPEAT = 3
+
+APP_PATH = os.path.join(ROOT, "app.py")
+CREATE_PAGE_PATH = os.path.join(ROOT, "pages", "create_new_story.py")
+
+# AppTest の1回の実行の制限時間 (秒)。100k件の初回読み込みもあるので長めにする
+RUN_TIMEOUT = 600
+
+SAMPLE_MESSAGES = [
+    {"role": "user", "content": "うちは朝の四時から収穫しとるんよ。日が昇る前のほうが実が締まっとってね。"},
+    {"role": "assistant", "content": "うんうん、なるほど！ すごく手間暇がかかっているんですね。"},
+] * 10
+
+
+def populate(size):
+    """
+    偽物のスプレッドシートを作り直し、size 件のストーリーを入れる。入れたストーリーのIDのリストを返す。
+    """
+    fakes.reset_fake_spreadsheets()
+    ws = fakes.fake_spreadsheet(database.SHEET_NAME).sheet1
+
+    chat_history = encode_history(json.dumps(SAMPLE_MESSAGES, ensure_ascii=False))
+    story_ids = [str(uuid.uuid4()) for _ in range(size)]
+    ws.rows.append(list(SHEET_COLUMNS))
+    for i, story_id in enumerate(story_ids):
+        record = {
+            "story_id": story_id,
+            "title": f"ストーリー {i}",
+            "body": "夜明け前の畑に、今日も足を運びます。\n\n" * 5,
+            "chat_history": chat_history,
+            "created_at": datetime(2025, 1, 1).isoformat(),
+            "history_summary": "",
+        }
+        ws.rows.append([record[col] for col in COLUMNS] + [""] * (len(SHEET_COLUMNS) - len(COLUMNS)))
+    return story_ids
+
+
+def new_app(path, args):
+    at = AppTest.from_file(path, default_timeout=RUN_TIMEOUT)
+    at.secrets["STORAGE_BACKEND"] = "fake_sheets"
+    at.secrets["USE_FAKE_MODEL"] = True
+    at.secrets["FAKE_MODEL_FIRST_TOKEN_LATENCY"] = args.model_latency
+    at.secrets["GENERATION_CACHE_PATH"] = ":memory:"
+    at.secrets["BACKGROUND_REFRESH"] = False # 計測中にバックグラウンドで読み込まないようにする
+    return at
+
+
+def reset_app_state():
+    # プロセスを再起動した直後と同じ状態にする (メモリ上のテーブル・接続・モデルなどのキャッシュを消す)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+
+def timed_run(at):
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(f"ページの実行中にエラーが発生しました: {at.exception[0].message}")
+    return elapsed
+
+
+def find_button(at, label):
+    return next(button for button in at.button if button.label == label)
+
+
+# -----------------------------------------------------------------
+#  シナリオ (それぞれ、計測した所要時間 (秒) を返す)
+# -----------------------------------------------------------------
+
+def scenario_dashboard_cold(args, story_ids):
+    reset_app_state()
+    return timed_run(new_app(APP_PATH, args))
+
+
+def scenario_dashboard_warm(args, story_ids):
+    return timed_run(new_app(APP_PATH, args))
+
+
+def scenario_qr_view(args, story_ids):
+    at = new_app(APP_PATH, args)
+    at.query_params["story_id"] = story_ids[len(story_ids) // 2]
+    return timed_run(at)
+
+
+def scenario_resume(args, story_ids):
+    at = new_app(CREATE_PAGE_PATH, args)
+    at.query_params["resume_id"] = story_ids[len(story_ids) // 3]
+    return timed_run(at)
+
+
+def scenario_interview(args, story_ids):
+    at = new_app(CREATE_PAGE_PATH, args)
+    at.run()
+    at.chat_input[0].set_value("うちのトマトは朝の四時から収穫しとるんよ。")
+    return timed_run(at)
+
+
+def scenario_save(args, story_ids):
+    at = new_app(CREATE_PAGE_PATH, args)
+    at.session_state["messages"] = list(SAMPLE_MESSAGES)
+    at.session_state["final_story_title"] = "朝露とともに育つ、まっすぐなトマト"
+    at.session_state["final_story_body"] = "夜明け前の畑に、今日も足を運びます。"
+    at.session_state["chat_history_json"] = json.dumps(SAMPLE_MESSAGES, ensure_ascii=False)
+    at.run()
+    find_button(at, "この内容で新規保存する").click()
+    return timed_run(at)
+
+
+def scenario_update(args, story_ids):
+    at = new_app(CREATE_PAGE_PATH, args)
+    at.session_state["messages"] = list(SAMPLE_MESSAGES)
+    at.session_state["final_story_title"] = "朝露とともに育つ、まっすぐなトマト (改訂)"
+    at.session_state["final_story_body"] = "夜明け前の畑に、今日も足を運びます。"
+    at.session_state["chat_history_json"] = json.dumps(SAMPLE_MESSAGES, ensure_ascii=False)
+    at.session_state["saved_story_id"] = story_ids[len(story_ids) // 4]
+    at.run()
+    find_button(at, "この内容で上書き保存する").click()
+    return timed_run(at)
+
+
+SCENARIOS = {
+    "dashboard_cold": scenario_dashboard_cold,
+    "dashboard_warm": scenario_dashboard_warm,
+    "qr_view": scenario_qr_view,
+    "resume": scenario_resume,
+    "interview": scenario_interview,
+    "save": scenario_save,
+    "update": scenario_update,
+}
+
+
+def run_scenario(name, args, story_ids):
+    """
+    シナリオを args.repeat 回実行し、所要時間と偽物のシートへの API 呼び出し回数 (1回あたり) をまとめる。
+    """
+    spreadsheet = fakes.fake_spreadsheet(database.SHEET_NAME)
+    seconds = []
+    calls = {}
+    for _ in range(args.repeat):
+        spreadsheet.reset_calls()
+        seconds.append(SCENARIOS[name](args, story_ids))
+        for method, count in spreadsheet.calls.items():
+            calls[method] = calls.get(method, 0) + count
+    return {
+        "median_s": statistics.median(seconds),
+        "min_s": min(seconds),
+        "max_s": max(seconds),
+        "runs": seconds,
+        "sheet_calls_per_run": {method: count / args.repeat for method, count in sorted(calls.items())},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="偽物のシート・AIを使ったアプリ全体のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="ストーリーの件数")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="シナリオごとの実行回数")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--sheets-latency", type=float, default=0.0, help="シート API 1回あたりの待ち時間 (秒)")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="AIの最初の応答までの待ち時間 (秒)")
+    parser.add_argument("--out", default=None, help="結果の JSON の出力先 (既定: benchmarks/results/bench_app_<日時>.json)")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "bench_app",
+        "created_at": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "repeat": args.repeat,
+            "sheets_latency_s": args.sheets_latency,
+            "model_latency_s": args.model_latency,
+        },
+        "results": [],
+    }
+
+    print(f"{'stories':>8} | {'scenario':<15} | {'median (ms)':>11} | {'min (ms)':>9} | {'max (ms)':>9} | sheet calls / run")
+    print("-" * 100)
+    for size in args.sizes:
+        story_ids = populate(size)
+        fakes.fake_spreadsheet(database.SHEET_NAME).set_latency(args.sheets_latency)
+        reset_app_state()
+        metrics.reset()
+
+        for name in args.scenarios:
+            result = run_scenario(name, args, story_ids)
+            report["results"].append(dict(result, stories=size, scenario=name))
+            calls = ", ".join(f"{method}={count:g}" for method, count in result["sheet_calls_per_run"].items())
+            print(f"{size:>8} | {name:<15} | {result['median_s'] * 1000:>11.1f} | "
+                  f"{result['min_s'] * 1000:>9.1f} | {result['max_s'] * 1000:>9.1f} | {calls}")
+
+        # アプリ側で記録した処理ごとの計測結果 (metrics.py) も残す
+        report.setdefault("metrics", {})[str(size)] = metrics.summary()
+
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"bench_app_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を {out} に書き出しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/bench_history_codec.py
+#
+# chat_history の保存形式 (history_codec) のサイズと変換時間を計測するベンチマーク。
+# ヒアリングを模した会話 (日本語・1往復ごとに質問と回答) を往復数を変えて作り、
+#   - raw    : これまでの保存形式 (json.dumps した文字列そのまま)
+#   - encoded: 保存形式 v1 (zlib + base64)
+# の文字数、必要なセル数、エンコード・デコードにかかる時間を表示する。
+#
+# 実行方法 (リポジトリのルートで):
+#   python benchmarks/bench_history_codec.py
+
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import history_codec  # noqa: E402
+
+TURNS = [10, 30, 100, 300]
+REPEAT = 20
+
+# 会話の文を作るための断片 (毎回いくつかを組み合わせ、同じ文ばかりにならないようにする)
+FRAGMENTS = [
+    "うちは朝の四時から収穫しとるんよ。", "日が昇る前のほうが実が締まっとってね、味が全然違うんじゃ。",
+    "去年は台風でハウスが半分やられてしもうて、", "家族総出で一晩中ビニールを押さえとった。",
+    "子どもが野菜嫌いでも、これなら食べられるって言うてもらえるのが一番うれしいねえ。",
+    "土づくりには十年かけとる。", "牡蠣殻を砕いて畑に混ぜるのが、じいちゃんの代からのやり方でね。",
+    "出荷の前には一個ずつ手で磨いとるんです。", "市場の人には手間をかけすぎじゃって笑われるけど、",
+    "孫が東京から帰ってきた時に、おいしいって言うてくれたのが始まりじゃった。",
+    "水は山の湧き水を引いとって、", "夏場は朝晩の二回、様子を見に行かんと落ち着かんのよ。",
+]
+QUESTIONS = [
+    "うんうん、なるほど！ すごく手間暇がかかっているんですね。",
+    "それは大変でしたね！ 具体的にはどんなことがありましたか？",
+    "すごいこだわりですね！ 他の産地のものとは、どんなところが違うんでしょう？",
+    "ちなみに、どんな方に一番食べてほしいですか？",
+    "その時、どんなお気持ちでしたか？",
+]
+
+
+def make_transcript(turns):
+    """
+    turns 往復分のヒアリングの会話を、ページと同じ json.dumps の形式で作る。
+    """
+    messages = []
+    for i in range(turns):
+        answer = "".join(random.sample(FRAGMENTS, random.randint(2, 4)))
+        question = "".join(random.sample(QUESTIONS, 2))
+        messages.append({"role": "user", "content": f"{answer}({i})"})
+        messages.append({"role": "assistant", "content": question})
+    return json.dumps(messages)
+
+
+def time_us(fn, arg):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(arg)
+    return (time.perf_counter() - start) / REPEAT * 1e6
+
+
+def main():
+    print(f"{'turns':>6} | {'raw chars':>10} | {'encoded':>10} | {'ratio':>6} | {'cells':>9} | "
+          f"{'encode (us)':>11} | {'decode (us)':>11}")
+    print("-" * 84)
+    for turns in TURNS:
+        raw = make_transcript(turns)
+        encoded = history_codec.encode_history(raw)
+        assert history_codec.decode_history(encoded) == raw
+
+        raw_cells = math.ceil(len(raw) / history_codec.CELL_LIMIT)
+        encoded_cells = math.ceil(len(encoded) / history_codec.CELL_LIMIT)
+        encode_us = time_us(history_codec.encode_history, raw)
+        decode_us = time_us(history_codec.decode_history, encoded)
+
+        print(f"{turns:>6} | {len(raw):>10} | {len(encoded):>10} | {len(encoded) / len(raw):>6.2f} | "
+              f"{raw_cells:>3} -> {encoded_cells:<3} | {encode_us:>11.1f} | {decode_us:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
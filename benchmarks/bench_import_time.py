@@ -0,0 +1,117 @@
+# benchmarks/bench_import_time.py
+#
+# モジュールの読み込み時間 (python -X importtime) を計測し、
+# QRコードからの閲覧に必要なモジュールが重いライブラリ (Gemini, qrcode, gspread など) を読み込んでいないかを確認する。
+#
+#   - streamlit     : 基準 (Streamlit 本体だけ)
+#   - viewer        : 閲覧モード (app.py の ?story_id=... の表示) で読み込むモジュール
+#   - create_page   : ストーリー作成ページで読み込むモジュール (AIを使う前の状態)
+#
+# 基準より後に読み込まれたモジュールに HEAVY_MODULES が含まれていたら、理由を表示して終了コード 1 で終わる。
+# 同じ確認は tests/test_import_time.py がテストとして行う (pytest で実行される)。
+#
+# 実行方法 (リポジトリのルートで):
+#   python benchmarks/bench_import_time.py
+#   python benchmarks/bench_import_time.py --repeat 10
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE = "streamlit"
+
+TARGETS = {
+    "streamlit": "import streamlit",
+    "viewer": "import streamlit, database",
+    "create_page": "import streamlit, database, llm, prompts, generation_cache, qr_codes, metrics",
+}
+
+# 閲覧モード・ページの起動時に読み込んではいけない (使う時に読み込む) ライブラリ
+HEAVY_MODULES = ["google.generativeai", "qrcode", "gspread", "tenacity", "PIL", "pandas"]
+
+
+def import_time(statement):
+    """
+    statement を新しいプロセスで -X importtime 付きで実行し、
+    (読み込み時間の合計 (ミリ秒), {モジュール名: 自分の分を含めた読み込み時間 (ミリ秒)}) を返す。
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"'{statement}' の実行に失敗しました:\n{result.stderr[-2000:]}")
+
+    total_us = 0
+    modules = {}
+    for line in result.stderr.splitlines():
+        # 例: "import time:       150 |        250 |   streamlit.runtime"
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(parts) != 3:
+            continue
+        _, cumulative_us, name = parts
+        if not cumulative_us.strip().isdigit():
+            continue # 見出しの行
+        # 読み込み元からの深さに応じて2文字ずつ字下げされる (直接読み込んだものは "| " の後の空白1つだけ)
+        indent = len(name) - len(name.lstrip())
+        name = name.strip()
+        modules[name] = int(cumulative_us) / 1000
+        if indent == 1: # 直接読み込んだ (他のモジュールから読み込まれたのではない) もの
+            total_us += int(cumulative_us)
+    return total_us / 1000, modules
+
+
+def heavy_modules(modules, baseline_modules):
+    """
+    基準 (baseline_modules) より後に読み込まれたモジュールのうち、HEAVY_MODULES (とその下のモジュール) の名前の一覧。
+    """
+    return sorted(
+        module for module in modules
+        if module not in baseline_modules
+        and any(module == prefix or module.startswith(prefix + ".") for prefix in HEAVY_MODULES)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モジュールの読み込み時間のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の回数 (中央値を表示)")
+    parser.add_argument("--top", type=int, default=8, help="基準より後に読み込まれた重いモジュールを何件表示するか")
+    args = parser.parse_args()
+
+    results = {}
+    for name, statement in TARGETS.items():
+        runs = [import_time(statement) for _ in range(args.repeat)]
+        results[name] = (statistics.median(total for total, _ in runs), runs[-1][1])
+
+    baseline_ms, baseline_modules = results[BASELINE]
+    print(f"{'target':<12} | {'import (ms)':>11} | {'+ streamlit 以外 (ms)':>20}")
+    print("-" * 52)
+    for name, (total_ms, _) in results.items():
+        print(f"{name:<12} | {total_ms:>11.1f} | {total_ms - baseline_ms:>20.1f}")
+
+    failed = False
+    for name, (_, modules) in results.items():
+        if name == BASELINE:
+            continue
+        added = {module: ms for module, ms in modules.items() if module not in baseline_modules}
+
+        print(f"\n[{name}] 基準より後に読み込まれたモジュール (読み込み時間の大きい順):")
+        for module, ms in sorted(added.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"  {ms:>8.1f} ms  {module}")
+
+        heavy = heavy_modules(modules, baseline_modules)
+        if heavy:
+            failed = True
+            print(f"  NG: 起動時に読み込まないはずのモジュールが読み込まれています: {', '.join(heavy[:10])}")
+        else:
+            print("  OK: 重いライブラリは読み込まれていません")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# benchmarks/bench_qr_codes.py
+#
+# QRコードの作成速度 (1秒あたりの件数) を計測するベンチマーク。
+#   - serial: 1件ずつ作成 (キャッシュなし。これまでのページと同じ)
+#   - batch : qr_codes.generate_batch() で作成 (PROCESS_POOL_THRESHOLD 件未満は1件ずつ)
+#   - pool  : qr_codes.generate_batch() で件数によらずプロセスプールを使って並列に作成 (CPU が1つの場合は1件ずつ)
+#   - cached: 同じURLをもう一度 generate_batch() に渡した場合 (すべてキャッシュから返す)
+# と、ZIP・PDF にまとめるのにかかる時間を表示する。
+#
+# 実行方法 (リポジトリのルートで):
+#   python benchmarks/bench_qr_codes.py
+
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import qr_codes  # noqa: E402
+
+SIZES = [12, 60, 240]
+
+
+def make_items(count):
+    items = []
+    for i in range(count):
+        story_id = str(uuid.uuid4())
+        items.append({"story_id": story_id, "title": f"ストーリー {i}", "url": qr_codes.story_url(story_id)})
+    return items
+
+
+def main():
+    print(f"{'codes':>6} | {'serial /s':>10} | {'batch /s':>10} | {'pool /s':>10} | {'cached /s':>10} | "
+          f"{'zip (s)':>8} | {'pdf (s)':>8}")
+    print("-" * 81)
+    for count in SIZES:
+        items = make_items(count)
+
+        start = time.perf_counter()
+        for item in items:
+            qr_codes.render_qr_png(item["url"], style="print")
+        serial = count / (time.perf_counter() - start)
+
+        pngs, batch_stats = qr_codes.generate_batch(items)
+        _, cached_stats = qr_codes.generate_batch(items)
+        assert cached_stats["cache_hits"] == count or count > qr_codes.DEFAULT_MAX_ENTRIES
+        _, pool_stats = qr_codes.generate_batch(make_items(count), pool_threshold=0)
+
+        start = time.perf_counter()
+        qr_codes.pack_zip(items, pngs)
+        zip_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        qr_codes.pack_pdf(items, pngs)
+        pdf_seconds = time.perf_counter() - start
+
+        print(f"{count:>6} | {serial:>10.1f} | {batch_stats['codes_per_sec']:>10.1f} | "
+              f"{pool_stats['codes_per_sec']:>10.1f} | "
+              f"{cached_stats['codes_per_sec']:>10.1f} | {zip_seconds:>8.3f} | {pdf_seconds:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
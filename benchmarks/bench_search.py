@@ -0,0 +1,104 @@
+# benchmarks/bench_search.py
+#
+# ストーリー検索 (search_index.SearchIndex) のベンチマーク。
+#   - build : 全件からの索引の作成
+#   - search: 検索語ごとの検索 (1ページ目の50件を取り出すまで)
+#   - scan  : 比較用。全件の本文に対する単純な部分文字列の検索
+#   - upsert: 1件の上書き
+#
+# 実行方法 (リポジトリのルートで):
+#   python benchmarks/bench_search.py
+#   python benchmarks/bench_search.py --sizes 1000 100000 --body-words 120
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from search_index import SearchIndex, normalize  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000]
+REPEAT = 20
+
+WORDS = (
+    "朝 露 トマト 収穫 農家 畑 土 手間 こだわり 家族 子ども 夏 太陽 甘い 味 市場 出荷 牡蠣 殻 湧き水 "
+    "山 海 米 みかん 梨 桃 りんご 苺 ぶどう 茶 牛乳 卵 蜂蜜 野菜 果物 季節 祖父 孫 瀬戸内 島 風 雨 "
+    "台風 ハウス 温室 苗 種 Organic 有機 JAS"
+).split()
+PARTICLES = "、。のがをにはと"
+
+QUERIES = ["トマト", "瀬戸内 みかん", "台風の畑", "米", "organic", "見つからない言葉"]
+
+
+def make_text(words):
+    return "".join(random.choice(WORDS) + random.choice(PARTICLES) for _ in range(words))
+
+
+def make_records(n, body_words):
+    start = datetime(2025, 1, 1)
+    return [
+        {
+            "story_id": str(uuid.uuid4()),
+            "title": make_text(4),
+            "body": make_text(body_words),
+            "created_at": (start + timedelta(minutes=i)).isoformat(),
+        }
+        for i in range(n)
+    ]
+
+
+def scan(records, query):
+    # 比較用: すべての語を含むストーリーを数えるだけ (並べ替えはしない)
+    terms = normalize(query).split()
+    return sum(
+        all(term in normalize(record["title"]) or term in normalize(record["body"]) for term in terms)
+        for record in records
+    )
+
+
+def median_ms(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - start) * 1e3)
+    return statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストーリー検索のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="ストーリーの件数")
+    parser.add_argument("--body-words", type=int, default=80, help="本文の単語数 (1語あたり2〜4文字程度)")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="検索ごとの実行回数 (中央値を表示)")
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        random.seed(n)
+        records = make_records(n, args.body_words)
+
+        index = SearchIndex()
+        start = time.perf_counter()
+        index.rebuild(records)
+        build_s = time.perf_counter() - start
+
+        record = dict(random.choice(records), title="新しいタイトル")
+        upsert_ms = median_ms(lambda: index.upsert(record), args.repeat)
+
+        print(f"\n{n} 件: build {build_s:.2f} 秒 / upsert {upsert_ms:.2f} ms")
+        print(f"  {'query':<16} | {'hits':>7} | {'search (ms)':>11} | {'scan (ms)':>9}")
+        print("  " + "-" * 54)
+        for query in QUERIES:
+            hits, _ = index.search(query)
+            search_ms = median_ms(lambda: index.search(query), args.repeat)
+            # 単純な検索は遅いので1回だけ計測する
+            scan_ms = median_ms(lambda: scan(records, query), 1)
+            print(f"  {query:<16} | {hits:>7} | {search_ms:>11.2f} | {scan_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/bench_story_lookup.py
+#
+# get_story の検索コストを比較するベンチマーク。
+#   - scan : 旧実装 (DataFrame のブールマスク + to_dict)
+#   - index: story_id 索引 (database.StoryTable) による O(1) 検索
+#
+# 実行方法 (リポジトリのルートで):
+#   python benchmarks/bench_story_lookup.py
+
+import os
+import random
+import sys
+import time
+import uuid
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database  # noqa: E402
+
+SIZES = [100, 1_000, 10_000, 100_000]
+LOOKUPS = 200
+
+
+def make_stories(n):
+    """
+    シートと同じ列構成 (A列〜E列) のダミーデータを n 件作る。
+    """
+    return pd.DataFrame([
+        {
+            "story_id": str(uuid.uuid4()),
+            "title": f"タイトル {i}",
+            "body": "本文" * 200,
+            "chat_history": "[]",
+            "created_at": "2025-01-01T00:00:00",
+        }
+        for i in range(n)
+    ])
+
+
+def scan_lookup(df, story_id):
+    story = df[df['story_id'] == story_id]
+    if not story.empty:
+        return story.to_dict('records')[0]
+    return None
+
+
+def index_lookup(table, story_id):
+    story = table.get(story_id)
+    return dict(story) if story is not None else None
+
+
+def per_lookup_us(fn, container, ids):
+    start = time.perf_counter()
+    for story_id in ids:
+        fn(container, story_id)
+    return (time.perf_counter() - start) / len(ids) * 1e6
+
+
+def main():
+    print(f"{'rows':>8} | {'build (ms)':>10} | {'scan (us)':>10} | {'index (us)':>10}")
+    print("-" * 49)
+    for n in SIZES:
+        df = make_stories(n)
+        ids = random.choices(df["story_id"].tolist(), k=LOOKUPS)
+
+        start = time.perf_counter()
+        table = database.StoryTable(df.to_dict('records'))
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        # 大きなサイズでは旧実装が遅すぎるため、検索回数を減らして計測する
+        scan_ids = ids if n <= 10_000 else ids[:20]
+        scan_us = per_lookup_us(scan_lookup, df, scan_ids)
+        index_us = per_lookup_us(index_lookup, table, ids)
+
+        print(f"{n:>8} | {build_ms:>10.1f} | {scan_us:>10.1f} | {index_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+# benchmarks/load_test.py
+#
+# QRコードからの閲覧 (app.py の ?story_id=...) に多くの利用者が同時にアクセスした場合の負荷試験。
+# 市場などで、同じ商品のQRコードを大勢が一斉に読み取る状況を想定する。
+#
+# bench_app.py と同じく、保存先は fakes.FakeWorksheet (API 1回ごとの待ち時間を設定できる偽物のシート) にする。
+# AppTest は同時に複数を実行できない (実行のたびにプロセス全体で1つの Runtime を作り直すため) ので、
+# このプロセスの中で本物の Streamlit サーバーを起動し、ブラウザと同じく WebSocket でページを開く
+# (BackMsg の rerun_script を送り、script_finished を受け取るまでを1セッションの応答時間とする)。
+# 偽物のシート・メモリ上のテーブル・single-flight などは、サーバーに同時にアクセスが来た場合と同じく
+# すべてのセッションで共有される。アクセスする側も同じプロセスで動くので、メモリ (RSS) にはその分も含まれる。
+#
+#   - 閲覧セッション    : ?story_id=... を開く。hot_ratio の割合で人気のストーリー (--hot-stories 件) を、
+#                          残りはそれ以外のストーリー (cold) をランダムに開く
+#   - ダッシュボード    : --dashboard-ratio の割合で、ダッシュボード (一覧) を開く
+#
+# 結果として、スループット (セッション/秒)・種類ごとの応答時間のパーセンタイル・メモリ (RSS) の増加量・
+# 偽物のシートへの API 呼び出し回数 (1秒あたり) を表示し、JSON に書き出す。
+# 既定では開始前にキャッシュを消すので、起動直後に同時にアクセスが来た場合の読み込みの集中も確認できる
+# (--warm で、先に1回ずつ表示してから計測する)。
+#
+# 実行方法 (リポジトリのルートで):
+#   python benchmarks/load_test.py
+#   python benchmarks/load_test.py --stories 10000 --sessions 1000 --concurrency 100 --hot-ratio 0.9 --sheets-latency 0.2
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from urllib.parse import urlencode
+
+# 同じディレクトリの bench_app.py の準備処理を使う (読み込むとリポジトリのルートが sys.path に入る)
+from bench_app import APP_PATH, ROOT, git_commit, populate
+
+from streamlit.proto.BackMsg_pb2 import BackMsg  # noqa: E402
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg  # noqa: E402
+from streamlit.web import bootstrap  # noqa: E402
+from tornado.websocket import websocket_connect  # noqa: E402
+
+import database  # noqa: E402
+import fakes  # noqa: E402
+import metrics  # noqa: E402
+
+VIEWER = "viewer"
+DASHBOARD = "dashboard"
+
+# メモリ (RSS) を調べる間隔 (秒)
+MEMORY_SAMPLE_INTERVAL = 0.2
+
+# サーバーの起動を待つ時間と、1セッションの制限時間 (秒)
+SERVER_START_TIMEOUT = 60
+SESSION_TIMEOUT = 600
+
+# サーバーで使う secrets (一時ファイルに書き出して secrets.files に指定する)
+SECRETS = {
+    "STORAGE_BACKEND": "fake_sheets",
+    "USE_FAKE_MODEL": True,
+    "GENERATION_CACHE_PATH": ":memory:",
+    "BACKGROUND_REFRESH": False, # 計測中にバックグラウンドで読み込まないようにする
+}
+
+
+def rss_mb():
+    """
+    このプロセスの現在の RSS (MB)。/proc がない環境では最大 RSS で代用する。
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage / 2**20 if sys.platform == "darwin" else usage / 1024
+
+
+class MemoryMonitor:
+    """
+    バックグラウンドで RSS を一定間隔で調べ、最大値を記録する。
+    """
+
+    def __init__(self):
+        self.start_mb = rss_mb()
+        self.peak_mb = self.start_mb
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end_mb = rss_mb()
+        self.peak_mb = max(self.peak_mb, self.end_mb)
+
+    def _run(self):
+        while not self._stop.wait(MEMORY_SAMPLE_INTERVAL):
+            self.peak_mb = max(self.peak_mb, rss_mb())
+
+
+def plan_sessions(args, story_ids):
+    """
+    実行するセッション (種類, story_id) のリストを作る。
+    """
+    rng = random.Random(args.seed)
+    hot = story_ids[:args.hot_stories]
+    cold = story_ids[args.hot_stories:] or hot
+    sessions = []
+    for _ in range(args.sessions):
+        if rng.random() < args.dashboard_ratio:
+            sessions.append((DASHBOARD, None))
+        elif rng.random() < args.hot_ratio:
+            sessions.append((VIEWER, rng.choice(hot)))
+        else:
+            sessions.append((VIEWER, rng.choice(cold)))
+    return sessions
+
+
+def write_secrets(directory):
+    path = os.path.join(directory, "secrets.toml")
+    with open(path, "w", encoding="utf-8") as f:
+        for key, value in SECRETS.items():
+            f.write(f"{key} = {json.dumps(value)}\n")
+    return path
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_server(port):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Streamlit サーバーが起動しませんでした")
+
+
+async def run_session(port, kind, story_id):
+    """
+    WebSocket で1セッション分のページを開き、(種類, 所要時間 (秒), エラーメッセージ) を返す。
+    """
+    start = time.perf_counter()
+    ws = None
+    try:
+        ws = await websocket_connect(f"ws://127.0.0.1:{port}/_stcore/stream", subprotocols=["streamlit"])
+        msg = BackMsg()
+        msg.rerun_script.SetInParent()
+        if story_id is not None:
+            msg.rerun_script.query_string = urlencode({"story_id": story_id})
+        await ws.write_message(msg.SerializeToString(), binary=True)
+
+        error = None
+        shown = False
+        while True:
+            payload = await asyncio.wait_for(ws.read_message(), SESSION_TIMEOUT)
+            if payload is None:
+                error = "接続が切れました"
+                break
+            fwd = ForwardMsg()
+            fwd.ParseFromString(payload)
+            kind_of_msg = fwd.WhichOneof("type")
+            if kind_of_msg == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                element = fwd.delta.new_element.WhichOneof("type")
+                if element == "exception":
+                    error = error or fwd.delta.new_element.exception.message
+                elif element == "alert" and kind == VIEWER:
+                    error = error or fwd.delta.new_element.alert.body
+                shown = shown or element == "markdown"
+            elif kind_of_msg == "script_finished" and fwd.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                break
+        if error is None and kind == VIEWER and not shown:
+            error = "ストーリーが表示されませんでした"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        if ws is not None:
+            ws.close()
+    return kind, time.perf_counter() - start, error
+
+
+async def run_sessions(port, sessions, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(session):
+        async with semaphore:
+            return await run_session(port, *session)
+
+    return await asyncio.gather(*(run_one(session) for session in sessions))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(results, seconds):
+    """
+    種類ごとの件数・エラー数・応答時間 (ミリ秒) のパーセンタイルをまとめる。
+    """
+    summary = {}
+    for kind in (VIEWER, DASHBOARD, "all"):
+        rows = [r for r in results if kind == "all" or r[0] == kind]
+        latencies = [elapsed * 1000 for _, elapsed, error in rows if error is None]
+        if not rows:
+            continue
+        summary[kind] = {
+            "sessions": len(rows),
+            "errors": sum(1 for _, _, error in rows if error is not None),
+            "throughput_per_s": len(rows) / seconds,
+            "mean_ms": statistics.mean(latencies) if latencies else None,
+            "p50_ms": percentile(latencies, 0.50) if latencies else None,
+            "p95_ms": percentile(latencies, 0.95) if latencies else None,
+            "p99_ms": percentile(latencies, 0.99) if latencies else None,
+            "max_ms": max(latencies) if latencies else None,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QRコードからの閲覧の同時アクセスの負荷試験")
+    parser.add_argument("--stories", type=int, default=10_000, help="保存先のストーリーの件数")
+    parser.add_argument("--sessions", type=int, default=500, help="実行するセッションの総数")
+    parser.add_argument("--concurrency", type=int, default=50, help="同時に実行するセッション数")
+    parser.add_argument("--hot-stories", type=int, default=1, help="人気のストーリーの件数")
+    parser.add_argument("--hot-ratio", type=float, default=0.9, help="閲覧のうち人気のストーリーを開く割合")
+    parser.add_argument("--dashboard-ratio", type=float, default=0.05, help="セッションのうちダッシュボードの割合")
+    parser.add_argument("--sheets-latency", type=float, default=0.1, help="シート API 1回あたりの待ち時間 (秒)")
+    parser.add_argument("--warm", action="store_true", help="キャッシュを温めてから計測する (既定は起動直後の状態から)")
+    parser.add_argument("--seed", type=int, default=0, help="セッションの並びの乱数の種")
+    parser.add_argument("--out", default=None, help="結果の JSON の出力先 (既定: benchmarks/results/load_test_<日時>.json)")
+    args = parser.parse_args()
+
+    story_ids = populate(args.stories)
+    fakes.fake_spreadsheet(database.SHEET_NAME).set_latency(args.sheets_latency)
+    metrics.reset()
+
+    # サーバーはメインスレッドで動かす必要があるので、計測は別のスレッドで行い、終わったらサーバーを止める
+    port = free_port()
+    outcome = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        flag_options = {
+            "server_port": port,
+            "server_address": "127.0.0.1",
+            "server_headless": True,
+            "server_fileWatcherType": "none",
+            "browser_gatherUsageStats": False,
+            "secrets_files": [write_secrets(tmp)],
+            "logger_level": "error",
+        }
+
+        def measure():
+            try:
+                wait_for_server(port)
+                outcome["result"] = run_load(args, port, story_ids)
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                signal.raise_signal(signal.SIGTERM)
+
+        threading.Thread(target=measure, daemon=True).start()
+        bootstrap.load_config_options(flag_options)
+        bootstrap.run(APP_PATH, False, [], flag_options)
+
+    if "error" in outcome:
+        raise outcome["error"]
+    report(args, *outcome["result"])
+
+
+def run_load(args, port, story_ids):
+    """
+    セッションを実行し、(結果のリスト, 所要時間 (秒), メモリ, シート API の呼び出し回数) を返す。
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        if args.warm:
+            loop.run_until_complete(run_sessions(port, [(DASHBOARD, None)], 1))
+            loop.run_until_complete(run_sessions(port, [(VIEWER, story_id) for story_id in story_ids[:args.hot_stories]], 1))
+        sessions = plan_sessions(args, story_ids)
+
+        spreadsheet = fakes.fake_spreadsheet(database.SHEET_NAME)
+        spreadsheet.reset_calls()
+        print(f"{args.stories} 件のストーリー / {args.sessions} セッション / 同時 {args.concurrency} "
+              f"(人気 {args.hot_stories} 件を {args.hot_ratio:.0%}, ダッシュボード {args.dashboard_ratio:.0%}) "
+              f"/ シートの待ち時間 {args.sheets_latency * 1000:.0f} ms / {'warm' if args.warm else 'cold'} start")
+
+        with MemoryMonitor() as memory:
+            start = time.perf_counter()
+            results = loop.run_until_complete(run_sessions(port, sessions, args.concurrency))
+            seconds = time.perf_counter() - start
+        return results, seconds, memory, dict(sorted(spreadsheet.calls.items()))
+    finally:
+        loop.close()
+
+
+def report(args, results, seconds, memory, calls):
+    summary = summarize(results, seconds)
+    total_calls = sum(calls.values())
+
+    print(f"\n{'kind':<10} | {'sessions':>8} | {'errors':>6} | {'per sec':>8} | {'p50 (ms)':>9} | "
+          f"{'p95 (ms)':>9} | {'p99 (ms)':>9} | {'max (ms)':>9}")
+    print("-" * 90)
+    for kind, row in summary.items():
+        cells = [f"{row[key]:>9.1f}" if row[key] is not None else f"{'-':>9}" for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+        print(f"{kind:<10} | {row['sessions']:>8} | {row['errors']:>6} | {row['throughput_per_s']:>8.1f} | {' | '.join(cells)}")
+
+    print(f"\nメモリ (RSS): 開始 {memory.start_mb:.1f} MB / 最大 {memory.peak_mb:.1f} MB / 終了 {memory.end_mb:.1f} MB "
+          f"(増加 {memory.end_mb - memory.start_mb:+.1f} MB)")
+    print(f"シート API 呼び出し: {total_calls} 回 ({total_calls / seconds:.2f} 回/秒) "
+          + ", ".join(f"{method}={count}" for method, count in calls.items()))
+    errors = [error for _, _, error in results if error is not None]
+    if errors:
+        print(f"エラーの例: {errors[0]}")
+
+    report = {
+        "benchmark": "load_test",
+        "created_at": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "settings": {key: value for key, value in vars(args).items() if key != "out"},
+        "seconds": seconds,
+        "summary": summary,
+        "memory_mb": {"start": memory.start_mb, "peak": memory.peak_mb, "end": memory.end_mb},
+        "sheet_calls": calls,
+        "sheet_calls_per_s": total_calls / seconds,
+        # アプリ側で記録した処理ごとの計測結果 (読み込みの回数・キャッシュのヒット率など)
+        "metrics": metrics.summary(),
+    }
+    out = args.out or os.path.join(ROOT, "benchmarks", "results", f"load_test_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を {out} に書き出しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,32 @@
 # database.py
 
 import streamlit as st
-import gspread
-import pandas as pd
+# gspread, pandas, search_index (numpy) は使う時に読み込む (QRコードからの閲覧では不要なことが多く、読み込みに時間がかかるため)
 from datetime import datetime
 import uuid
+import threading
+import time
 import json # st.secretsからJSON文字列を読み込むため
-
-# -----------------------------------------------------------------
-#  定数
-# -----------------------------------------------------------------
-
-# Google Sheetsで作成したスプレッドシートの名前
-SHEET_NAME = "brand_gen_database" 
+import metrics
+import revisions
+from storage import (
+    COLUMNS, LISTING_COLUMNS, SEARCH_COLUMNS, open_worksheet, create_backend as create_storage_backend,
+    SHEET_NAME, DEFAULT_BACKEND, # 定数は storage.py で定義 (コマンドラインツールと共通)
+)
 
 # -----------------------------------------------------------------
 #  データベース接続
 # -----------------------------------------------------------------
 
 @st.cache_resource(ttl=3600) # 1時間に1回接続をリフレッシュ
+@metrics.instrument("db.connect") # キャッシュにない場合 (実際に接続した場合) だけ記録される
 def connect_to_db():
     """
     Google Sheetsへの接続を確立し、ワークシートオブジェクトを返す。
     接続情報は st.secrets から読み込み、st.cache_resourceでキャッシュする。
     """
+    import gspread # Google Sheets を使う場合だけ読み込む
+    
     try:
         # --- 修正箇所 (ここから) ---
 
@@ -37,14 +40,9 @@ def connect_to_db():
 
         # --- 修正箇所 (ここまで) ---
 
-        # 3. 辞書型の認証情報を使用してgspreadに接続
-        gc = gspread.service_account_from_dict(creds_dict)
-        
-        # 4. 指定した名前のスプレッドシートを開く
-        sh = gc.open(SHEET_NAME)
-        
-        # 5. 最初のワークシート（シート1）を取得
-        worksheet = sh.sheet1
+        # 3. 辞書型の認証情報を使用してgspreadに接続し、
+        #    指定した名前のスプレッドシートの最初のワークシート（シート1）を取得
+        worksheet = open_worksheet(creds_dict, SHEET_NAME)
         
         return worksheet
         
@@ -55,123 +53,866 @@ def connect_to_db():
         st.error(f"データベース接続エラー: {e}")
         st.stop()
 
+# バックエンド (と Google Sheets への接続) を作り直す間隔 (秒)。connect_to_db のキャッシュの有効期間と同じ
+BACKEND_TTL = 3600
+
+def create_backend():
+    """
+    st.secrets["STORAGE_BACKEND"] に従ってストレージバックエンドを作成して返す。
+    作り方 (SQLite のパス・シートの分割・書き込みの上限などの設定) は storage.create_backend() と共通で、
+    ここでは Streamlit のアプリに固有の部分だけを行う。
+      - "sheets" (既定): Google Sheets は connect_to_db のワークシート (キャッシュした接続) を使う
+      - "fake_sheets"  : ベンチマーク用のメモリ上の偽物のワークシート (fakes.py。この場合だけ読み込む)
+      - 設定の誤りは st.error で表示して止める
+    """
+    backend_name = st.secrets.get("STORAGE_BACKEND", DEFAULT_BACKEND)
+    
+    worksheet = None
+    if backend_name == "sheets":
+        worksheet = connect_to_db()
+    elif backend_name == "fake_sheets":
+        from fakes import fake_spreadsheet
+        worksheet = fake_spreadsheet(SHEET_NAME).sheet1
+    
+    try:
+        return create_storage_backend(st.secrets, worksheet=worksheet)
+    except ValueError as e:
+        st.error(f"エラー: {e}")
+        st.stop()
+
+# 差し替えた古いバックエンドの書き込み待ちを書き込み終えるまで待つ時間の上限 (秒)
+RENEW_FLUSH_TIMEOUT = 60
+
+class BackendHolder:
+    """
+    全セッションで共有するバックエンドの入れ物。
+    有効期間が切れる前にバックグラウンドの更新スレッドが作り直して差し替える (renew) ので、
+    利用者のリクエストが接続の作り直しを待つことはない。
+
+    差し替えた古いバックエンドは、書き込み待ち・失敗したままの書き込みがなくなるまで retired に残し、
+    そこで書き込んだストーリーの状態の確認と再試行 (write_status / retry_write) はそちらに聞く
+    (新しいバックエンドは知らないストーリーを保存済みとして扱うため)。
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.created_at = 0.0
+        self.retired = [] # 差し替えた古いバックエンド (古い順)
+
+    def renew(self):
+        """
+        新しいバックエンドを作って差し替え、古いバックエンドの書き込み待ちを書き込み終える。
+        """
+        connect_to_db.clear() # Google Sheets の場合は接続から作り直す
+        old = self.backend
+        self.backend = create_backend()
+        self.created_at = time.time()
+        if old is not None:
+            self.retired = self.retired + [old]
+            old.flush(timeout=RENEW_FLUSH_TIMEOUT)
+        self._prune()
+
+    def _prune(self):
+        # 書き込みが終わった古いバックエンドは手放す
+        self.retired = [backend for backend in self.retired if backend.has_unfinished_writes()]
+
+    def _backend_for_write(self, story_id):
+        """
+        story_id の書き込みの状態を覚えているバックエンド (新しいものから探す)。どれも知らない場合は今のバックエンド。
+        """
+        self._prune()
+        for backend in [self.backend] + list(reversed(self.retired)):
+            if backend.tracks_write(story_id):
+                return backend
+        return self.backend
+
+    def write_status(self, story_id):
+        return self._backend_for_write(story_id).write_status(story_id)
+
+    def retry_write(self, story_id):
+        return self._backend_for_write(story_id).retry_write(story_id)
+
+@st.cache_resource
+def get_backend_holder():
+    return BackendHolder()
+
+def get_backend():
+    """
+    全セッションで共有するストレージバックエンドを返す。
+    最初の1回だけ作成する (同時に呼ばれても作成は1回だけ)。
+    """
+    holder = get_backend_holder()
+    if holder.backend is None:
+        get_single_flight().do("backend", lambda: holder.backend or holder.renew())
+    return holder.backend
+
+# -----------------------------------------------------------------
+#  同時読み込みのまとめ (single-flight)
+# -----------------------------------------------------------------
+
+class SingleFlight:
+    """
+    同じキーの読み込みが同時に要求された場合に、最初の1つだけを実行し、
+    残りはその完了を待って同じ結果 (または同じ例外) を受け取る。
+    (再起動直後に多くのセッションが同時に全件読み込みをしないようにする)
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e: # st.stop() の例外もそのまま待っている側に伝える
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
 # -----------------------------------------------------------------
 #  データ取得 (F-005: ストーリー閲覧機能)
 # -----------------------------------------------------------------
 
-@st.cache_data(ttl=600) # 10分間、取得したデータをキャッシュする
+class StoryTable:
+    """
+    保存先のストーリーをメモリ上に保持するテーブル。
+    行のリスト(records)と story_id の索引(index)を持ち、
+    保存・更新時は保存先を読み直さずにその場で書き換える (write-through)。
+    
+    records を渡さずに作った場合は空の状態から始まり (complete=False)、
+    1件ずつの読み込み (get_story) や load_all() での全件読み込みで中身が増える。
+    """
+
+    def __init__(self, records=None):
+        self._lock = threading.Lock()
+        self._df = None # to_dataframe() の結果 (書き換えのたびに作り直す)
+        self.complete = records is not None # 全件を読み込み済みかどうか
+        self.records = []
+        self.index = {}
+        for record in records or []:
+            self._add(record)
+
+    def _add(self, record):
+        # get_all_records() は数字だけのIDを int に変換することがあるため、キーは文字列に揃える
+        story_id = str(record.get('story_id', ''))
+        self.records.append(record)
+        # 同じIDが複数ある場合は先頭の行を採用する
+        self.index.setdefault(story_id, record)
+
+    def load_all(self, records, keep_unseen=True):
+        """
+        保存先から読み込んだ全件で中身を置き換える。
+        keep_unseen=True の場合、読み込み中に別のセッションが追加した行 (読み込み結果にないID) は残す。
+        """
+        with self._lock:
+            previous = self.records
+            self.records = []
+            self.index = {}
+            for record in records:
+                self._add(record)
+            if keep_unseen:
+                for record in previous:
+                    if str(record.get('story_id', '')) not in self.index:
+                        self._add(record)
+            self.complete = True
+            self._df = None
+
+    def reset(self):
+        """
+        中身を空にして、全件を読み込んでいない状態に戻す。
+        """
+        with self._lock:
+            self.records = []
+            self.index = {}
+            self.complete = False
+            self._df = None
+
+    def get(self, story_id):
+        """
+        story_id に一致するレコードを O(1) で返す。見つからない場合は None。
+        """
+        return self.index.get(str(story_id))
+
+    def upsert(self, record):
+        """
+        レコードを追加、または同じ story_id の既存レコードを上書きする。
+        """
+        story_id = str(record['story_id'])
+        with self._lock:
+            current = self.index.get(story_id)
+            if current is None:
+                self._add(record)
+            else:
+                # 同じ dict を records と index の両方が参照しているので、その場で更新すればよい
+                current.update(record)
+            self._df = None
+
+    def patch(self, record):
+        """
+        同じ story_id のレコードがテーブルにある場合だけ、渡された列を上書きする。
+        (まだ読み込んでいないレコードを、一部の列だけで作ってしまわないため)
+        """
+        with self._lock:
+            current = self.index.get(str(record['story_id']))
+            if current is not None:
+                current.update(record)
+                self._df = None
+
+    def to_dataframe(self):
+        """
+        テーブル全体を DataFrame として返す。
+        呼び出し側で列を追加しても共有データが壊れないよう、コピーを返す。
+        """
+        with self._lock:
+            if self._df is None:
+                import pandas as pd
+                self._df = pd.DataFrame(self.records)
+            return self._df.copy()
+
+@st.cache_resource
+def get_story_table():
+    """
+    全セッションで共有する、全列のストーリーのテーブル (StoryTable) を返す。
+    最初は空で、閲覧されたストーリーから1件ずつ読み込む。全件が必要な場合は get_all_stories() を使う。
+    保存・更新時は save_story / update_story が、他のプロセスでの変更は sync_stories() が
+    このテーブルを直接書き換える。
+    """
+    return StoryTable()
+
+@st.cache_resource # 全列のテーブルとは別にキャッシュする
+def get_listing_table():
+    """
+    全セッションで共有する、一覧表示用の列 (LISTING_COLUMNS) だけのテーブルを返す。
+    """
+    return StoryTable()
+
+# -----------------------------------------------------------------
+#  差分同期
+# -----------------------------------------------------------------
+
+# 差分同期の間隔 (秒)。この間隔より短い呼び出しでは保存先に問い合わせない
+SYNC_INTERVAL = 10
+
+# 保存先を月ごとなどに分けている場合、一覧を全件読み直す時に最初に読む件数の目安
+# (新しい分から読み、この件数に達したら残りの古い分は load_older_stories() で読む)
+LISTING_PRELOAD = 500
+
+class SyncState:
+    """
+    差分同期の状態。保存先の読み込み位置 (cursor) と最後に同期した時刻を持つ。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cursor = None # None の場合は次の同期で全件を読み直す
+        self.synced_at = 0.0
+        self.older_shards = [] # 一覧にまだ読み込んでいない古い分 (新しい順)
+
+@st.cache_resource
+def get_sync_state():
+    return SyncState()
+
+def sync_stories(force=False):
+    """
+    前回の同期以降に保存先で追加・更新されたストーリーだけを読み込み、
+    メモリ上のテーブル (一覧と全列) に反映する。
+    初回と、行の削除・並べ替えなどで読み込み位置がずれた場合だけ、一覧を全件読み直す。
+    
+    前回の同期から SYNC_INTERVAL 秒以内の場合は何もしない (force=True で必ず同期する)。
+    """
+    state = get_sync_state()
+    if not force and time.time() - state.synced_at < SYNC_INTERVAL:
+        return
+    
+    with state.lock:
+        # 待っている間に別のセッションが同期を済ませていれば何もしない
+        if not force and time.time() - state.synced_at < SYNC_INTERVAL:
+            return
+        
+        backend = get_backend()
+        story_table = get_story_table()
+        listing_table = get_listing_table()
+        
+        records, cursor = (None, None)
+        if state.cursor is not None:
+            with metrics.timed("storage.fetch_changes") as span:
+                records, cursor = backend.fetch_changes(state.cursor)
+                span.size = len(records) if records is not None else None
+        
+        if records is None:
+            # 全件読み直し: 先に位置を取っておけば、読み直し中の追加分は次の同期で読み込まれる
+            with metrics.timed("storage.fetch_changes"):
+                _, cursor = backend.fetch_changes(None)
+            with metrics.timed("storage.list_stories") as span:
+                listing, state.older_shards = _list_recent_stories(backend)
+                span.size = len(listing)
+            listing_table.load_all(listing, keep_unseen=False)
+            if story_table.complete:
+                # 全列のテーブルは、バックグラウンドで読み直してから差し替える
+                # (読み直している間も今の内容で閲覧でき、利用者のリクエストが全件の読み込みを待つことはない)
+                _run_in_background("all_records", lambda: _load_all_records(story_table, keep_unseen=False))
+            else:
+                story_table.reset() # 全列のレコードは必要になった時に1件ずつ読み込み直す
+            # 検索用の索引も、バックグラウンドで作り直してから差し替える
+            start_search_index_build()
+        else:
+            for record in records:
+                listing_table.upsert({col: record.get(col, "") for col in LISTING_COLUMNS})
+                if story_table.complete:
+                    story_table.upsert(record)
+                else:
+                    story_table.patch(record)
+                _index_upsert(record)
+        
+        # 上書きで古くなった分が増えたら、検索用の索引をバックグラウンドで作り直す
+        if get_search_index().needs_rebuild():
+            start_search_index_build()
+        
+        state.cursor = cursor
+        state.synced_at = time.time()
+
+def _list_recent_stories(backend):
+    """
+    一覧を新しい分 (shards()) から読み、LISTING_PRELOAD 件に達するまで読む。
+    戻り値: (読み込んだ一覧 (保存順), まだ読んでいない古い分のリスト)
+    """
+    shards = backend.shards()
+    listing = []
+    for i, shard in enumerate(shards):
+        listing = backend.list_stories(shard) + listing
+        if len(listing) >= LISTING_PRELOAD:
+            return listing, shards[i + 1:]
+    return listing, []
+
+def has_older_stories():
+    """
+    一覧にまだ読み込んでいない古いストーリーがあるかどうか。
+    """
+    return bool(get_sync_state().older_shards)
+
+def load_older_stories():
+    """
+    一覧にまだ読み込んでいない古い分を1つ (月ごとに分けている場合は1か月分) 読み込む。
+    (ダッシュボードの「以前のストーリーを読み込む」用)
+    """
+    state = get_sync_state()
+    with state.lock:
+        if not state.older_shards:
+            return
+        shard = state.older_shards[0]
+        with metrics.timed("storage.list_stories") as span:
+            listing = get_backend().list_stories(shard)
+            span.size = len(listing)
+        listing_table = get_listing_table()
+        for record in listing:
+            listing_table.upsert(record)
+        state.older_shards = state.older_shards[1:]
+
 def get_all_stories():
     """
-    シートからすべてのストーリーを取得し、Pandas DataFrameとして返す。
+    保存先からすべてのストーリーを全列で取得し、Pandas DataFrameとして返す。
+    chat_history や body も読み込むので、一覧表示には get_story_listing() を使うこと。
+    """
+    sync_stories()
+    table = get_story_table()
+    metrics.record_cache("story_table.all", table.complete)
+    if not table.complete:
+        get_single_flight().do("all_records", lambda: table.complete or _load_all_records(table))
+    return table.to_dataframe() # データがない場合は空のDataFrameになる
+
+def _load_all_records(table, keep_unseen=True):
+    with metrics.timed("storage.get_all_records") as span:
+        records = get_backend().get_all_records()
+        span.size = len(records)
+    # keep_unseen=False (読み直し) で落ちた、読み込み中に保存された分は、次の差分同期で戻る
+    table.load_all(records, keep_unseen=keep_unseen)
+    _fill_older_listing(records)
+
+def _fill_older_listing(records):
+    # 全件を読み込んだので、一覧のまだ読んでいない古い分もここから埋める
+    state = get_sync_state()
+    if state.older_shards:
+        with state.lock:
+            listing_table = get_listing_table()
+            for record in records:
+                listing_table.upsert({col: record.get(col, "") for col in LISTING_COLUMNS})
+            state.older_shards = []
+
+def get_story_listing():
+    """
+    すべてのストーリーの一覧表示用の列 (story_id, title, created_at) だけを取得し、
+    Pandas DataFrameとして返す。
     (ダッシュボード一覧表示用)
+    
+    一覧は sync_stories() で差分だけを読み込んで最新に保つので、新しいストーリーも数秒で反映される。
+    """
+    sync_stories()
+    return get_listing_table().to_dataframe() # データがない場合は空のDataFrameになる
+
+@st.cache_resource
+def get_search_index():
+    """
+    全セッションで共有する、タイトルと本文の検索用の索引 (SearchIndex) を返す。
+    バックグラウンドで保存先のタイトル・本文の列だけから作り (rebuild_search_index)、
+    その後は保存・更新・差分同期のたびにその場で更新する。
+    """
+    from search_index import SearchIndex
+    return SearchIndex()
+
+class SearchState:
+    """
+    検索用の索引の状態。索引はバックグラウンドで作り直し、できあがったら差し替える。
     """
-    ws = connect_to_db()
-    if ws:
-        # .get_all_records() は1行目をヘッダーとして自動的に辞書のリストに変換してくれる
-        data = ws.get_all_records()
-        if data:
-            return pd.DataFrame(data)
-    return pd.DataFrame() # データがない場合は空のDataFrameを返す
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = False # 一度でも全件から作り終えたかどうか
+        self.building = False
+        self.pending = [] # 作り直している間に反映したレコード (差し替えた後にもう一度反映する)
+
+@st.cache_resource
+def get_search_state():
+    return SearchState()
+
+def _index_upsert(record):
+    # 検索用の索引にレコードを反映する (作り直している最中なら、差し替えた後の索引にも反映されるように残す)
+    state = get_search_state()
+    with state.lock:
+        get_search_index().upsert(record)
+        if state.building:
+            state.pending.append(record)
+
+def rebuild_search_index():
+    """
+    保存先から検索に使う列 (SEARCH_COLUMNS。chat_history は読まない) だけを全件読み込んで索引を作り直し、
+    できあがったら差し替える。作り直している間も、古い索引で検索できる。
+    """
+    state = get_search_state()
+    with state.lock:
+        state.building = True
+        state.pending = []
+    try:
+        with metrics.timed("storage.list_stories.search") as span:
+            records = get_backend().list_stories(columns=SEARCH_COLUMNS)
+            span.size = len(records)
+        _fill_older_listing(records) # 検索結果は一覧の行で返すので、一覧も全件にしておく
+        index = get_search_index()
+        with metrics.timed("search_index.rebuild") as span:
+            index.rebuild(records)
+            span.size = len(records)
+        with state.lock:
+            for record in state.pending:
+                index.upsert(record)
+            state.ready = True
+    finally:
+        with state.lock:
+            state.building = False
+            state.pending = []
+
+def start_search_index_build():
+    """
+    検索用の索引の作り直しを、バックグラウンドのスレッドで始める (作り直している最中なら何もしない)。
+    """
+    if not get_search_state().building:
+        _run_in_background("search_index", rebuild_search_index)
+
+def is_search_ready():
+    """
+    検索用の索引ができているかどうか (できるまでは search_stories() はタイトルだけを検索する)。
+    """
+    return get_search_state().ready
+
+def _run_in_background(key, fn):
+    # fn をバックグラウンドのスレッドで実行する (同じ key のものが実行中なら、それが終わるのを待つだけ)
+    # エラーは計測結果 (metrics) にエラーとして記録する
+    def run():
+        try:
+            get_single_flight().do(key, fn)
+        except BaseException as e:
+            metrics.observe(f"background.{key}_failed", 0.0, error=type(e).__name__)
+    
+    threading.Thread(target=run, name=f"background-{key}", daemon=True).start()
+
+def search_stories(query, page=1, page_size=50):
+    """
+    タイトルと本文に query を含むストーリーを関連の高い順 (タイトルに含むものが先、同じなら新しい順) に並べ、
+    page ページ目 (1始まり) の page_size 件だけを一覧表示用の列で返す。
+    (ダッシュボードの検索用)
+    
+    query が空の場合は、すべてのストーリーを新しい順に並べたものを返す。
+    
+    戻り値: (total, df)
+        total: 一致した件数
+        df   : page ページ目の一覧 (Pandas DataFrame)
+    """
+    offset = (max(page, 1) - 1) * page_size
+    
+    if not query.strip():
+        df = get_story_listing()
+        if df.empty:
+            return 0, df
+        df = df.sort_values("created_at", ascending=False, kind="stable")
+        return len(df), df.iloc[offset:offset + page_size].reset_index(drop=True)
+    
+    sync_stories()
+    listing_table = get_listing_table()
+    if not is_search_ready():
+        # 索引がまだできていない場合は、バックグラウンドで作り始め、それまでは一覧のタイトルだけから探す
+        # (利用者のリクエストで本文を全件読み込むことはしない)
+        start_search_index_build()
+        return _search_titles(listing_table.to_dataframe(), query, offset, page_size)
+    
+    with metrics.timed("search_index.search") as span:
+        total, story_ids = get_search_index().search(query, offset, page_size)
+        span.size = total
+    
+    import pandas as pd
+    rows = []
+    for story_id in story_ids:
+        record = listing_table.get(story_id)
+        if record is not None:
+            rows.append({col: record.get(col, "") for col in LISTING_COLUMNS})
+    return total, pd.DataFrame(rows, columns=LISTING_COLUMNS)
+
+def _search_titles(df, query, offset, page_size):
+    # 索引ができるまでの代わり: タイトルに検索語のすべてを含むものを新しい順に並べる
+    from search_index import normalize
+    
+    with metrics.timed("search_index.search_titles") as span:
+        terms = normalize(query).split()
+        if df.empty:
+            matched = df
+        else:
+            titles = df["title"].map(normalize)
+            mask = titles.map(lambda title: all(term in title for term in terms))
+            matched = df[mask].sort_values("created_at", ascending=False, kind="stable")
+        span.size = len(matched)
+    return len(matched), matched.iloc[offset:offset + page_size].reset_index(drop=True)
 
 def get_story(story_id):
     """
     指定された story_id に一致するストーリーを1件取得する。
     (QRコードからの閲覧用)
     """
-    # 全件取得（キャッシュ利用）
-    df = get_all_stories() 
+    # 他のプロセスでの変更を反映 (間隔内なら何もしない)
+    sync_stories()
+    table = get_story_table()
     
-    if not df.empty and 'story_id' in df.columns:
-        # DataFrameから該当IDの行を検索
-        story = df[df['story_id'] == story_id]
-        
-        if not story.empty:
-            # DataFrameを行(dict)に変換して最初の1件を返す
-            return story.to_dict('records')[0]
+    # 索引から検索（キャッシュ利用）
+    story = table.get(story_id)
+    metrics.record_cache("story_table.get", story is not None)
+    
+    if story is None:
+        # まだ読み込んでいない (または別のプロセスが保存した) ストーリーは、保存先からこの1件だけを読み込む
+        story = get_single_flight().do(("record", str(story_id)), lambda: _load_record(table, story_id))
+    
+    if story is not None:
+        # キャッシュ内のレコードを書き換えられないようにコピーを返す
+        return dict(story)
             
     return None # 見つからない場合はNoneを返す
 
+def _load_record(table, story_id):
+    with metrics.timed("storage.get_record"):
+        story = get_backend().get_record(story_id)
+    if story is not None:
+        table.upsert(story)
+    return story
+
+# -----------------------------------------------------------------
+#  起動時の準備とバックグラウンド更新
+# -----------------------------------------------------------------
+
+# バックグラウンドで差分同期する間隔 (秒)。SYNC_INTERVAL より短くして、利用者のリクエストでは同期しなくて済むようにする
+REFRESH_INTERVAL = SYNC_INTERVAL / 2
+
+# バックエンドの有効期間が切れる何秒前に作り直すか
+RENEW_MARGIN = 300
+
+def warm_up(load_all=False):
+    """
+    接続と一覧を読み込み、検索用の索引 (タイトル・本文の列だけ) を作っておく。
+    load_all=True の場合は全列のテーブルも読み込む (chat_history を含む全件を読むので、既定では読まない。
+    全列は閲覧されたものから1件ずつ読み込む)。
+    """
+    with metrics.timed("background.warm_up"):
+        get_backend()
+        sync_stories(force=True) # 初回の全件読み直しで、検索用の索引の作成もバックグラウンドで始まる
+        if load_all:
+            get_all_stories()
+
+def _refresh_loop(load_all):
+    # 起動直後に準備し、その後は一定間隔で差分同期とバックエンドの作り直しを行う
+    # (エラーは計測結果 (metrics) にエラーとして記録して続ける)
+    try:
+        warm_up(load_all)
+    except BaseException as e:
+        metrics.observe("background.warm_up_failed", 0.0, error=type(e).__name__)
+    
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        try:
+            holder = get_backend_holder()
+            if time.time() - holder.created_at > BACKEND_TTL - RENEW_MARGIN:
+                with metrics.timed("background.renew_backend"):
+                    holder.renew()
+            with metrics.timed("background.sync"):
+                sync_stories(force=True)
+        except BaseException as e:
+            metrics.observe("background.refresh_failed", 0.0, error=type(e).__name__)
+
+@st.cache_resource
+def start_background_tasks():
+    """
+    起動時の準備 (warm_up) と、バックグラウンドでの更新を行うスレッドを開始する。
+    プロセスごとに1回だけ実行される (app.py と各ページの最初で呼ぶ)。
+    st.secrets["BACKGROUND_REFRESH"] が False の場合は何もしない。
+    
+    コンテナの起動スクリプトなどで、起動直後にアプリのURL (ヘルスチェック) に1回アクセスしておくと、
+    利用者が来る前に準備を始められる。
+    """
+    if not st.secrets.get("BACKGROUND_REFRESH", True):
+        return None
+    thread = threading.Thread(
+        target=_refresh_loop,
+        args=(st.secrets.get("WARM_UP_FULL_TABLE", False),),
+        name="story-cache-refresher",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
 # -----------------------------------------------------------------
 #  データ保存 (F-003: ストーリー保存機能)
 # -----------------------------------------------------------------
 
-def save_story(title, body, chat_history):
+def save_story(title, body, chat_history, history_summary=""):
     """
-    生成されたストーリーをGoogle Sheetsに新しい行として追加保存する。
+    生成されたストーリーを保存先に新しい行として追加保存する。
     (F-003: ストーリー保存機能)
     
+    Sheets への書き込みはキューに入れてすぐに戻るので、story_id はシートに書き込まれる前に返る。
+    書き込みが終わったかどうかは get_save_status(story_id) で確認できる。
+    QRコードは get_save_status(story_id) が "saved" になってから印刷・配布すること
+    (書き込み待ちのものはプロセスの終了時にも送るが、scheduler.SHUTDOWN_FLUSH_TIMEOUT 秒を過ぎた分は失われる)。
+    
+    history_summary には、ヒアリング再開時に使う会話の要約 (JSON文字列) を渡す。
+    
     戻り値:
         str: 保存に成功した場合、新しく発行された story_id
         None: 保存に失敗した場合
     """
-    ws = connect_to_db()
-    if ws:
-        try:
-            # 1. 新しいユニークIDを生成
-            story_id = str(uuid.uuid4())
-            
-            # 2. 現在時刻
-            created_at = datetime.now().isoformat()
-            
-            # 3. Google Sheetに追加する行データを作成 (テーブル設計のA列〜E列の順)
-            new_row = [
-                story_id,
-                title,
-                body,
-                str(chat_history), # 履歴は安全のため文字列として保存
-                created_at
-            ]
-            
-            # 4. シートの末尾に行を追加
-            ws.append_row(new_row)
-            
-            # 5. キャッシュをクリア (重要)
-            # 新しいデータを追加したので、古いキャッシュを削除する
-            st.cache_data.clear()
-            
-            # 6. QRコード生成用に新しいIDを返す
-            return story_id 
-            
-        except Exception as e:
-            st.error(f"ストーリーの保存に失敗しました: {e}")
-            return None
-    return None
-# (save_story 関数の下に追記)
+    try:
+        # 1. 新しいユニークIDを生成
+        story_id = str(uuid.uuid4())
+        
+        # 2. 現在時刻
+        created_at = datetime.now().isoformat()
+        
+        # 3. 追加するレコードを作成 (テーブル設計のA列〜F列の順)
+        new_record = dict(zip(COLUMNS, [
+            story_id,
+            title,
+            body,
+            str(chat_history), # 履歴は安全のため文字列として保存
+            created_at,
+            history_summary
+        ]))
+        
+        # 4. 保存先の末尾に追加
+        with metrics.timed("storage.append_record") as span:
+            span.size = sum(len(str(value)) for value in new_record.values()) # 書き込む文字数
+            get_backend().append_record(new_record)
+        
+        # 5. メモリ上のテーブルに新しい行を追加 (write-through)
+        # キャッシュ全体は消さないので、他のセッションが保存先を読み直すことはない
+        get_story_table().upsert(new_record)
+        get_listing_table().upsert({col: new_record[col] for col in LISTING_COLUMNS})
+        _index_upsert({col: new_record[col] for col in SEARCH_COLUMNS})
+        
+        # 6. QRコード生成用に新しいIDを返す
+        return story_id 
+        
+    except Exception as e:
+        st.error(f"ストーリーの保存に失敗しました: {e}")
+        return None
 
-def update_story(story_id, title, body, chat_history):
+def update_story(story_id, title, body, chat_history, history_summary=""):
     """
     既存のストーリーを story_id をキーに上書き更新する。
-    (B列: title, C列: body, D列: chat_history を更新)
+    (B列: title, C列: body, D列: chat_history, F列: history_summary を更新)
+    
+    上書き前の版は変更履歴に残る (list_revisions / restore_revision で一覧・復元できる)。
+    変更履歴の版は保存先が書き込む時に組み立てるので、この呼び出しでは変更履歴を読まない。
     
     戻り値:
         bool: 更新が成功したかどうか
     """
-    ws = connect_to_db()
-    if ws:
-        try:
-            # 1. story_id (A列にあるはず) を検索してセルを取得
-            cell = ws.find(story_id)
+    try:
+        # 変更履歴に残すため、上書き前の内容をメモリ上のテーブルから取っておく
+        # (保存先には問い合わせない。テーブルにない場合は、保存先が変更履歴を書き込む時に読む)
+        previous = get_story_table().get(story_id)
+        previous = dict(previous) if previous is not None else None
+        
+        # 1. 保存先の該当IDを上書き
+        with metrics.timed("storage.update_record") as span:
+            span.size = len(title) + len(body) + len(str(chat_history)) + len(history_summary) # 書き込む文字数
+            updated = get_backend().update_record(story_id, title, body, str(chat_history), history_summary)
+        
+        if updated:
+            # 2. メモリ上のテーブルの該当IDだけを書き換える (write-through)
+            get_story_table().patch({
+                "story_id": story_id,
+                "title": title,
+                "body": body,
+                "chat_history": str(chat_history),
+                "history_summary": history_summary,
+            })
+            get_listing_table().patch({"story_id": story_id, "title": title})
+            _index_upsert({"story_id": story_id, "title": title, "body": body})
             
-            if cell:
-                # 2. 該当する行番号を取得
-                row_number = cell.row
-                
-                # 3. B列からD列の範囲 (例: "B5:D5") を指定して更新
-                update_range = f'B{row_number}:D{row_number}'
-                values = [[title, body, str(chat_history)]] # 2次元配列で渡す
-                
-                ws.update(update_range, values)
-                
-                # 4. キャッシュをクリア (重要)
-                st.cache_data.clear()
-                
-                return True
-            else:
-                # 該当する story_id が見つからなかった場合
-                st.error(f"上書き対象のID ({story_id}) が見つかりませんでした。")
-                return False
-                
-        except Exception as e:
-            st.error(f"ストーリーの上書き保存に失敗しました: {e}")
+            # 3. 変更履歴に前の版との差分を追加 (失敗しても上書き保存自体は成功として扱う)
+            try:
+                with metrics.timed("storage.record_revision"):
+                    get_backend().record_revision(story_id, previous, {
+                        "title": title,
+                        "body": body,
+                        "chat_history": str(chat_history),
+                        "history_summary": history_summary,
+                    }, datetime.now().isoformat())
+            except Exception as e:
+                metrics.observe("revisions.record_failed", 0.0, error=type(e).__name__)
+                st.warning(f"変更履歴の記録に失敗しました: {e}")
+            
+            return True
+        else:
+            # 該当する story_id が見つからなかった場合
+            st.error(f"上書き対象のID ({story_id}) が見つかりませんでした。")
             return False
-    return False
\ No newline at end of file
+            
+    except Exception as e:
+        st.error(f"ストーリーの上書き保存に失敗しました: {e}")
+        return False
+
+def get_save_status(story_id):
+    """
+    保存・上書き保存したストーリーの、保存先への書き込みの状態を返す。
+    
+    戻り値: (status, error)
+        status: "pending" (書き込み待ち) / "saved" (書き込み済み) / "failed" (失敗)
+        error : 失敗した場合のエラーメッセージ (それ以外は None)
+    
+    "saved" になるまでは保存先にないので、QRコードを印刷・配布しないこと。
+    """
+    get_backend()
+    return get_backend_holder().write_status(story_id)
+
+def retry_save(story_id):
+    """
+    書き込みに失敗したストーリーを、もう一度書き込み待ちに戻す。戻せた場合は True。
+    """
+    get_backend()
+    return get_backend_holder().retry_write(story_id)
+
+# -----------------------------------------------------------------
+#  変更履歴
+# -----------------------------------------------------------------
+
+def list_revisions(story_id):
+    """
+    ストーリーの変更履歴の一覧を新しい順に返す。
+    (変更履歴は上書き保存した時だけ記録されるので、一度も上書きしていない場合は空。
+    書き込み待ちの版は、保存先に書き込まれてから一覧に出る)
+    
+    戻り値: dict のリスト
+        revision  : 版の番号 (restore_revision に渡す)
+        created_at: 記録した日時
+        title     : その版のタイトル
+        chars     : その版の本文の文字数
+    """
+    with metrics.timed("storage.get_revisions") as span:
+        existing = get_backend().get_revisions(story_id)
+        span.size = len(existing)
+    return [
+        {
+            "revision": revision["revision"],
+            "created_at": revision["created_at"],
+            "title": content["title"],
+            "chars": len(content["body"]),
+        }
+        for revision, content in reversed(revisions.replay(existing))
+    ]
+
+def get_revision(story_id, revision):
+    """
+    ストーリーの revision 版の内容 (story_id, title, body, chat_history, history_summary) を返す。
+    見つからない場合は None。
+    """
+    with metrics.timed("storage.get_revisions") as span:
+        existing = get_backend().get_revisions(story_id)
+        span.size = len(existing)
+    content = revisions.rebuild(existing, revision)
+    if content is None:
+        return None
+    return dict(content, story_id=story_id)
+
+def restore_revision(story_id, revision):
+    """
+    ストーリーを revision 版の内容で上書き保存する (復元も1つの版として変更履歴に残るので、元に戻せる)。
+    
+    戻り値:
+        dict: 復元した版の内容 (get_revision と同じ形)。失敗した場合は None
+    """
+    content = get_revision(story_id, revision)
+    if content is None:
+        st.error(f"ID ({story_id}) の第{revision}版が見つかりませんでした。")
+        return None
+    if not update_story(
+        story_id, content["title"], content["body"], content["chat_history"], content["history_summary"]
+    ):
+        return None
+    return content
+
+# -----------------------------------------------------------------
+#  静的な HTML の書き出し状況 (static_export.py)
+# -----------------------------------------------------------------
+
+# 配信中の manifest.json を読み直す間隔 (秒)
+EXPORTED_IDS_TTL = 60
+
+@st.cache_data(ttl=EXPORTED_IDS_TTL, show_spinner=False)
+def get_exported_story_ids(static_base_url):
+    """
+    static_base_url で配信している、書き出し済みのストーリーの story_id の集合を返す。
+    QRコードはこの中のストーリーだけを静的な HTML に向ける (qr_codes.story_url の exported_ids)。
+    """
+    if not static_base_url:
+        return frozenset()
+    from static_export import load_exported_ids # QRコードを作る時だけ読み込む
+    return frozenset(load_exported_ids(static_base_url))
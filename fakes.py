@@ -0,0 +1,371 @@
+# fakes.py
+#
+# テストやベンチマークで外部サービスの代わりに使う偽物 (フェイク) の実装。
+# ネットワークやAPIキーなしでアプリの動作や応答速度を確認するために使う。
+
+import json
+import re
+import threading
+import time
+
+# 偽物のストーリーテラーが返す、本物と同じ出力形式のテキスト
+FAKE_STORY_TEXT = """## 朝露とともに育つ、まっすぐなトマト
+
+夜明け前の畑に、今日も足を運びます。
+「手間はかかるけど、子どもたちが笑って食べてくれたらそれでいいんです」
+
+---
+
+# Metacognition & Evaluation
+1. 想いが反映されている
+"""
+
+# 構造化出力 (JSON) の場合に偽物のストーリーテラーが返すテキスト
+FAKE_STORY_JSON = json.dumps({
+    "title": "朝露とともに育つ、まっすぐなトマト",
+    "body": "夜明け前の畑に、今日も足を運びます。\n「手間はかかるけど、子どもたちが笑って食べてくれたらそれでいいんです」",
+    "analysis": "Who: 朝四時から収穫する農家 / Target: 子育て中の家庭 / トーン: 温かみ",
+}, ensure_ascii=False)
+
+
+class FakeUsage:
+    """
+    レスポンスの usage_metadata の代わり。出力トークン数は文字数で代用する。
+    """
+
+    def __init__(self, candidates_token_count):
+        self.candidates_token_count = candidates_token_count
+
+
+class FakeChunk:
+    """
+    generate_content() のレスポンス (またはストリーミング時のチャンク) の代わり。
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = FakeUsage(len(text))
+
+
+class FakeGenerativeModel:
+    """
+    google.generativeai.GenerativeModel の代わりになる偽物のモデル。
+
+    引数:
+        response_text (str): 毎回返す応答テキスト
+        first_token_latency (float): 最初のチャンクが届くまでの待ち時間 (秒)
+        chunk_latency (float): 2つ目以降のチャンクごとの待ち時間 (秒)
+        chunk_size (int): 1チャンクあたりの文字数
+    """
+
+    def __init__(self, response_text="うんうん、なるほど！ もう少し詳しく教えてください。",
+                 first_token_latency=0.0, chunk_latency=0.0, chunk_size=8):
+        self.response_text = response_text
+        self.first_token_latency = first_token_latency
+        self.chunk_latency = chunk_latency
+        self.chunk_size = chunk_size
+        self.prompts = [] # 受け取ったプロンプト (テストでの確認用)
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.prompts.append(prompt)
+        if stream:
+            return self._stream()
+
+        time.sleep(self.first_token_latency + self.chunk_latency * (len(self._chunks()) - 1))
+        return FakeChunk(self.response_text)
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history)
+
+    def _chunks(self):
+        text = self.response_text
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+
+    def _stream(self):
+        for i, text in enumerate(self._chunks()):
+            time.sleep(self.first_token_latency if i == 0 else self.chunk_latency)
+            yield FakeChunk(text)
+
+
+class FakeChatSession:
+    """
+    google.generativeai.ChatSession の代わり。
+    送ったメッセージと応答を history (role は "user" / "model") に積んでいく。
+    """
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        self.history.append({"role": "user", "parts": [content]})
+        response = self.model.generate_content(content, stream=stream)
+        if not stream:
+            self.history.append({"role": "model", "parts": [response.text]})
+            return response
+        return self._record(response)
+
+    def _record(self, chunks):
+        # 本物と同じく、ストリーミングの応答を最後まで読み切った時点で履歴に追加する
+        texts = []
+        for chunk in chunks:
+            texts.append(chunk.text)
+            yield chunk
+        self.history.append({"role": "model", "parts": ["".join(texts)]})
+
+
+def fake_models(first_token_latency=0.0, chunk_latency=0.0, story_format="text"):
+    """
+    ページで使う役割ごとのモデル (create_new_story.py の load_models() と同じ形) の偽物を返す。
+    story_format="json" の場合、ストーリーテラーは構造化出力 (JSON) を返す。
+    """
+    latency = {"first_token_latency": first_token_latency, "chunk_latency": chunk_latency}
+    return {
+        "interviewer": FakeGenerativeModel(**latency),
+        "storyteller": FakeGenerativeModel(FAKE_STORY_JSON if story_format == "json" else FAKE_STORY_TEXT, **latency),
+        "summarizer": FakeGenerativeModel("- 商品: トマト\n- こだわり: 朝の収穫", **latency),
+    }
+
+# -----------------------------------------------------------------
+#  Google Sheets (gspread)
+# -----------------------------------------------------------------
+
+class FakeCell:
+    """
+    gspread.Cell の代わり (acell() / find() の戻り値)。
+    """
+
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+def _column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
+
+
+def _column_letters(number):
+    letters = ""
+    while number > 0:
+        number, rem = divmod(number - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+class FakeWorksheet:
+    """
+    gspread.Worksheet の代わりになる、メモリ上のワークシート。
+    storage.SheetsBackend が使うメソッドだけを実装している。
+
+    API の呼び出し1回ごとに latency 秒待ち、calls に呼び出し回数をメソッド名ごとに数える。
+    セルの値は Google Sheets と同じく文字列で持ち、読み込み時は行末・末尾の空セルを返さない。
+    """
+
+    def __init__(self, spreadsheet, title, latency=0.0):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.latency = latency
+        self.rows = [] # 1行目 (ヘッダー) から順に、文字列のリスト
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        self.spreadsheet.count_call(name)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _set_cell(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = "" if value is None else str(value)
+
+    def read_range(self, a1):
+        """
+        "A2:B" や "A5" のような範囲の値 (2次元リスト) を返す (API の呼び出しとしては数えない)。
+        """
+        match = re.fullmatch(r"([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?", a1)
+        start_col = _column_number(match.group(1))
+        start_row = int(match.group(2) or 1)
+        end_col = _column_number(match.group(3) or match.group(1))
+        end_row = int(match.group(4)) if match.group(4) else (start_row if match.group(3) is None else len(self.rows))
+
+        with self._lock:
+            values = []
+            for cells in self.rows[start_row - 1:end_row]:
+                row = [str(value) for value in cells[start_col - 1:end_col]]
+                while row and row[-1] == "":
+                    row.pop()
+                values.append(row)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def row_values(self, row):
+        self._call("row_values")
+        with self._lock:
+            values = list(self.rows[row - 1]) if row <= len(self.rows) else []
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def col_values(self, col):
+        self._call("col_values")
+        with self._lock:
+            values = [cells[col - 1] if len(cells) >= col else "" for cells in self.rows]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def acell(self, label):
+        self._call("acell")
+        values = self.read_range(label)
+        match = re.fullmatch(r"([A-Z]+)(\d+)", label)
+        return FakeCell(int(match.group(2)), _column_number(match.group(1)), values[0][0] if values and values[0] else "")
+
+    def get_all_records(self):
+        self._call("get_all_records")
+        with self._lock:
+            if not self.rows:
+                return []
+            header = self.rows[0]
+            return [
+                {key: (cells[i] if i < len(cells) else "") for i, key in enumerate(header)}
+                for cells in self.rows[1:]
+            ]
+
+    def batch_get(self, ranges):
+        self._call("batch_get")
+        return [self.read_range(a1) for a1 in ranges]
+
+    def update(self, range_name, values):
+        self._call("update")
+        self._write(range_name, values)
+
+    def batch_update(self, data):
+        self._call("batch_update")
+        for item in data:
+            self._write(item["range"], item["values"])
+
+    def _write(self, range_name, values):
+        match = re.fullmatch(r"([A-Z]+)(\d+)(?::[A-Z]+\d*)?", range_name)
+        start_col = _column_number(match.group(1))
+        start_row = int(match.group(2))
+        with self._lock:
+            for i, row in enumerate(values):
+                for j, value in enumerate(row):
+                    self._set_cell(start_row + i, start_col + j, value)
+
+    def append_row(self, values, **kwargs):
+        self._call("append_row")
+        return self._append([values])
+
+    def append_rows(self, values, **kwargs):
+        self._call("append_rows")
+        return self._append(values)
+
+    def _append(self, rows):
+        with self._lock:
+            # 値の入っている最後の行の次に追加する (途中の空行は埋めない)
+            last = len(self.rows)
+            while last > 0 and not any(self.rows[last - 1]):
+                last -= 1
+            del self.rows[last:]
+            first = len(self.rows) + 1
+            for values in rows:
+                self.rows.append(["" if value is None else str(value) for value in values])
+        width = max([1] + [len(values) for values in rows])
+        updated_range = f"'{self.title}'!A{first}:{_column_letters(width)}{first + len(rows) - 1}"
+        return {"updates": {"updatedRange": updated_range, "updatedRows": len(rows)}}
+
+    def find(self, query, in_column=None):
+        self._call("find")
+        with self._lock:
+            for i, cells in enumerate(self.rows):
+                for j, value in enumerate(cells):
+                    if value == str(query) and (in_column is None or in_column == j + 1):
+                        return FakeCell(i + 1, j + 1, value)
+        return None
+
+
+class FakeSpreadsheet:
+    """
+    gspread.Spreadsheet の代わり。最初のワークシート (sheet1) と、追加したワークシートを持つ。
+    calls には全ワークシートの API 呼び出し回数を数える。
+    """
+
+    def __init__(self, latency=0.0):
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+        self._worksheets = [FakeWorksheet(self, "シート1", latency)]
+
+    @property
+    def sheet1(self):
+        return self._worksheets[0]
+
+    def set_latency(self, latency):
+        for ws in self._worksheets:
+            ws.latency = latency
+
+    def count_call(self, name):
+        with self._calls_lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def reset_calls(self):
+        with self._calls_lock:
+            self.calls = {}
+
+    def worksheets(self):
+        self.count_call("worksheets")
+        return list(self._worksheets)
+
+    def worksheet(self, title):
+        self.count_call("worksheet")
+        for ws in self._worksheets:
+            if ws.title == title:
+                return ws
+        raise KeyError(title)
+
+    def add_worksheet(self, title, rows=1000, cols=26):
+        self.count_call("add_worksheet")
+        ws = FakeWorksheet(self, title, self.sheet1.latency)
+        self._worksheets.append(ws)
+        return ws
+
+    def values_batch_get(self, ranges):
+        self.count_call("values_batch_get")
+        if self.sheet1.latency:
+            time.sleep(self.sheet1.latency)
+        value_ranges = []
+        for a1 in ranges:
+            title, cells = a1.rsplit("!", 1)
+            title = title[1:-1].replace("''", "'") if title.startswith("'") else title
+            ws = next(ws for ws in self._worksheets if ws.title == title)
+            value_ranges.append({"range": a1, "values": ws.read_range(cells)})
+        return {"valueRanges": value_ranges}
+
+
+# プロセス内で共有する偽物のスプレッドシート (名前ごと)。
+# ベンチマークで先にデータを入れておき、アプリ側 (database.get_backend) からも同じものを使う
+_spreadsheets = {}
+_spreadsheets_lock = threading.Lock()
+
+
+def fake_spreadsheet(name):
+    """
+    指定した名前の偽物のスプレッドシートを返す。なければ空のものを作る。
+    """
+    with _spreadsheets_lock:
+        if name not in _spreadsheets:
+            _spreadsheets[name] = FakeSpreadsheet()
+        return _spreadsheets[name]
+
+
+def reset_fake_spreadsheets():
+    with _spreadsheets_lock:
+        _spreadsheets.clear()
@@ -0,0 +1,127 @@
+# generation_cache.py
+#
+# AIの生成結果のキャッシュ。
+# 同じヒアリング内容 (メッセージ一覧) ・プロンプトのバージョン・モデル名からの生成は
+# 結果が使い回せるので、入力のハッシュをキーにしてディスク (SQLite) に保存する。
+# プロセスを再起動しても残り、古いもの (TTL切れ) と使われていないもの (LRU) から削除する。
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# キャッシュに残す最大件数 (超えたら最後に使われたのが古いものから削除)
+DEFAULT_MAX_ENTRIES = 1000
+
+# キャッシュの有効期間 (秒)
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def normalize_messages(messages):
+    """
+    キーの計算に使うため、メッセージ一覧から表示に影響しない違い (改行コード、前後の空白) を取り除く。
+    """
+    return [
+        {
+            "role": str(m.get("role", "")),
+            "content": str(m.get("content", "")).replace("\r\n", "\n").strip(),
+        }
+        for m in messages
+    ]
+
+
+def make_key(kind, messages, prompt_version, model_name):
+    """
+    生成の種類 (例: "storyteller")・メッセージ一覧・プロンプトのバージョン・モデル名から
+    キャッシュのキー (SHA-256 の16進文字列) を作る。
+    """
+    payload = json.dumps(
+        {
+            "kind": kind,
+            "messages": normalize_messages(messages),
+            "prompt_version": prompt_version,
+            "model": model_name,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """
+    SQLite ファイルに保存する、LRU + TTL の生成結果キャッシュ。
+    ヒット数・ミス数 (このプロセスで数えたもの) は hits / misses で参照できる。
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS generations (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used_at)"
+            )
+
+    def get(self, key):
+        """
+        キーに対応する生成結果を返す。ない場合・期限切れの場合は None。
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE generations SET last_used_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        """
+        生成結果を保存し、期限切れのものと上限を超えた分を削除する。
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO generations (key, value, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._conn.execute("DELETE FROM generations WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                """
+                DELETE FROM generations WHERE key IN (
+                    SELECT key FROM generations ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def stats(self):
+        """
+        ヒット数・ミス数・保存件数を dict で返す。
+        """
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
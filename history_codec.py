@@ -0,0 +1,56 @@
+# history_codec.py
+#
+# chat_history (会話履歴の JSON 文字列) を保存するときの形式。
+#   - 保存形式 v1: "zb64v1:" + base64(zlib(UTF-8 の JSON))
+#   - 旧形式     : JSON 文字列をそのまま保存したもの (読み込みのみ対応)
+# Google Sheets のセルは 50,000 文字までなので、長い場合は複数のセルに分けて保存する。
+
+import base64
+import zlib
+
+# 保存形式 v1 の先頭に付ける目印
+PREFIX_V1 = "zb64v1:"
+
+# 1セルに書き込む最大文字数 (Google Sheets の上限 50,000 文字より少し小さくする)
+CELL_LIMIT = 49000
+
+
+def encode_history(chat_history):
+    """
+    会話履歴の JSON 文字列を保存形式 v1 の文字列にする。空の場合は空文字列のまま。
+    """
+    if not chat_history:
+        return ""
+    compressed = zlib.compress(str(chat_history).encode("utf-8"), 9)
+    return PREFIX_V1 + base64.b64encode(compressed).decode("ascii")
+
+
+def decode_history(stored):
+    """
+    保存されていた文字列を会話履歴の JSON 文字列に戻す。
+    保存形式 v1 でない場合 (旧形式の JSON など) はそのまま返す。
+    """
+    if not stored or not stored.startswith(PREFIX_V1):
+        return stored
+    compressed = base64.b64decode(stored[len(PREFIX_V1):])
+    return zlib.decompress(compressed).decode("utf-8")
+
+
+def split_cells(encoded, cell_count, limit=CELL_LIMIT):
+    """
+    保存形式の文字列を limit 文字ずつ cell_count 個のセルに分ける (余ったセルは空文字列)。
+    cell_count 個に収まらない場合は ValueError。
+    """
+    cells = [encoded[i:i + limit] for i in range(0, len(encoded), limit)] or [""]
+    if len(cells) > cell_count:
+        raise ValueError(
+            f"会話履歴が長すぎて保存できません (圧縮後 {len(encoded)} 文字, 上限 {cell_count * limit} 文字)"
+        )
+    return cells + [""] * (cell_count - len(cells))
+
+
+def join_cells(cells):
+    """
+    split_cells() で分けたセルの値をつなげて、decode_history() に渡せる文字列に戻す。
+    """
+    return "".join(str(cell) for cell in cells if cell)
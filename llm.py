@@ -0,0 +1,409 @@
+# llm.py
+#
+# Gemini (google.generativeai) の呼び出しまわりの共通処理。
+
+import datetime
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from prompts import MODEL_NAME, STORY_REPAIR_PROMPT, STORY_RESPONSE_SCHEMA
+
+
+def stream_generate(model, prompt, timings):
+    """
+    model.generate_content(prompt, stream=True) を呼び出し、届いたテキストを順に返すジェネレーター。
+    st.write_stream() にそのまま渡せる。
+
+    timings (dict) には計測結果を書き込む:
+        "ttft" : 最初のテキストが届くまでの秒数 (time to first token)
+        "total": 最後のテキストが届くまでの秒数
+    """
+    start = time.perf_counter()
+    response = model.generate_content(prompt, stream=True)
+    yield from _stream_text(response, start, timings)
+
+
+def stream_chat(chat, message, timings):
+    """
+    stream_generate() の ChatSession 版。chat.send_message(message, stream=True) の応答を順に返す。
+    最後まで読み切ると、応答が chat の履歴に追加される。
+    """
+    start = time.perf_counter()
+    response = chat.send_message(message, stream=True)
+    yield from _stream_text(response, start, timings)
+
+
+def _stream_text(response, start, timings):
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # 最後のチャンクなど、テキストを含まないチャンクは .text が例外になる
+            continue
+        if not text:
+            continue
+        if "ttft" not in timings:
+            timings["ttft"] = time.perf_counter() - start
+        yield text
+
+    timings["total"] = time.perf_counter() - start
+
+
+def format_timings(timings):
+    """
+    計測結果を画面表示用の文字列にする。
+    """
+    parts = []
+    if "ttft" in timings:
+        parts.append(f"最初の応答まで {timings['ttft']:.2f}秒")
+    if "total" in timings:
+        parts.append(f"応答完了まで {timings['total']:.2f}秒")
+    return " / ".join(parts)
+
+
+# -----------------------------------------------------------------
+#  ストーリー生成 (F-002)
+# -----------------------------------------------------------------
+
+# 一度に作るストーリー案の上限
+MAX_CANDIDATES = 4
+
+# ストーリーテラーの出力形式 (secrets の STORY_OUTPUT_FORMAT で選ぶ)
+#   "json": 構造化出力 (response_schema で title / body / analysis の JSON に限定する)
+#   "text": 以前の Markdown 形式 ("## タイトル" + 本文 + 自己評価)
+STORY_FORMAT_JSON = "json"
+STORY_FORMAT_TEXT = "text"
+DEFAULT_STORY_FORMAT = STORY_FORMAT_JSON
+
+# 構造化出力用のモデルの設定 (create_role_model の generation_config に渡す)
+STORY_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": STORY_RESPONSE_SCHEMA,
+}
+
+# 構造化出力の前後に付くことがあるコードブロックの記号 (```json ... ```)
+_CODE_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def parse_story(raw_story_text):
+    """
+    ストーリーテラーの出力 ("## タイトル" + 本文 + "---" 以降は自己評価) から
+    タイトルと本文を取り出して (title, body) を返す。解析できない場合は None。
+    """
+    match = re.search(r'##\s*(.*?)\n(.*?)(?:\n---|# Metacognition|$)', raw_story_text, flags=re.DOTALL)
+
+    # 万が一単純な検索で失敗した場合のバックアップロジック
+    if not match:
+        match = re.search(r'##\s*(.*?)\n(.*)', raw_story_text, re.DOTALL)
+
+    if not match:
+        return None
+
+    # Markdownの太字などを除去（念のため）
+    title = match.group(1).strip().replace("**", "")
+    body = match.group(2).strip()
+    return title, body
+
+
+def parse_story_json(raw_story_text):
+    """
+    構造化出力 (title / body / analysis の JSON) を検証して (title, body, analysis) を返す。
+    JSON として読めない場合、title か body が空の場合は None (analysis はなければ "")。
+    """
+    try:
+        data = json.loads(raw_story_text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    title, body, analysis = data.get("title"), data.get("body"), data.get("analysis")
+    if not isinstance(title, str) or not isinstance(body, str):
+        return None
+    title = title.strip().lstrip("#").strip().replace("**", "")
+    body = body.strip()
+    if not title or not body:
+        return None
+    return title, body, analysis.strip() if isinstance(analysis, str) else ""
+
+
+def salvage_story_json(raw_story_text):
+    """
+    そのままでは parse_story_json() で読めない出力から、AIを呼ばずに取り出せる分を取り出す。
+    (コードブロックの記号や前後の説明文を除いた JSON、または Markdown 形式で書かれてしまった場合)
+    取り出せない場合は None。
+    """
+    text = _CODE_FENCE.sub("", raw_story_text or "")
+    start, end = text.find("{"), text.rfind("}")
+    if 0 <= start < end:
+        parsed = parse_story_json(text[start:end + 1])
+        if parsed:
+            return parsed
+    parsed = parse_story(text) if text.lstrip().startswith("##") else None
+    return (parsed[0], parsed[1], "") if parsed else None
+
+
+def _story_json_error(raw_story_text):
+    # 形式を直してもらう時に伝える、読めなかった理由
+    try:
+        data = json.loads(raw_story_text)
+    except (TypeError, ValueError) as e:
+        return f"JSON として読めません ({e})"
+    if not isinstance(data, dict):
+        return "JSON のオブジェクトではありません"
+    missing = [key for key in ("title", "body") if not isinstance(data.get(key), str) or not data[key].strip()]
+    return f"{' と '.join(missing)} がありません" if missing else "形式が正しくありません"
+
+
+def output_tokens(response):
+    """
+    応答の出力トークン数 (usage_metadata.candidates_token_count)。分からない場合は None。
+    """
+    try:
+        return int(response.usage_metadata.candidates_token_count)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def generate_story(model, prompt, story_format=DEFAULT_STORY_FORMAT):
+    """
+    ストーリーを1件生成して解析する。
+
+    構造化出力 (story_format="json") で読めなかった場合は、まず AI を呼ばずに取り出せる分を取り出し、
+    それでもだめなら1回だけ、読めなかった出力と理由を渡して形式だけを直してもらう
+    (チャット履歴から作り直すより、入力が短く、分析もしないので速い)。
+
+    出力トークン数と解析の成否は、所要時間とは別の値として metrics に出力形式ごとに記録する。
+    1回目の生成と形式の直しは分けて記録する (直しの回数は .repair の回数):
+        llm.storyteller.<形式>.output_tokens / .parse_failed (失敗なら 1、成功なら 0)
+        llm.storyteller.<形式>.repair.output_tokens / .repair_failed
+
+    戻り値: dict
+        "raw"     : 解析したテキスト (形式を直してもらった場合は直した後のもの。キャッシュにはこれを保存する)
+        "title", "body", "analysis": 解析結果 (解析できなかった場合は None)
+        "repaired": 形式を直して読めた場合は True
+        "error"   : 解析できなかった場合のエラーメッセージ (成功した場合は None)
+    """
+    op = f"llm.storyteller.{story_format}"
+    response = model.generate_content(prompt)
+    raw = response.text
+    parsed = _parse(raw, story_format)
+    repaired = False
+    _record_output(op, response, parsed)
+
+    if parsed is None and story_format == STORY_FORMAT_JSON:
+        with metrics.timed(f"{op}.repair"):
+            repair = model.generate_content(STORY_REPAIR_PROMPT.format(error=_story_json_error(raw), raw=raw))
+        parsed = _parse(repair.text, story_format)
+        if parsed is not None:
+            raw, repaired = repair.text, True
+        _record_output(f"{op}.repair", repair, parsed, failed_op=f"{op}.repair_failed")
+
+    return _story_result(raw, parsed, repaired)
+
+
+def _record_output(op, response, parsed, failed_op=None):
+    # 出力トークン数 (分からない場合は記録しない) と、解析できなかったかどうか (0/1) を記録する
+    tokens = output_tokens(response)
+    if tokens is not None:
+        metrics.record_value(f"{op}.output_tokens", tokens)
+    metrics.record_value(failed_op or f"{op}.parse_failed", 0 if parsed else 1)
+
+
+def parse_output(raw_story_text, story_format=DEFAULT_STORY_FORMAT):
+    """
+    保存しておいた生成結果 (generate_story() の "raw") を解析し、generate_story() と同じ形の dict を返す。
+    """
+    return _story_result(raw_story_text, _parse(raw_story_text, story_format), False)
+
+
+def _parse(raw_story_text, story_format):
+    # (title, body, analysis) か None
+    if story_format == STORY_FORMAT_JSON:
+        return parse_story_json(raw_story_text) or salvage_story_json(raw_story_text)
+    parsed = parse_story(raw_story_text)
+    return parsed + ("",) if parsed else None
+
+
+def _story_result(raw, parsed, repaired):
+    if parsed is None:
+        return {"raw": raw, "title": None, "body": None, "analysis": None, "repaired": False,
+                "error": "AIの出力形式を解析できませんでした。"}
+    title, body, analysis = parsed
+    return {"raw": raw, "title": title, "body": body, "analysis": analysis, "repaired": repaired, "error": None}
+
+
+def generate_candidates(model, prompt, count, story_format=DEFAULT_STORY_FORMAT):
+    """
+    同じプロンプトで count 件のストーリー案を並列に生成する。
+    リクエストは待ち時間がほとんどなので、スレッドで同時に送れば全体の時間は1件分に近くなる。
+
+    戻り値: 案ごとの dict (generate_story() と同じ形) のリスト (生成順ではなく依頼順)
+        失敗した場合は "raw" が "" で、"error" にエラーメッセージが入る
+    """
+    def generate_one(_):
+        try:
+            return generate_story(model, prompt, story_format)
+        except Exception as e:
+            return {"raw": "", "title": None, "body": None, "analysis": None, "repaired": False, "error": str(e)}
+
+    count = max(1, min(count, MAX_CANDIDATES))
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(generate_one, range(count)))
+
+
+# -----------------------------------------------------------------
+#  会話履歴の圧縮 (長いヒアリング用)
+# -----------------------------------------------------------------
+
+# 履歴 (要約 + 直近の会話) がこの目安を超えたら、古い会話を要約にまとめる
+HISTORY_TOKEN_BUDGET = 2000
+
+# 要約せずにそのまま残す直近のメッセージ数 (ユーザーとAIで1往復 = 2件)
+KEEP_RECENT_MESSAGES = 6
+
+SUMMARY_PROMPT = """
+以下は、第一次産業の生産者とAIライターのヒアリングの記録です。
+後でブランドストーリーを書くために必要な情報（商品、こだわり、ターゲット、想い、具体的なエピソード、
+生産者の口癖や印象的な言葉）を落とさずに、箇条書きで簡潔にまとめてください。
+「これまでの要約」がある場合は、その内容に「追加の会話」を反映した新しい要約を出力してください。
+
+[これまでの要約]
+{summary}
+
+[追加の会話]
+{turns}
+"""
+
+
+def estimate_tokens(text):
+    """
+    テキストのトークン数の目安を返す。
+    日本語はおおむね1文字1トークン以下なので、文字数をそのまま上限の目安として使う。
+    """
+    return len(text)
+
+
+def format_history(messages):
+    """
+    メッセージのリストをプロンプトに埋め込む履歴テキストにする。
+    """
+    return "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+
+
+def empty_summary():
+    """
+    まだ何も要約していない状態を返す。
+        "text"   : 要約テキスト
+        "covered": 要約済みのメッセージ数 (messages の先頭からの件数)
+    """
+    return {"text": "", "covered": 0}
+
+
+def load_summary(summary_json, messages):
+    """
+    保存されていた要約 (JSON文字列) を読み込む。
+    読めない場合や、履歴と件数が合わない場合は空の要約を返す (次のターンで作り直される)。
+    """
+    try:
+        summary = json.loads(summary_json) if summary_json else empty_summary()
+        if 0 <= int(summary["covered"]) <= len(messages):
+            return {"text": str(summary["text"]), "covered": int(summary["covered"])}
+    except (ValueError, TypeError, KeyError):
+        pass
+    return empty_summary()
+
+
+def compact_history(model, messages, summary):
+    """
+    要約されていない部分の履歴が HISTORY_TOKEN_BUDGET を超えていれば、
+    直近 KEEP_RECENT_MESSAGES 件を残して古い会話を要約にまとめ、新しい要約を返す。
+    超えていなければ summary をそのまま返す (モデルは呼ばない)。
+    """
+    pending = messages[summary["covered"]:]
+    size = estimate_tokens(summary["text"]) + estimate_tokens(format_history(pending))
+    if size <= HISTORY_TOKEN_BUDGET or len(pending) <= KEEP_RECENT_MESSAGES:
+        return summary
+
+    fold_until = len(messages) - KEEP_RECENT_MESSAGES
+    prompt = SUMMARY_PROMPT.format(
+        summary=summary["text"] or "(なし)",
+        turns=format_history(messages[summary["covered"]:fold_until]),
+    )
+    response = model.generate_content(prompt)
+    return {"text": response.text.strip(), "covered": fold_until}
+
+
+# -----------------------------------------------------------------
+#  モデルとチャットセッション
+# -----------------------------------------------------------------
+
+# 明示的なコンテキストキャッシュ (サーバー側に保存した system_instruction) の有効期間 (秒)
+CONTEXT_CACHE_TTL = 3600
+
+
+def create_role_model(system_instruction, use_context_cache=False, generation_config=None):
+    """
+    役割のプロンプトを system_instruction に設定したモデルを作る。
+    (genai.configure() は呼び出し側で済ませておくこと)
+    generation_config を渡すと、毎回のリクエストにその設定 (構造化出力など) を使う。
+
+    use_context_cache=True の場合は system_instruction をサーバー側にキャッシュし、
+    毎回のリクエストでプロンプト分のトークンを送らないようにする。
+    キャッシュできない場合 (最小トークン数に満たないなど) は通常のモデルを返す。
+    その場合も、先頭が毎回同じなので暗黙的なキャッシュの対象になる。
+    """
+    import google.generativeai as genai
+
+    if use_context_cache:
+        try:
+            from google.generativeai import caching
+            cache = caching.CachedContent.create(
+                model=f"models/{MODEL_NAME}",
+                system_instruction=system_instruction,
+                ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL),
+            )
+            return genai.GenerativeModel.from_cached_content(cached_content=cache, generation_config=generation_config)
+        except Exception:
+            pass
+
+    return genai.GenerativeModel(MODEL_NAME, system_instruction=system_instruction, generation_config=generation_config)
+
+
+def to_chat_history(messages, summary):
+    """
+    メッセージのリストを ChatSession の履歴 (role は "user" / "model") に変換する。
+    要約済みの部分は、要約を伝える1往復に置き換える。
+    """
+    history = []
+    if summary["text"]:
+        history.append({"role": "user", "parts": [f"[これまでの会話の要約]\n{summary['text']}"]})
+        history.append({"role": "model", "parts": ["はい、ここまでのお話は把握しました。続けましょう。"]})
+    for m in messages[summary["covered"]:]:
+        history.append({"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]})
+    return history
+
+
+def interview_chat(model, chat, messages, summary):
+    """
+    messages (今回の入力より前の会話) までの履歴を持つ ChatSession を返す。
+    前回の chat の履歴が一致していればそのまま使い、一致しない場合
+    (初回、ヒアリング再開時、要約が進んだ時、エラーで応答が途中になった時など) は作り直す。
+    """
+    history = to_chat_history(messages, summary)
+    if chat is not None and _history_texts(chat.history) == _history_texts(history):
+        return chat
+    return model.start_chat(history=history)
+
+
+def _history_texts(history):
+    texts = []
+    for content in history:
+        if isinstance(content, dict):
+            texts.append((content["role"], "".join(content["parts"])))
+        else:
+            texts.append((content.role, "".join(part.text for part in content.parts)))
+    return texts
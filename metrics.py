@@ -0,0 +1,245 @@
+# metrics.py
+#
+# 処理ごとの所要時間・データ量・キャッシュのヒット/ミス・エラー数と、時間以外の値 (トークン数など) の分布を記録する
+# 軽量な計測の仕組み。
+# どこが遅いのか (シートへの接続・読み込み・書き込み、AIの生成など) を管理者ページ (pages/metrics.py) で確認し、
+# 必要なら JSON Lines で書き出して手元で分析する。
+#
+# 使い方:
+#   with metrics.timed("storage.append_record") as span:
+#       ...
+#       span.size = len(text)          # データ量 (任意)
+#
+#   @metrics.instrument("db.connect")
+#   def connect_to_db(): ...
+#
+#   metrics.record_cache("generation_cache", hit=True)
+#
+#   metrics.record_value("llm.storyteller.json.output_tokens", 812)   # 時間以外の値 (所要時間には数えない)
+#
+# 記録はプロセス内 (Streamlit の全セッション共通) のメモリに、処理ごとに直近 MAX_SAMPLES 件まで残す。
+
+import bisect
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# 処理ごとに残す直近の計測結果の件数 (パーセンタイルの計算と JSON Lines の書き出しに使う)
+MAX_SAMPLES = 5000
+
+# 所要時間のヒストグラムの区切り (ミリ秒)。最後の区切りより遅いものは "+Inf" に数える
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+# 時間以外の値 (record_value) のヒストグラムの区切り。最後の区切りより大きいものは "+Inf" に数える
+# (0/1 で記録した失敗は "<= 0" と "<= 1" に分かれる)
+VALUE_BUCKETS = [0, 1, 10, 100, 250, 500, 1000, 2000, 4000, 8000, 16000]
+
+
+class Span:
+    """
+    timed() の with ブロックで受け取る、1回分の計測。size にデータ量を入れておくと一緒に記録される。
+    """
+
+    def __init__(self, op):
+        self.op = op
+        self.size = None
+
+
+class _OpStats:
+    # 処理1種類分の集計
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.samples = deque(maxlen=MAX_SAMPLES) # {"ts", "ms", "size", "error"}
+        self.value_count = 0
+        self.value_total = 0
+        self.value_buckets = [0] * (len(VALUE_BUCKETS) + 1)
+        self.value_samples = deque(maxlen=MAX_SAMPLES) # {"ts", "value"}
+
+
+class Metrics:
+    """
+    処理名ごとの計測結果の置き場所。スレッドセーフ。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def _get(self, op):
+        stats = self._ops.get(op)
+        if stats is None:
+            stats = self._ops[op] = _OpStats()
+        return stats
+
+    def observe(self, op, seconds, size=None, error=None):
+        """
+        1回分の所要時間 (秒)・データ量・エラー (あれば例外のクラス名) を記録する。
+        """
+        ms = seconds * 1000
+        with self._lock:
+            stats = self._get(op)
+            stats.count += 1
+            stats.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+            if size is not None:
+                stats.total_size += size
+            if error is not None:
+                stats.errors += 1
+            stats.samples.append({"ts": time.time(), "ms": round(ms, 3), "size": size, "error": error})
+
+    def record_cache(self, op, hit):
+        """
+        キャッシュのヒット/ミスを数える。
+        """
+        with self._lock:
+            stats = self._get(op)
+            if hit:
+                stats.hits += 1
+            else:
+                stats.misses += 1
+
+    def record_value(self, op, value):
+        """
+        時間以外の値 (出力トークン数、失敗なら 1・成功なら 0 など) を1件記録する。
+        所要時間とは別に集計するので、op の所要時間のパーセンタイルには影響しない。
+        """
+        with self._lock:
+            stats = self._get(op)
+            stats.value_count += 1
+            stats.value_total += value
+            stats.value_buckets[bisect.bisect_left(VALUE_BUCKETS, value)] += 1
+            stats.value_samples.append({"ts": time.time(), "value": value})
+
+    @contextmanager
+    def timed(self, op):
+        """
+        with ブロックの所要時間を op の名前で記録する。例外が出た場合はエラーとして数えてそのまま投げ直す。
+        """
+        span = Span(op)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            self.observe(op, time.perf_counter() - start, span.size, type(e).__name__)
+            raise
+        self.observe(op, time.perf_counter() - start, span.size)
+
+    def instrument(self, op, size_of=None):
+        """
+        関数の呼び出しを op の名前で記録するデコレーター。
+        size_of を渡すと、戻り値からデータ量を計算して一緒に記録する。
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.timed(op) as span:
+                    result = fn(*args, **kwargs)
+                    if size_of is not None:
+                        span.size = size_of(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """
+        処理ごとの集計 (件数、エラー数、p50/p95/p99/最大 (ミリ秒)、データ量の合計、キャッシュのヒット/ミス、
+        record_value の件数・平均・p50/p95) のリスト。パーセンタイルは直近 MAX_SAMPLES 件から計算する。
+        """
+        rows = []
+        with self._lock:
+            for op, stats in sorted(self._ops.items()):
+                latencies = sorted(sample["ms"] for sample in stats.samples)
+                values = sorted(sample["value"] for sample in stats.value_samples)
+                rows.append({
+                    "op": op,
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "p50_ms": _percentile(latencies, 50),
+                    "p95_ms": _percentile(latencies, 95),
+                    "p99_ms": _percentile(latencies, 99),
+                    "max_ms": latencies[-1] if latencies else None,
+                    "total_size": stats.total_size,
+                    "cache_hits": stats.hits,
+                    "cache_misses": stats.misses,
+                    "value_count": stats.value_count,
+                    "value_mean": stats.value_total / stats.value_count if stats.value_count else None,
+                    "value_p50": _percentile(values, 50),
+                    "value_p95": _percentile(values, 95),
+                })
+        return rows
+
+    def histogram(self, op):
+        """
+        op の所要時間のヒストグラム ([(区切りのラベル, 件数), ...])。
+        """
+        with self._lock:
+            stats = self._ops.get(op)
+            counts = list(stats.buckets) if stats else [0] * (len(BUCKETS_MS) + 1)
+        labels = [f"<= {ms}ms" for ms in BUCKETS_MS] + ["+Inf"]
+        return list(zip(labels, counts))
+
+    def value_histogram(self, op):
+        """
+        op の record_value の値のヒストグラム ([(区切りのラベル, 件数), ...])。
+        """
+        with self._lock:
+            stats = self._ops.get(op)
+            counts = list(stats.value_buckets) if stats else [0] * (len(VALUE_BUCKETS) + 1)
+        labels = [f"<= {value}" for value in VALUE_BUCKETS] + ["+Inf"]
+        return list(zip(labels, counts))
+
+    def to_jsonl(self):
+        """
+        残っている計測結果を1件1行の JSON Lines にする。
+        """
+        with self._lock:
+            lines = [
+                json.dumps(dict(sample, op=op, ts=datetime.fromtimestamp(sample["ts"]).isoformat()), ensure_ascii=False)
+                for op, stats in sorted(self._ops.items())
+                for sample in list(stats.samples) + list(stats.value_samples)
+            ]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def dump_jsonl(self, path):
+        """
+        計測結果を JSON Lines としてファイルに追記し、書き出した行数を返す。
+        """
+        text = self.to_jsonl()
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+        return text.count("\n")
+
+    def reset(self):
+        with self._lock:
+            self._ops = {}
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# プロセス内で共有する計測結果 (Streamlit の全セッションで共有される)
+registry = Metrics()
+
+timed = registry.timed
+instrument = registry.instrument
+observe = registry.observe
+record_cache = registry.record_cache
+record_value = registry.record_value
+summary = registry.summary
+histogram = registry.histogram
+value_histogram = registry.value_histogram
+to_jsonl = registry.to_jsonl
+dump_jsonl = registry.dump_jsonl
+reset = registry.reset
@@ -1,24 +1,80 @@
 # pages/create_new_story.py (修正版)
 
 import streamlit as st
-import google.generativeai as genai
-import qrcode
-from io import BytesIO
+# google.generativeai は AI を最初に使う時に読み込む (load_models)
 import database  # 作成した database.py をインポート
+import llm
+from prompts import INTERVIEWER_PROMPT, STORYTELLER_PROMPT, STORYTELLER_JSON_PROMPT, MODEL_NAME, PROMPT_VERSION
+from generation_cache import GenerationCache, make_key
+import qr_codes
+import metrics
 import json
-import re
+import time
 
 # -----------------------------------------------------------------
 #  APIキー設定 (Gemini)
 # -----------------------------------------------------------------
-try:
+@st.cache_resource(ttl=3000) # モデルは全セッションで共有する (コンテキストキャッシュの有効期限より前に作り直す)
+def load_models():
+    """
+    役割ごとのモデルを作成して返す。
+    インタビュアーとストーリーテラーの役割のプロンプトは system_instruction として一度だけ設定し、
+    毎回のリクエストにプロンプトを埋め込まないようにする。
+    ストーリーテラーは、出力形式 (get_story_format) が "json" の場合は構造化出力のモデルにする。
+    """
+    story_format = get_story_format()
+    if st.secrets.get("USE_FAKE_MODEL", False):
+        # テスト・ベンチマーク用: APIを呼ばない偽物のモデルを使う (本番では読み込まない)
+        from fakes import fake_models
+        return fake_models(
+            first_token_latency=st.secrets.get("FAKE_MODEL_FIRST_TOKEN_LATENCY", 0.0),
+            chunk_latency=st.secrets.get("FAKE_MODEL_CHUNK_LATENCY", 0.0),
+            story_format=story_format,
+        )
+
+    import google.generativeai as genai
+    
     # 通信方式は rest のままでOK
     genai.configure(api_key=st.secrets["GOOGLE_API_KEY"], transport='rest')
 
-    model = genai.GenerativeModel('gemini-2.5-flash')
-except Exception as e:
-    st.error("Google AI APIキーが設定されていません。st.secretsを確認してください。")
-    st.stop()
+    use_context_cache = st.secrets.get("USE_CONTEXT_CACHE", False)
+    if story_format == llm.STORY_FORMAT_JSON:
+        storyteller = llm.create_role_model(STORYTELLER_JSON_PROMPT, use_context_cache, llm.STORY_GENERATION_CONFIG)
+    else:
+        storyteller = llm.create_role_model(STORYTELLER_PROMPT, use_context_cache)
+    return {
+        "interviewer": llm.create_role_model(INTERVIEWER_PROMPT, use_context_cache),
+        "storyteller": storyteller,
+        "summarizer": genai.GenerativeModel(MODEL_NAME), # 会話の要約用
+    }
+
+def get_story_format():
+    """
+    ストーリーテラーの出力形式 (st.secrets["STORY_OUTPUT_FORMAT"])。
+    "json" (既定): 構造化出力 / "text": 以前の Markdown 形式 (比較用)
+    """
+    return st.secrets.get("STORY_OUTPUT_FORMAT", llm.DEFAULT_STORY_FORMAT)
+
+@st.cache_resource
+def get_generation_cache():
+    """
+    ストーリー生成結果のキャッシュ (ディスク上の SQLite ファイル) を開いて返す。
+    """
+    return GenerationCache(st.secrets.get("GENERATION_CACHE_PATH", "generation_cache.sqlite3"))
+
+def get_models():
+    """
+    役割ごとのモデルを返す。AIを使う操作 (発言・生成) をした時に初めて作成する
+    (続きから再開・保存・QRコードの表示だけならモデルの作成を待たない)。
+    """
+    try:
+        return load_models()
+    except Exception as e:
+        st.error("Google AI APIキーが設定されていません。st.secretsを確認してください。")
+        st.stop()
+
+# 接続・キャッシュの準備とバックグラウンド更新を開始 (プロセスごとに1回だけ。このページから開いた場合のため)
+database.start_background_tasks()
 
 params = st.query_params
 if "resume_id" in params and "messages_loaded" not in st.session_state:
@@ -38,6 +94,8 @@ if "resume_id" in params and "messages_loaded" not in st.session_state:
             st.session_state.final_story_body = story_data.get("body", "")
             st.session_state.chat_history_json = story_data["chat_history"]
             st.session_state.saved_story_id = resume_id # 既存のIDをセット
+            # 保存されていた会話の要約も復元する (再開時に要約し直さないため)
+            st.session_state.history_summary = llm.load_summary(story_data.get("history_summary", ""), loaded_messages)
             
             # (重要) 読み込み完了フラグを立てる (ページリロード時に再読み込みしないため)
             st.session_state.messages_loaded = True 
@@ -66,6 +124,16 @@ if "chat_history_json" not in st.session_state:
     st.session_state.chat_history_json = "" # 保存用の履歴
 if "saved_story_id" not in st.session_state:
     st.session_state.saved_story_id = None # 保存後のID
+if "last_timings" not in st.session_state:
+    st.session_state.last_timings = {} # 直前のAI応答の所要時間
+if "story_candidates" not in st.session_state:
+    st.session_state.story_candidates = [] # 複数案モードで生成したストーリー案
+if "story_parse_failure" not in st.session_state:
+    st.session_state.story_parse_failure = None # 解析できなかった生成結果の生データ (作り直すまで表示する)
+if "history_summary" not in st.session_state:
+    st.session_state.history_summary = llm.empty_summary() # 古い会話の要約 (長いヒアリング用)
+if "story_revisions" not in st.session_state:
+    st.session_state.story_revisions = None # 読み込んだ変更履歴の一覧 (上書き保存するストーリー用)
 
 # -----------------------------------------------------------------
 #  UI (3つのタブ)
@@ -80,10 +148,17 @@ with tab1:
     st.header("AIヒアリング 🎤")
     st.markdown("生産物への「こだわり」や「情熱」をAIに話してみてください。")
 
+    # 応答を届いた分から少しずつ表示するか (オフにすると全文がそろってから表示)
+    stream_mode = st.toggle("AIの応答を少しずつ表示する", value=True)
+
     # 1. チャット履歴の表示
     for msg in st.session_state.messages:
         st.chat_message(msg["role"]).write(msg["content"])
 
+    # 直前のAI応答の所要時間
+    if st.session_state.last_timings:
+        st.caption(llm.format_timings(st.session_state.last_timings))
+
     # 2. ユーザーの入力処理
     if prompt := st.chat_input("あなたの想いをどうぞ..."):
         # A. ユーザーの入力をまずは履歴に追加
@@ -92,77 +167,54 @@ with tab1:
         # B. 画面上でユーザーの入力を一時的に表示
         st.chat_message("user").write(prompt)
 
-        # C. プロンプト作成とAI生成
-        interviewer_prompt = """
-            # Role
-            あなたは、第一次産業（農業・漁業・畜産など）の生産者に寄り添う、親しみやすく聞き上手な「ライター」です。
-            ITに詳しくない高齢の生産者でも、あなたとチャットをするだけで安心して自分の想いを話せるような、温かい人格（孫や親しい若者のような口調）で振る舞ってください。
-
-            # Goal
-            生産者との対話を通じて、商品に込められた「想い」「こだわり」「苦労話」、そして「誰に食べて（使って）ほしいか」を引き出し、後続のストーリー作成AIが魅力的な記事を書くための十分な情報を収集することです。
-
-            # Constraints
-            - **口調**: 敬語は崩しすぎず、かつ親しみを込めて。「〜ですね」「〜なんですか！」など、共感を示す相槌を多用する。専門用語は一切使わない。
-            - **質問の仕方**: 一度に複数の質問をしない。必ず「一問一答」形式で、会話のキャッチボールを行う。
-            - **進行管理**: ユーザーが答えに詰まったら、具体的な例を出して誘導する。
-            - **終了条件**: 必要な情報（商品、こだわり、ターゲット、想い）が揃ったと判断したら、会話を終了し、これまでの内容を要約して確認する。
+        # C. AI生成
+        # (インタビュアーの役割は system_instruction に設定済み。会話は ChatSession で続ける)
+        # 【修正3】チャットにもエラーハンドリング(try-except)を追加
+        models = get_models()
+        try:
+            # 今回の入力より前の会話
+            previous_messages = st.session_state.messages[:-1]
             
-            【重要な禁止事項】
-            回答には見出し記号（# や ## など）を使用しないでください。
-            常に通常のテキストサイズで応答してください。
-
-            # Workflow (Chain of Thought)
-            ステップバイステップで、以下の手順に従って対話を進めてください。
-
-            1.  **アイスブレイク & 商品確認**:
-                - まずは明るく挨拶し、緊張を解く。
-                - 「今回、皆さんに知ってほしい自慢の生産物は何ですか？」と聞く。
-
-            2.  **ターゲットの明確化 (重要)**:
-                - その生産物を「どんな人に」「どんなシチュエーションで」楽しんでほしいかを聞き出す。
-                - 例：「お子さんがいる家庭に安心して食べてほしいですか？それとも、自分へのご褒美として楽しんでほしいですか？」
-
-            3.  **「想い」の深掘り**:
-                - こだわっている点、他との違い、生産する上での苦労や喜びについて聞く。
-                - ユーザーの回答に対し、「それは大変でしたね！」「すごいこだわりですね！」と感情豊かに反応し、さらに「具体的にはどんなことがありましたか？」とエピソードを引き出す。
-
-            4.  **内容の確認と終了**:
-                - ストーリー作成に必要な要素が揃ったら、ヒアリング内容を「〇〇という想いで作られた、△△向けの商品ですね」と優しく要約する。
-                - 「この内容で素敵な紹介文を作りますね」と伝え、会話を締める。
-
-            # Output Example (Tone)
-            - 悪い例: 「ターゲット層を教えてください。また、差別化要因は何ですか？」
-            - 良い例: 「うんうん、なるほど！ すごく手間暇がかかっているんですね。ちなみに、このトマトはどんな方に一番食べてほしいですか？ 例えば、野菜嫌いのお子さんとか、料理好きな方とか…。」
-
-            # Self-Correction
-            回答を出力する前に、以下の点を自己評価してください。
-            - 相手を急かしていないか？
-            - 質問が一度に2つ以上になっていないか？
-            - 相手の回答に対して、十分な共感（リアクション）を示しているか？
-            不備があれば修正し、生産者が話しやすい回答を出力してください。
-
-            # Conversation History
-            [履歴]
-            {chat_history}
-        """
-        
-        history_text = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages])
-        full_prompt = interviewer_prompt.format(chat_history=history_text)
-
-        with st.spinner("AIが応答を考えています..."):
-            # 【修正3】チャットにもエラーハンドリング(try-except)を追加
-            try:
-                response = model.generate_content(full_prompt)
-                ai_response = response.text
-                
-                # D. AIの回答を履歴に追加
-                st.session_state.messages.append({"role": "assistant", "content": ai_response})
-                
-                # E. 画面を再読み込み
-                st.rerun()
-                
-            except Exception as e:
-                st.error(f"AIとの通信でエラーが発生しました。しばらく待ってから再試行してください。\n詳細: {e}")
+            # 履歴が長くなったら古い会話を要約にまとめ、送る履歴の長さを一定に保つ
+            with metrics.timed("llm.compact_history"):
+                st.session_state.history_summary = llm.compact_history(
+                    models["summarizer"], previous_messages, st.session_state.history_summary
+                )
+            
+            # このセッションの ChatSession を使い回す (再開時や要約が進んだ時は履歴から作り直す)
+            chat = llm.interview_chat(
+                models["interviewer"],
+                st.session_state.get("chat_session"),
+                previous_messages,
+                st.session_state.history_summary,
+            )
+            st.session_state.chat_session = chat
+
+            timings = {}
+            with metrics.timed("llm.interviewer") as span:
+                if stream_mode:
+                    # D. AIの回答を届いた分から吹き出しに表示
+                    with st.chat_message("assistant"):
+                        ai_response = st.write_stream(llm.stream_chat(chat, prompt, timings))
+                else:
+                    with st.spinner("AIが応答を考えています..."):
+                        start = time.perf_counter()
+                        response = chat.send_message(prompt)
+                        ai_response = response.text
+                        timings["total"] = time.perf_counter() - start
+                span.size = len(ai_response)
+            if "ttft" in timings:
+                metrics.observe("llm.interviewer.ttft", timings["ttft"])
+            
+            # E. AIの回答 (全文) を履歴に追加
+            st.session_state.messages.append({"role": "assistant", "content": ai_response})
+            st.session_state.last_timings = timings
+            
+            # F. 画面を再読み込み
+            st.rerun()
+            
+        except Exception as e:
+            st.error(f"AIとの通信でエラーが発生しました。しばらく待ってから再試行してください。\n詳細: {e}")
 
 # --- タブ2: ストーリー生成 (F-002) ---
 with tab2:
@@ -171,112 +223,137 @@ with tab2:
     if not st.session_state.messages:
         st.warning("まず「ステップ1: AIヒアリング」でAIと対話してください。")
     else:
-        if st.button("このヒアリング内容からストーリーを生成する"):
-            # プロンプト (変更なし)
-            storyteller_prompt = """
-                # Role
-                あなたは、心を揺さぶる文章を書く「トップブランド・ストーリーテラー」です。
-                提供されたチャット履歴（ヒアリング内容）を元に、消費者がその生産物を手に取りたくなるような、情緒的で魅力的なブランドストーリーを作成してください。
-
-                # Goal
-                生産者の「人柄」や「熱量」が伝わる文章を作成し、QRコードからアクセスした消費者の購買意欲やファン化を促進すること。
-
-                # Information Source
-                以下のチャット履歴から情報を抽出して使用してください。
-                Chat History: {chat_history}
-
-                # Constraints
-                - **ターゲット設定**: チャット履歴内で語られた「ターゲット層」に響くトーン＆マナーで執筆すること。
-                - **構成**: 「キャッチーなタイトル」＋「本文」の構成とする。
-                - **文字数**: スマートフォンで読むことを想定し、本文は400文字〜600文字程度に収める。
-                - **表現**: 説明的な文章ではなく、情景が浮かぶような「物語（ナラティブ）」にする。生産者の話し言葉や口癖を効果的に引用する。
-
-                # Workflow (Chain of Thought)
-                いきなり文章を書き始めず、以下のステップで論理的に構成してください。
-
-                1.  **情報の分析と抽出**:
-                    - `{chat_history}` を読み込み、以下の要素を抽出する。
-                        - **Who**: 誰が（生産者の人柄）
-                        - **What**: 何を（商品の特徴）
-                        - **Target**: 誰に向けて（ターゲット層）
-                        - **Why/Story**: どんな想い・苦労・喜びがあるか（核となるエピソード）
-
-                2.  **トーン＆マナーの決定**:
-                    - 抽出したターゲット層に合わせて文体を調整する。
-                        - （例：高級志向 → 洗練された丁寧な文章 / 家庭向け → 温かみのある親しみやすい文章）
-
-                3.  **プロット作成**:
-                    - **導入**: 読者の興味を惹きつける問いかけや情景描写。
-                    - **展開**: 生産者の直面した課題や、こだわり抜いたプロセスの描写。
-                    - **結び**: 生産者のメッセージと、商品を手に取る消費者への呼びかけ。
-
-                4.  **ドラフト作成**:
-                    - プロットに基づき執筆する。タイトルは最後に、本文の内容を凝縮した最も魅力的なものをつける。
-
-                # Output Format
-                ## [ここに思わずクリックしたくなるタイトル]
-
-                [ここに本文を記述。適度に改行を入れ、スマホでの可読性を高めること。]
-
-                ---
-
-                # Metacognition & Evaluation
-                出力する前に、作成したストーリーを以下の基準で自己採点してください。
-                1.  チャット履歴にある「生産者の想い」が反映されているか？（事実の羅列になっていないか）
-                2.  ターゲット層に刺さる言葉選びができているか？
-                3.  生産者の顔が浮かぶような温かみがあるか？
-
-                上記の基準を満たしていない場合は、よりエモーショナルな表現に修正してから最終出力を行ってください。
-            """
-            
-            history_text = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages])
-            full_prompt = storyteller_prompt.format(chat_history=history_text)
-
-            with st.spinner("プロのストーリーテラーが執筆中です（構成検討〜執筆まで行います）..."):
-                try:
-                    response = model.generate_content(full_prompt)
-                    raw_story_text = response.text
-                    
-                    # 【修正2】正規表現の引数 raw_text= を削除し、変数名のみにする
-                    match = re.search(r'##\s*(.*?)\n(.*?)(?:\n---|# Metacognition|$)', raw_story_text, flags=re.DOTALL)
-
-                    # 万が一単純な検索で失敗した場合のバックアップロジック
-                    if not match:
-                         match = re.search(r'##\s*(.*?)\n(.*)', raw_story_text, re.DOTALL)
-
-                    if match:
-                        title = match.group(1).strip()
-                        body = match.group(2).strip()
+        generation_cache = get_generation_cache()
+        
+        # 1回で作る案の数 (2以上にすると、複数の案を同時に作って並べて比較できる)
+        candidate_count = st.number_input(
+            "一度に作るストーリー案の数", min_value=1, max_value=llm.MAX_CANDIDATES, value=1, step=1
+        )
+        
+        # 同じヒアリング内容からの生成結果はキャッシュから返す (別の案がほしい場合はオンにする)
+        regenerate = st.checkbox("以前の生成結果を使わずに作り直す", value=False)
+        
+        # 解析できなかった後の「作り直す」は、キャッシュを使わずに生成し直す
+        regenerate_requested = st.session_state.pop("regenerate_story", False)
+        regenerate = regenerate or regenerate_requested
+        
+        if st.button("このヒアリング内容からストーリーを生成する") or regenerate_requested:
+            st.session_state.story_parse_failure = None
+            models = get_models()
+            # ストーリーテラーの役割は system_instruction に設定済みなので、チャット履歴だけを送る
+            full_prompt = "Chat History:\n" + llm.format_history(st.session_state.messages)
+            story_format = get_story_format()
+            # 出力形式が違う生成結果は使い回せないので、キーを分ける
+            cache_kind = "storyteller_json" if story_format == llm.STORY_FORMAT_JSON else "storyteller"
+            cache_key = make_key(cache_kind, st.session_state.messages, PROMPT_VERSION, MODEL_NAME)
+
+            if candidate_count > 1:
+                # 複数案モード: 案ごとに違う結果がほしいので、キャッシュは使わない
+                with st.spinner(f"プロのストーリーテラーが{candidate_count}つの案を同時に執筆中です..."):
+                    start = time.perf_counter()
+                    with metrics.timed("llm.storyteller.candidates") as span:
+                        st.session_state.story_candidates = llm.generate_candidates(
+                            models["storyteller"], full_prompt, candidate_count, story_format
+                        )
+                        span.size = candidate_count
+                    elapsed = time.perf_counter() - start
+                st.caption(f"{candidate_count}案の生成にかかった時間: {elapsed:.1f}秒")
+            else:
+                st.session_state.story_candidates = []
+                
+                with st.spinner("プロのストーリーテラーが執筆中です（構成検討〜執筆まで行います）..."):
+                    try:
+                        raw_story_text = None if regenerate else generation_cache.get(cache_key)
+                        from_cache = raw_story_text is not None
+                        if not regenerate:
+                            metrics.record_cache("generation_cache", from_cache)
                         
-                        # Markdownの太字などを除去（念のため）
-                        title = title.replace("**", "")
+                        if from_cache:
+                            result = llm.parse_output(raw_story_text, story_format)
+                        else:
+                            # 構造化出力で読めなかった場合は、作り直さずに1回だけ形式を直してもらう
+                            with metrics.timed("llm.storyteller") as span:
+                                result = llm.generate_story(models["storyteller"], full_prompt, story_format)
+                                span.size = len(result["raw"])
+                        raw_story_text = result["raw"]
                         
-                        st.session_state.final_story_title = title
-                        st.session_state.final_story_body = body
+                        if result["error"] is None:
+                            title, body = result["title"], result["body"]
+                            
+                            st.session_state.final_story_title = title
+                            st.session_state.final_story_body = body
+                            st.session_state.chat_history_json = json.dumps(st.session_state.messages)
+                            
+                            # 解析できた生成結果だけをキャッシュする
+                            if not from_cache:
+                                generation_cache.put(cache_key, raw_story_text)
+                            
+                            st.success(
+                                "ストーリーが生成されました！"
+                                + (" (以前の生成結果を表示しています)" if from_cache else "")
+                                + (" (出力の形式を自動で直しました)" if result["repaired"] else "")
+                            )
+                            
+                            # 思考プロセス（分析結果など）もデバッグ用に見れるようにする（任意）
+                            # (構造化出力では、分析の要点だけが analysis に入る)
+                            with st.expander("AIの思考プロセス・分析結果を見る"):
+                                if story_format == llm.STORY_FORMAT_JSON:
+                                    st.text(result["analysis"] or "(分析結果はありません)")
+                                else:
+                                    st.text(raw_story_text)
+
+                            if "messages_loaded" not in st.session_state:
+                                st.session_state.saved_story_id = None 
+                        else:
+                            raise IndexError("フォーマット不一致")
+
+                    except (IndexError, AttributeError):
+                        # 生データ (JSON など) をストーリーとして保存しないよう、確認用のストーリーも空にして作り直してもらう
+                        st.session_state.story_parse_failure = raw_story_text or ""
+                        st.session_state.final_story_title = ""
+                        st.session_state.final_story_body = ""
+
+                    except Exception as e:
+                        st.error(f"ストーリー生成中にエラーが発生しました。\n詳細: {e}")
+
+        # 生成結果を解析できなかった場合は、保存には進まずにこのタブで作り直してもらう
+        if st.session_state.story_parse_failure is not None:
+            st.error("AIの出力形式を解析できなかったため、ストーリーを保存できません。作り直してください。")
+            if st.session_state.story_parse_failure:
+                with st.expander("生成された生データを見る"):
+                    st.code(st.session_state.story_parse_failure)
+            if st.button("作り直す", key="regenerate_after_parse_failure"):
+                st.session_state.regenerate_story = True
+                st.rerun()
+
+        # 複数案モードの結果を横に並べて表示し、採用する案を選んでもらう
+        if st.session_state.story_candidates:
+            columns = st.columns(len(st.session_state.story_candidates))
+            for i, (column, candidate) in enumerate(zip(columns, st.session_state.story_candidates)):
+                with column:
+                    st.markdown(f"#### 案 {i + 1}")
+                    if candidate["error"]:
+                        st.error(candidate["error"])
+                        if candidate["raw"]:
+                            st.code(candidate["raw"])
+                        continue
+                    
+                    st.markdown(f"**{candidate['title']}**")
+                    st.markdown(candidate["body"])
+                    
+                    if st.button("この案を採用する", key=f"adopt_candidate_{i}"):
+                        st.session_state.final_story_title = candidate["title"]
+                        st.session_state.final_story_body = candidate["body"]
                         st.session_state.chat_history_json = json.dumps(st.session_state.messages)
                         
-                        st.success("ストーリーが生成されました！")
-                        
-                        # 思考プロセス（分析結果など）もデバッグ用に見れるようにする（任意）
-                        with st.expander("AIの思考プロセス・分析結果を見る"):
-                            st.text(raw_story_text)
-
                         if "messages_loaded" not in st.session_state:
                             st.session_state.saved_story_id = None 
-                    else:
-                        raise IndexError("フォーマット不一致")
-
-                except (IndexError, AttributeError):
-                    st.error("AIの出力形式を解析できませんでした。")
-                    st.warning("▼ 生成された生データ:")
-                    st.code(raw_story_text) 
-                    
-                    # エラー時は生データをそのまま保存できるようにする
-                    st.session_state.final_story_title = "タイトル自動取得失敗"
-                    st.session_state.final_story_body = raw_story_text
+                        
+                        st.session_state.story_candidates = []
+                        st.rerun()
 
-                except Exception as e:
-                    st.error(f"ストーリー生成中にエラーが発生しました。\n詳細: {e}")
+        cache_stats = generation_cache.stats()
+        st.caption(f"生成結果のキャッシュ: ヒット {cache_stats['hits']}回 / ミス {cache_stats['misses']}回 / 保存 {cache_stats['entries']}件")
 
     if st.session_state.final_story_body:
         st.subheader("生成されたストーリー（確認用）")
@@ -310,11 +387,13 @@ with tab3:
                         story_id=st.session_state.saved_story_id,
                         title=st.session_state.final_story_title,
                         body=st.session_state.final_story_body,
-                        chat_history=st.session_state.chat_history_json
+                        chat_history=st.session_state.chat_history_json,
+                        history_summary=json.dumps(st.session_state.history_summary, ensure_ascii=False)
                     )
                 
                 if success:
                     st.success(f"ストーリーが上書き保存されました！ (ID: {st.session_state.saved_story_id})")
+                    st.session_state.story_revisions = None # 新しい版が増えたので読み込み直す
                 else:
                     st.error("上書き保存に失敗しました。")
             
@@ -324,7 +403,8 @@ with tab3:
                     new_story_id = database.save_story(
                         title=st.session_state.final_story_title,
                         body=st.session_state.final_story_body,
-                        chat_history=st.session_state.chat_history_json
+                        chat_history=st.session_state.chat_history_json,
+                        history_summary=json.dumps(st.session_state.history_summary, ensure_ascii=False)
                     )
                 
                 if new_story_id:
@@ -333,22 +413,69 @@ with tab3:
                 else:
                     st.error("新規保存に失敗しました。")
 
+        # 上書き保存するストーリーの変更履歴 (前の版に戻せる)
+        if is_update:
+            with st.expander("変更履歴"):
+                # 変更履歴は別のワークシートにあるので、開いた時だけ読み込む
+                if st.button("変更履歴を読み込む"):
+                    st.session_state.story_revisions = database.list_revisions(st.session_state.saved_story_id)
+                
+                story_revisions = st.session_state.story_revisions
+                if story_revisions == []:
+                    st.caption("まだ変更履歴はありません (上書き保存すると、前の版が残ります)。")
+                elif story_revisions:
+                    selected = st.selectbox(
+                        "版",
+                        story_revisions,
+                        format_func=lambda r: f"第{r['revision']}版 ({r['created_at'][:16]}) {r['title']} / {r['chars']}文字",
+                    )
+                    if st.button("この版に戻す"):
+                        with st.spinner("選んだ版に戻しています..."):
+                            restored = database.restore_revision(st.session_state.saved_story_id, selected["revision"])
+                        if restored:
+                            st.session_state.final_story_title = restored["title"]
+                            st.session_state.final_story_body = restored["body"]
+                            st.session_state.chat_history_json = restored["chat_history"]
+                            if restored["chat_history"]:
+                                st.session_state.messages = json.loads(restored["chat_history"])
+                            st.session_state.history_summary = llm.load_summary(
+                                restored["history_summary"], st.session_state.messages
+                            )
+                            st.session_state.pop("chat_session", None) # 会話が変わったので作り直す
+                            st.session_state.story_revisions = None
+                            st.toast(f"第{selected['revision']}版に戻しました。")
+                            st.rerun()
+
         # 保存が成功したらQRコードを表示
         if st.session_state.saved_story_id:
             story_id = st.session_state.saved_story_id
             
-            # (↓ QRコード表示ロジックは変更なし)
             # 【F-004: QRコード発行機能】
-            app_url = "https://brand-gen-ejztgk9pxefnatl8jyk4tr.streamlit.app/" 
-            final_url = f"{app_url}/?story_id={story_id}"
-            
-            st.info(f"QRコードが指すURL (↓):\n{final_url}")
+            # (静的な HTML を配信している場合は、static_export.py で書き出し済みならそちらを指す)
+            static_base_url = st.secrets.get("STATIC_BASE_URL", "")
+            exported_ids = database.get_exported_story_ids(static_base_url)
+            final_url = qr_codes.story_url(story_id, static_base_url=static_base_url, exported_ids=exported_ids)
             
-            qr = qrcode.QRCode(version=1, box_size=10, border=4)
-            qr.add_data(final_url) 
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
-
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            st.image(buf)
\ No newline at end of file
+            # シートへの書き込みはまとめて行うので、保存の直後は書き込み待ちのことがある
+            # 書き込みが終わる前に印刷されたQRコードは、書き込みが失われると読めないURLになるので、
+            # 書き込み済みになるまではQRコードを表示しない
+            save_status, save_error = database.get_save_status(story_id)
+            if save_status == "pending":
+                st.caption("⏳ データベースへの書き込み待ちです (数秒で終わります)。書き込みが終わるとQRコードを表示します。")
+                if st.button("書き込みの状況を確認する"):
+                    st.rerun()
+            elif save_status == "failed":
+                st.error(f"データベースへの書き込みに失敗しました。\n詳細: {save_error}")
+                if st.button("もう一度書き込む"):
+                    database.retry_save(story_id)
+                    st.rerun()
+            else:
+                st.info(f"QRコードが指すURL (↓):\n{final_url}")
+                if static_base_url and story_id not in exported_ids:
+                    st.caption(
+                        "静的なページはまだ書き出されていないので、アプリのURLを指しています。"
+                        "static_export.py で書き出した後は、ダッシュボードから静的なページを指すQRコードを作成できます。"
+                    )
+                
+                # 同じURLの PNG はキャッシュから返す (再実行のたびに作り直さない)
+                st.image(qr_codes.get_qr_png(final_url))
\ No newline at end of file
@@ -0,0 +1,93 @@
+# pages/metrics.py (管理者用: 処理時間の計測結果)
+
+import streamlit as st
+import pandas as pd
+from datetime import datetime
+import metrics
+
+st.set_page_config(page_title="計測結果 (管理者用)", layout="wide")
+st.title("計測結果 (管理者用) ⏱️")
+
+# -----------------------------------------------------------------
+#  管理者の確認
+# -----------------------------------------------------------------
+admin_password = st.secrets.get("ADMIN_PASSWORD", "")
+if not admin_password:
+    st.error("管理者用のパスワード (ADMIN_PASSWORD) が設定されていません。st.secretsを確認してください。")
+    st.stop()
+
+if not st.session_state.get("is_admin", False):
+    password = st.text_input("管理者パスワード", type="password")
+    if password != admin_password:
+        if password:
+            st.error("パスワードが違います。")
+        st.stop()
+    st.session_state.is_admin = True
+
+# -----------------------------------------------------------------
+#  メイン処理
+# -----------------------------------------------------------------
+st.markdown(
+    "このサーバープロセスで記録した、処理ごとの所要時間 (ミリ秒) と、時間以外の値 (トークン数・失敗率など) です。"
+    f"パーセンタイルは処理ごとの直近 {metrics.MAX_SAMPLES} 件から計算しています。"
+    "失敗を 0/1 で記録した処理は、値の平均が失敗率になります。"
+)
+
+rows = metrics.summary()
+if not rows:
+    st.info("まだ計測結果はありません。")
+    st.stop()
+
+st.dataframe(
+    pd.DataFrame(rows),
+    use_container_width=True,
+    column_config={
+        "op": "処理",
+        "count": "回数",
+        "errors": "エラー",
+        "p50_ms": st.column_config.NumberColumn("p50 (ms)", format="%.1f"),
+        "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.1f"),
+        "p99_ms": st.column_config.NumberColumn("p99 (ms)", format="%.1f"),
+        "max_ms": st.column_config.NumberColumn("最大 (ms)", format="%.1f"),
+        "total_size": "データ量の合計 (文字数・件数)",
+        "cache_hits": "キャッシュ ヒット",
+        "cache_misses": "キャッシュ ミス",
+        "value_count": "値の件数",
+        "value_mean": st.column_config.NumberColumn("値の平均", format="%.2f"),
+        "value_p50": st.column_config.NumberColumn("値の p50", format="%.0f"),
+        "value_p95": st.column_config.NumberColumn("値の p95", format="%.0f"),
+    },
+    hide_index=True,
+)
+
+st.subheader("所要時間の分布")
+op = st.selectbox("処理", [row["op"] for row in rows if row["count"]])
+if op:
+    histogram = pd.DataFrame(metrics.histogram(op), columns=["所要時間", "回数"]).set_index("所要時間")
+    st.bar_chart(histogram, sort=False)
+
+st.subheader("値の分布")
+value_op = st.selectbox("値を記録した処理", [row["op"] for row in rows if row["value_count"]])
+if value_op:
+    value_histogram = pd.DataFrame(metrics.value_histogram(value_op), columns=["値", "回数"]).set_index("値")
+    st.bar_chart(value_histogram, sort=False)
+
+st.subheader("書き出し")
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.download_button(
+        "JSON Lines をダウンロード",
+        data=metrics.to_jsonl(),
+        file_name=f"metrics_{datetime.now():%Y%m%d_%H%M%S}.jsonl",
+        mime="application/x-ndjson",
+    )
+with col2:
+    # サーバー上のファイルに追記する (st.secrets["METRICS_LOG_PATH"] が設定されている場合)
+    log_path = st.secrets.get("METRICS_LOG_PATH", "")
+    if st.button("サーバーのファイルに追記", disabled=not log_path, help=log_path or "METRICS_LOG_PATH が未設定です"):
+        written = metrics.dump_jsonl(log_path)
+        st.success(f"{written} 行を {log_path} に追記しました。")
+with col3:
+    if st.button("計測結果をリセット"):
+        metrics.reset()
+        st.rerun()
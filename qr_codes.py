@@ -0,0 +1,261 @@
+# qr_codes.py
+#
+# ストーリーの閲覧用URLのQRコード (PNG) を作る。
+#   - 同じ (URL, サイズ, スタイル) の PNG は、件数に上限のある LRU キャッシュから返す
+#     (Streamlit の再実行のたびに QRコードを作り直して PNG に変換しない)
+#   - ダッシュボードで選んだ複数のストーリーの QRコードをまとめて作り (大量の場合だけ並列に)、
+#     ZIP (PNG ファイル) または印刷用の PDF (複数ページ) にまとめる
+
+import csv
+import io
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# qrcode と Pillow は QRコードを作る時に読み込む (ページの起動を遅くしないため)
+import metrics
+from static_export import story_filename
+
+# アプリ本体のURL (閲覧用URLは "?story_id=..." を付けたもの)
+DEFAULT_APP_URL = "https://brand-gen-ejztgk9pxefnatl8jyk4tr.streamlit.app/"
+
+# キャッシュに残す最大件数 (超えたら最後に使われたのが古いものから削除)
+DEFAULT_MAX_ENTRIES = 256
+
+# QRコードの1セルのピクセル数 (元の実装と同じ)
+DEFAULT_BOX_SIZE = 10
+
+# スタイルごとの色と余白 (余白はセル数)
+STYLES = {
+    "standard": {"fill_color": "black", "back_color": "white", "border": 4},
+    "print": {"fill_color": "black", "back_color": "white", "border": 2}, # 印刷シート用 (余白を詰める)
+}
+
+# まとめて作る件数 (キャッシュにないもの) がこれ以上の場合だけ、プロセスプールで並列に作る
+# (プロセスの起動とモジュールの読み込み直しに時間がかかるので、ダッシュボードの1ページ分 (50件程度) では
+#  1件ずつ作るほうが速い。batch_generate.py のような大量の書き出し用)
+PROCESS_POOL_THRESHOLD = 500
+
+# 印刷用 PDF のページ (A4, 150dpi) と1ページあたりの並べ方
+PAGE_SIZE = (1240, 1754)
+PAGE_DPI = 150
+GRID = (3, 4) # 横3 x 縦4 = 1ページ12件
+
+# 印刷用 PDF のラベルに使う日本語フォントの候補 (見つからない場合は Pillow の既定フォントで story_id のみ)
+FONT_CANDIDATES = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+    "C:/Windows/Fonts/meiryo.ttc",
+]
+
+
+def story_url(story_id, app_url=DEFAULT_APP_URL, static_base_url="", exported_ids=()):
+    """
+    QRコードが指すストーリーの閲覧用URL。
+    static_base_url があり、static_export.py で書き出し済み (exported_ids。static_export.load_exported_ids で読む)
+    のストーリーは、静的な HTML を指す。まだ書き出していないストーリーはファイルがないので、アプリのURLのまま。
+    """
+    if static_base_url and story_id in exported_ids:
+        return f"{static_base_url.rstrip('/')}/{story_filename(story_id)}"
+    return f"{app_url}/?story_id={story_id}"
+
+# -----------------------------------------------------------------
+#  QRコードの作成とキャッシュ
+# -----------------------------------------------------------------
+
+def render_qr_png(url, box_size=DEFAULT_BOX_SIZE, style="standard"):
+    """
+    URL の QRコードを作り、PNG のバイト列で返す (キャッシュなし)。
+    """
+    import qrcode
+
+    options = STYLES[style]
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=options["border"])
+    qr.add_data(url)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color=options["fill_color"], back_color=options["back_color"])
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _render_job(job):
+    # プロセスプールの各ワーカーで実行する
+    return render_qr_png(*job)
+
+
+class QRCache:
+    """
+    (URL, サイズ, スタイル) -> PNG のバイト列 を保存する、件数に上限のある LRU キャッシュ。
+    ヒット数・ミス数は hits / misses で参照できる。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            png = self._entries.get(key)
+            if png is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return png
+
+    def put(self, key, png):
+        with self._lock:
+            self._entries[key] = png
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+# プロセス内で共有するキャッシュ (Streamlit の全セッションで共有される)
+_cache = QRCache()
+
+
+def get_qr_png(url, box_size=DEFAULT_BOX_SIZE, style="standard"):
+    """
+    URL の QRコードの PNG をキャッシュから返す。ない場合は作ってキャッシュに入れる。
+    """
+    key = (url, box_size, style)
+    png = _cache.get(key)
+    metrics.record_cache("qr.png", png is not None)
+    if png is None:
+        with metrics.timed("qr.render") as span:
+            png = render_qr_png(url, box_size, style)
+            span.size = len(png)
+        _cache.put(key, png)
+    return png
+
+
+def cache_stats():
+    return _cache.stats()
+
+# -----------------------------------------------------------------
+#  一括作成
+# -----------------------------------------------------------------
+
+def generate_batch(items, box_size=DEFAULT_BOX_SIZE, style="print", workers=None,
+                   pool_threshold=PROCESS_POOL_THRESHOLD):
+    """
+    複数のストーリーの QRコードをまとめて作る。キャッシュにないものだけを作り、その件数が pool_threshold 以上で
+    CPU が複数ある場合はプロセスプールで並列に、それ以外は1件ずつ作る。
+
+    引数:
+        items (list): {"story_id", "title", "url"} の dict のリスト
+
+    戻り値: (pngs, stats)
+        pngs : items と同じ順の PNG のバイト列のリスト
+        stats: {"count": 件数, "cache_hits": キャッシュから返した件数, "seconds": かかった秒数, "codes_per_sec": 1秒あたりの件数}
+    """
+    start = time.perf_counter()
+    keys = [(item["url"], box_size, style) for item in items]
+    pngs = [_cache.get(key) for key in keys]
+    missing = [i for i, png in enumerate(pngs) if png is None]
+
+    if len(missing) >= max(2, pool_threshold) and (os.cpu_count() or 1) > 1:
+        # Streamlit のサーバーはスレッドを使っているので、fork ではなく spawn で起動する
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            rendered = list(pool.map(_render_job, [keys[i] for i in missing]))
+    else:
+        rendered = [render_qr_png(*keys[i]) for i in missing]
+
+    for i, png in zip(missing, rendered):
+        _cache.put(keys[i], png)
+        pngs[i] = png
+
+    seconds = time.perf_counter() - start
+    metrics.observe("qr.batch", seconds, size=len(items))
+    return pngs, {
+        "count": len(items),
+        "cache_hits": len(items) - len(missing),
+        "seconds": seconds,
+        "codes_per_sec": len(items) / seconds if seconds > 0 else 0.0,
+    }
+
+
+def pack_zip(items, pngs):
+    """
+    QRコードの PNG を <story_id>.png として ZIP にまとめる。
+    どの QRコードがどのストーリーかが分かるよう、index.csv (story_id, タイトル, URL) も入れる。
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        index = io.StringIO()
+        writer = csv.writer(index)
+        writer.writerow(["story_id", "title", "url"])
+        for item, png in zip(items, pngs):
+            zf.writestr(f"{item['story_id']}.png", png)
+            writer.writerow([item["story_id"], item.get("title", ""), item["url"]])
+        zf.writestr("index.csv", "\ufeff" + index.getvalue()) # Excel で開けるよう BOM 付き
+    return buf.getvalue()
+
+
+def _load_font(size):
+    from PIL import ImageFont
+
+    for path in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(path, size), True
+        except OSError:
+            continue
+    return ImageFont.load_default(), False
+
+
+def pack_pdf(items, pngs):
+    """
+    QRコードを A4 のページに格子状に並べ、ラベル (タイトル・story_id) 付きの印刷用 PDF にする。
+    """
+    from PIL import Image, ImageDraw
+
+    columns, rows = GRID
+    margin = 60
+    cell_w = (PAGE_SIZE[0] - margin * 2) // columns
+    cell_h = (PAGE_SIZE[1] - margin * 2) // rows
+    label_h = 70
+    qr_size = min(cell_w, cell_h - label_h) - 20
+    font, has_cjk = _load_font(22)
+
+    pages = []
+    per_page = columns * rows
+    for page_start in range(0, len(items), per_page):
+        page = Image.new("RGB", PAGE_SIZE, "white")
+        draw = ImageDraw.Draw(page)
+        for n, (item, png) in enumerate(zip(items[page_start:page_start + per_page],
+                                            pngs[page_start:page_start + per_page])):
+            x = margin + (n % columns) * cell_w
+            y = margin + (n // columns) * cell_h
+            qr = Image.open(io.BytesIO(png)).convert("RGB").resize((qr_size, qr_size), Image.NEAREST)
+            page.paste(qr, (x + (cell_w - qr_size) // 2, y))
+
+            title = str(item.get("title", ""))
+            if len(title) > 16:
+                title = title[:15] + "…"
+            labels = [title, str(item["story_id"])[:8]] if has_cjk else [str(item["story_id"])]
+            for i, label in enumerate(labels):
+                width = draw.textlength(label, font=font)
+                draw.text((x + (cell_w - width) // 2, y + qr_size + 8 + i * 30), label, fill="black", font=font)
+        pages.append(page)
+
+    if not pages:
+        return b""
+    buf = io.BytesIO()
+    pages[0].save(buf, format="PDF", save_all=True, append_images=pages[1:], resolution=PAGE_DPI)
+    return buf.getvalue()
@@ -0,0 +1,199 @@
+# revisions.py
+#
+# ストーリーの変更履歴 (上書き保存のたびの版) の形式と、版の組み立て。
+# 毎回全文を残すと保存先が大きくなるので、各版は前の版との差分 (delta) だけを残し、
+# 差分が SNAPSHOT_EVERY - 1 個続いたら全文 (snapshot) を残す。ある版を組み立てる時は、
+# その版の元になった版をたどって全文まで戻り、差分を順に当てるので、当てる差分は最大 SNAPSHOT_EVERY - 1 個で済む。
+#
+# 変更履歴はストーリー本体とは別の場所 (シートの "revisions" ワークシート・SQLite の story_revisions テーブル) に
+# 保存するので、一覧の表示や1件の閲覧の読み込みは大きくならない。
+#
+# 版の番号は保存先に追加された順 (1始まり) で、保存先から読み込む時に振る。
+# 差分はどの版に対するものかを revision_id で持つので、複数のプロセスが同じストーリーの版を同時に追加しても
+# (同じ版に対する差分が2つ並んでも) 正しく組み立てられる。
+#
+# 1版分のレコード (保存先とのやりとりの形):
+#   {"revision": 版の番号 (読み込み時に振る), "revision_id": 版のID, "base_id": 差分の元の版のID (全文の場合は ""),
+#    "kind": SNAPSHOT / DELTA, "created_at": 記録した日時, "data": pack() した文字列}
+
+import difflib
+import json
+import re
+import uuid
+
+from history_codec import decode_history, encode_history
+
+# 差分がこの数だけ続く前に全文を残す (全文から数えた版の数)
+SNAPSHOT_EVERY = 10
+
+# 変更履歴に残す列
+FIELDS = ["title", "body", "chat_history", "history_summary"]
+
+# 版の種類
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+# 差分を取る単位の区切り (改行・句読点・カンマの直後)。chat_history の JSON もメッセージごとに近い単位で区切られる
+_TOKEN_END = re.compile(r"(?<=[\n。、,])")
+
+
+def _tokens(text):
+    return [token for token in _TOKEN_END.split(text) if token]
+
+
+def _fields(record):
+    return {field: str(record.get(field, "") or "") for field in FIELDS}
+
+
+def make_delta(old, new):
+    """
+    old から new への差分 (変わった列ごとの [開始位置, 終了位置, 置き換える文字列] のリスト) を返す。
+    位置は old の文字の位置で、前から順に並ぶ。
+    """
+    delta = {}
+    for field in FIELDS:
+        a, b = old[field], new[field]
+        if a == b:
+            continue
+        a_tokens, b_tokens = _tokens(a), _tokens(b)
+        offsets = [0]
+        for token in a_tokens:
+            offsets.append(offsets[-1] + len(token))
+        matcher = difflib.SequenceMatcher(None, a_tokens, b_tokens)
+        delta[field] = [
+            [offsets[i1], offsets[i2], "".join(b_tokens[j1:j2])]
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+            if tag != "equal"
+        ]
+    return delta
+
+
+def apply_delta(old, delta):
+    """
+    make_delta() の差分を old に当てた内容を返す。
+    """
+    new = dict(old)
+    for field, ops in delta.items():
+        text = old[field]
+        pieces = []
+        position = 0
+        for start, end, replacement in ops:
+            pieces.append(text[position:start])
+            pieces.append(replacement)
+            position = end
+        pieces.append(text[position:])
+        new[field] = "".join(pieces)
+    return new
+
+
+def pack(payload):
+    """
+    全文・差分を保存用の文字列にする。圧縮したほうが短い場合は history_codec の形式で圧縮する。
+    """
+    raw = json.dumps(payload, ensure_ascii=False)
+    compressed = encode_history(raw)
+    return compressed if len(compressed) < len(raw) else raw
+
+
+def unpack(data):
+    return json.loads(decode_history(data))
+
+
+def number_revisions(revisions):
+    """
+    保存先に追加された順のレコードのリストに、版の番号 (1始まり) を振ったリストを返す。
+    """
+    return [dict(revision, revision=i + 1) for i, revision in enumerate(revisions)]
+
+
+def plan_revisions(revisions, previous, versions):
+    """
+    上書き保存で追加する版のレコード (版の番号なし) のリストを返す (内容が変わらない場合は空)。
+
+    revisions: 保存済みの版のレコード (追加された順)
+    previous : 上書き前のストーリー (分からない場合は None。最新の版を上書き前とみなす)
+    versions : 上書き後の内容の (記録する日時, ストーリー) のリスト (古い順。続けて上書きした分をまとめて渡せる)
+    """
+    resolved = _resolve(revisions)
+    head_id = revisions[-1]["revision_id"] if revisions else None
+    head, depth = resolved.get(head_id, (None, 0))
+    planned = []
+
+    base = _fields(previous) if previous is not None else head
+    for created_at, new in versions:
+        new = _fields(new)
+        if new == base:
+            continue
+        if base is not None and base != head:
+            # 初めての上書き (または保存先が直接書き換えられていた場合) は、上書き前の内容も全文で残す
+            head_id, head, depth = _add(planned, SNAPSHOT, base, created_at), base, 0
+        if head is None or depth + 1 >= SNAPSHOT_EVERY:
+            head_id, depth = _add(planned, SNAPSHOT, new, created_at), 0
+        else:
+            head_id, depth = _add(planned, DELTA, make_delta(head, new), created_at, head_id), depth + 1
+        head = base = new
+    return planned
+
+
+def _add(planned, kind, payload, created_at, base_id=""):
+    # planned に版を1つ追加し、その版のIDを返す
+    revision_id = uuid.uuid4().hex[:12]
+    planned.append({
+        "revision_id": revision_id,
+        "base_id": base_id,
+        "kind": kind,
+        "created_at": created_at,
+        "data": pack(payload),
+    })
+    return revision_id
+
+
+def _resolve(revisions):
+    """
+    revisions (追加された順) の各版を組み立て、版のID -> (内容, 全文から数えた差分の数) の dict を返す。
+    元の版が見つからない (組み立てられない) 差分は含めない。
+    """
+    resolved = {}
+    for revision in revisions:
+        if revision["kind"] == SNAPSHOT:
+            resolved[revision["revision_id"]] = (_fields(unpack(revision["data"])), 0)
+        elif revision.get("base_id") in resolved:
+            base, depth = resolved[revision["base_id"]]
+            resolved[revision["revision_id"]] = (apply_delta(base, unpack(revision["data"])), depth + 1)
+    return resolved
+
+
+def rebuild(revisions, number):
+    """
+    revisions (number_revisions() で番号を振ったもの) から number 版の内容 (FIELDS をキーにした dict) を組み立てる。
+    ない場合・組み立てられない場合は None。
+    """
+    by_id = {revision["revision_id"]: revision for revision in revisions}
+    target = next((revision for revision in revisions if revision["revision"] == number), None)
+
+    # 元の版をたどって全文まで戻り、そこから差分を順に当てる
+    chain = []
+    while target is not None and target["kind"] != SNAPSHOT:
+        chain.append(target)
+        target = by_id.get(target.get("base_id"))
+        if len(chain) > len(revisions):
+            return None # 元の版が循環している (壊れたデータ)
+    if target is None:
+        return None
+    content = _fields(unpack(target["data"]))
+    for revision in reversed(chain):
+        content = apply_delta(content, unpack(revision["data"]))
+    return content
+
+
+def replay(revisions):
+    """
+    revisions (追加された順) の各版の内容を組み立て、(版のレコード, 内容) のリストを追加された順に返す。
+    組み立てられない差分 (元の版が見つからないもの) は含めない。
+    """
+    resolved = _resolve(revisions)
+    return [
+        (revision, resolved[revision["revision_id"]][0])
+        for revision in revisions
+        if revision["revision_id"] in resolved
+    ]
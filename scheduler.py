@@ -0,0 +1,281 @@
+# scheduler.py
+#
+# Google Sheets API の書き込みを、1分あたりの上限 (クォータ) を超えないように送るための仕組み。
+#   - TokenBucket  : 1分あたりの上限に合わせた流量制限
+#   - call_api()   : 上限超過 (429) や一時的なエラー (5xx) を、ゆらぎ付きの指数バックオフで再試行する
+#   - WriteQueue   : 書き込みをキューに入れてすぐに戻り、一定時間ごとにまとめて送る。
+#                    キーごと (story_id) に、書き込み待ち・保存済み・失敗の状態を確認できる
+#                    プロセスの終了時 (コンテナの再起動など) は、書き込み待ちのものを送り終えてから終了する
+#
+# イベント当日のように多くの生産者が同時に保存しても、1回ずつ送って上限に当たり保存に失敗することがないようにする。
+
+import atexit
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+# Google Sheets API の書き込みの上限 (1ユーザー・1プロジェクトあたり 60回/分)
+DEFAULT_WRITES_PER_MINUTE = 60
+
+# キューに入った書き込みをまとめて送るまでの待ち時間 (秒)
+DEFAULT_WINDOW = 1.0
+
+# 再試行の回数と、待ち時間の上限 (秒)
+MAX_ATTEMPTS = 6
+MAX_BACKOFF = 30
+
+# 再試行する HTTP ステータス (上限超過と、サーバー側の一時的なエラー)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 書き込みの状態
+PENDING = "pending"
+SAVED = "saved"
+FAILED = "failed"
+
+# 状態を覚えておく最大件数 (古いものから忘れる。忘れたものは保存済みとして扱う)
+MAX_STATUS_ENTRIES = 10000
+
+# プロセスの終了時に、書き込み待ちのものを送り終えるまで待つ時間の上限 (秒)
+# (docker stop などの終了の猶予 (既定で10秒) の間に終わるようにする。これを過ぎても残っていた分は失われる)
+SHUTDOWN_FLUSH_TIMEOUT = 8
+
+
+class TokenBucket:
+    """
+    1分あたり rate_per_minute 回までに抑える流量制限。
+    capacity 回分までは続けて使え、それ以降は一定の間隔でしか使えない。
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0 # 1秒あたりに増えるトークン
+        self.capacity = capacity or max(1, rate_per_minute // 6) # 既定では10秒分まで貯められる
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        トークンを1つ使う。足りない場合は貯まるまで待つ。
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait + random.uniform(0, 0.05)) # 同時に待っているスレッドが一斉に起きないよう少しずらす
+
+
+def is_retryable(error):
+    """
+    再試行すれば成功する見込みのあるエラー (上限超過・一時的なサーバーエラー・通信エラー) かどうか。
+    gspread.exceptions.APIError は response.status_code を持つ。
+    通信の切断・タイムアウトは、gspread が使う requests の例外 (組み込みの ConnectionError / TimeoutError の
+    サブクラスではない。応答の途中で切れた場合の ChunkedEncodingError を含む) も含める。
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # 書き込む時にだけ必要なので、ここで読み込む (閲覧だけのページの起動を遅くしない)
+    from requests.exceptions import ChunkedEncodingError, ConnectionError as RequestsConnectionError, Timeout
+
+    return isinstance(
+        error, (ConnectionError, TimeoutError, RequestsConnectionError, Timeout, ChunkedEncodingError)
+    )
+
+
+def format_error(error):
+    """
+    書き込みの状態に残すエラーメッセージ。
+    """
+    return f"{type(error).__name__}: {error}"
+
+
+def call_api(fn, bucket=None):
+    """
+    fn() を、流量制限 (bucket) を守りつつ、再試行できるエラーの間はゆらぎ付きの指数バックオフで再試行して呼ぶ。
+    最後まで失敗した場合・再試行できないエラーの場合は、その例外をそのまま投げる。
+    """
+    # 書き込む時にだけ必要なので、ここで読み込む (閲覧だけのページの起動を遅くしない)
+    from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+    for attempt in Retrying(
+        retry=retry_if_exception(is_retryable),
+        wait=wait_random_exponential(multiplier=0.5, max=MAX_BACKOFF),
+        stop=stop_after_attempt(MAX_ATTEMPTS),
+        reraise=True,
+    ):
+        with attempt:
+            if bucket is not None:
+                bucket.acquire()
+            return fn()
+
+
+class WriteQueue:
+    """
+    書き込みをキューに入れ、バックグラウンドのスレッドが window 秒ごとにまとめて flush_fn(ops) に渡す。
+
+    ops は (key, op) のリスト (入れた順)。flush_fn は、実際に書き込めなかった呼び出しのキーだけを
+    {key: エラーメッセージ} で返す (すべて成功した場合は空の dict か None)。書き込めた分は保存済みになるので、
+    retry() で二重に書き込まれることはない。flush_fn が例外を投げた場合は、そのまとまりがすべて失敗になる。
+    スレッドはキューが空になったら終了し、次に書き込みが入った時に起動し直す。
+    """
+
+    def __init__(self, flush_fn, window=DEFAULT_WINDOW):
+        self.flush_fn = flush_fn
+        self.window = window
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queue = [] # まだ送っていない (key, op)
+        self._in_flight = set() # 送信中のキー
+        self._status = OrderedDict() # key -> (状態, エラーメッセージ)
+        self._failed = {} # key -> 失敗した op のリスト (retry() で入れ直せるように残す)
+        self._thread = None
+        _queues.add(self)
+
+    def put(self, key, op):
+        """
+        書き込みをキューに入れてすぐに戻る。
+        """
+        with self._lock:
+            self._queue.append((key, op))
+            self._failed.pop(key, None)
+            self._set_status(key, PENDING, None)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sheets-write-queue", daemon=True)
+                self._thread.start()
+
+    def merge(self, key, fn):
+        """
+        まだ送っていない key の書き込みがあれば、その op を fn(op) の戻り値に置き換えて True を返す。
+        (例: 保存待ちの行の上書きを、追加する行の中身の書き換えにまとめる)
+        """
+        with self._lock:
+            for i in range(len(self._queue) - 1, -1, -1):
+                queued_key, op = self._queue[i]
+                if queued_key == key:
+                    self._queue[i] = (key, fn(op))
+                    return True
+        return False
+
+    def retry(self, key):
+        """
+        失敗した key の書き込みをもう一度キューに入れる。失敗した書き込みがなければ False。
+        """
+        with self._lock:
+            ops = self._failed.get(key)
+        if not ops:
+            return False
+        for op in ops:
+            self.put(key, op)
+        return True
+
+    def wait_for(self, key, timeout=None):
+        """
+        key の書き込みがキュー・送信中のどちらにもなくなるまで待つ。待ちきれた場合は True。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while key in self._in_flight or any(queued_key == key for queued_key, _ in self._queue):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def flush(self, timeout=None):
+        """
+        キューに入っているすべての書き込みが送り終わるまで待つ。待ちきれた場合は True。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def status(self, key):
+        """
+        key の書き込みの状態 (PENDING / SAVED / FAILED) とエラーメッセージ (失敗時のみ) を返す。
+        """
+        with self._lock:
+            return self._status.get(key, (SAVED, None))
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._queue) + len(self._in_flight)
+
+    def knows(self, key):
+        """
+        key の書き込みの状態を覚えているか (このキューに書き込みが入ったことがあるか)。
+        """
+        with self._lock:
+            return key in self._status
+
+    def unfinished_count(self):
+        """
+        書き込み待ち・送信中・失敗したまま (retry() されていない) のキーの数。
+        """
+        with self._lock:
+            return len({key for key, _ in self._queue} | self._in_flight | set(self._failed))
+
+    def _set_status(self, key, status, error):
+        self._status[key] = (status, error)
+        self._status.move_to_end(key)
+        while len(self._status) > MAX_STATUS_ENTRIES:
+            self._status.popitem(last=False)
+
+    def _run(self):
+        while True:
+            time.sleep(self.window) # この間に入った書き込みをまとめて送る
+            with self._lock:
+                ops, self._queue = self._queue, []
+                if not ops:
+                    self._thread = None
+                    self._idle.notify_all()
+                    return
+                self._in_flight = {key for key, _ in ops}
+
+            try:
+                failed = self.flush_fn(ops) or {}
+            except Exception as e:
+                failed = dict.fromkeys((key for key, _ in ops), format_error(e))
+
+            with self._lock:
+                failed_ops = {}
+                for key, op in ops:
+                    if key in failed:
+                        failed_ops.setdefault(key, []).append(op)
+                for key in dict.fromkeys(key for key, _ in ops):
+                    # 送信中に同じキーの書き込みが入った場合は、その結果が出るまで書き込み待ちのまま
+                    if not any(queued_key == key for queued_key, _ in self._queue):
+                        error = failed.get(key)
+                        self._set_status(key, FAILED if error else SAVED, error)
+                        if error:
+                            self._failed[key] = failed_ops[key]
+                self._in_flight = set()
+                self._idle.notify_all()
+
+
+# 作成した WriteQueue (プロセスの終了時に送り終えるため)
+_queues = weakref.WeakSet()
+
+
+@atexit.register
+def flush_all(timeout=SHUTDOWN_FLUSH_TIMEOUT):
+    """
+    すべての WriteQueue の書き込み待ちを、合わせて timeout 秒まで待って送り終える。すべて送り終えた場合は True。
+    プロセスの終了時 (Streamlit が SIGTERM で止まった時を含む) に自動で呼ばれる。
+    """
+    deadline = time.monotonic() + timeout
+    flushed = True
+    for queue in list(_queues):
+        flushed = queue.flush(max(0, deadline - time.monotonic())) and flushed
+    return flushed
@@ -0,0 +1,243 @@
+# search_index.py
+#
+# ストーリー (タイトルと本文) の全文検索用の転置インデックス。
+# 日本語は単語の区切りに空白がないので、文字の 2-gram (bigram) を単位にする。
+#   例: "朝どれトマト" -> "朝ど", "どれ", "れト", "トマ", "マト"
+# 検索語のすべての bigram を含むストーリーを候補にし、タイトルに含まれるものを上位に並べる。
+#
+# ストーリーの追加・上書きはその場で反映する (上書き前の分は削除済みの印を付けて検索結果から除き、
+# 削除済みが増えたら needs_rebuild() が True になるので、呼び出し側で作り直す)。
+# 検索時の集計は numpy で行い、10万件でも 1回の検索が数ミリ秒で終わるようにする。
+
+import re
+import threading
+import unicodedata
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+# 削除済みの印を付けた分がこの件数と、有効な件数の REBUILD_RATIO 倍の両方を超えたら作り直す
+REBUILD_MIN_DEAD = 1000
+REBUILD_RATIO = 0.2
+
+# 検索語の bigram がタイトルに1つ含まれるごとの加点と、すべて含まれる場合の加点
+# (本文だけに含まれる場合は 1 点。同じ点数の場合は新しい順)
+TITLE_BIGRAM_SCORE = 3
+TITLE_ALL_SCORE = 10
+
+# 作り直す時に一度に処理するストーリーの件数 (メモリの使用量を抑えるため)
+BUILD_CHUNK = 5000
+
+# bigram は2文字の文字コード (21ビットずつ) をつなげた整数で表す。1文字の場合は文字コードそのまま
+_CODE_BITS = 21
+_SLOT_BITS = 22 # 1回の処理の中でのストーリーの番号 (BUILD_CHUNK 件まで)
+
+_SPACES = re.compile(r"[\s\x00]+")
+
+
+def normalize(text):
+    """
+    検索用に文字の表記を揃える (全角英数字・半角カナを NFKC で揃え、英字は小文字にする)。
+    空白・改行は半角スペース1つにまとめる。
+    """
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", str(text or "")).lower())
+
+
+def _gram_pairs(texts, unigrams=False):
+    """
+    正規化済みのテキストのリストから、(テキストの番号, bigram のキー) の組を重複なしで返す。
+    空白をまたぐ bigram は含めない。unigrams=True の場合は1文字のキーも含める。
+
+    戻り値: (docs, keys) の numpy 配列。keys の昇順 (同じキーの中では docs の昇順) に並ぶ。
+    """
+    # 区切りの NUL を挟んでつなげ、文字コードの配列にして、まとめて計算する
+    codes = np.frombuffer("\x00".join(texts).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    separator = codes == 0
+    docs = np.cumsum(separator, dtype=np.uint64) # その位置より前の NUL の数 = テキストの番号
+    word = ~(separator | (codes == ord(" ")))
+
+    valid = word[:-1] & word[1:]
+    keys = (codes[:-1][valid] << np.uint64(_CODE_BITS)) | codes[1:][valid]
+    pair_docs = docs[:-1][valid]
+    if unigrams:
+        keys = np.concatenate([keys, codes[word]])
+        pair_docs = np.concatenate([pair_docs, docs[word]])
+
+    pairs = _sorted_unique((keys << np.uint64(_SLOT_BITS)) | pair_docs)
+    return pairs & np.uint64((1 << _SLOT_BITS) - 1), pairs >> np.uint64(_SLOT_BITS)
+
+
+def _sorted_unique(values):
+    # np.unique より速い (ソートして、隣と同じ値を除く)
+    values = np.sort(values)
+    keep = np.empty(len(values), dtype=bool)
+    keep[:1] = True
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+def query_keys(query):
+    """
+    検索語のキーの集合 (空白区切りの各語の bigram。1文字の語はその文字)。
+    """
+    keys = set()
+    for term in normalize(query).split():
+        if len(term) == 1:
+            keys.add(ord(term))
+        else:
+            keys.update(_gram_pairs([term])[1].tolist())
+    return keys
+
+
+def _timestamp(created_at):
+    try:
+        return datetime.fromisoformat(str(created_at)).timestamp()
+    except ValueError:
+        return 0.0
+
+
+class SearchIndex:
+    """
+    story_id 単位の bigram 転置インデックス。
+
+    ストーリーごとに番号 (slot) を振り、bigram のキー -> slot の配列 (array) を持つ。
+    上書き時は新しい slot を振り直し、古い slot は削除済みにする。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._postings = {} # キー -> その bigram をタイトルか本文に含む slot の配列
+        self._title_postings = {} # キー (bigram と1文字) -> タイトルに含む slot の配列
+        self._slots = [] # slot -> story_id
+        self._alive = bytearray() # slot -> 1 (有効) / 0 (上書き前の古い内容)
+        self._created_at = array("d") # slot -> created_at (UNIXTIME。並べ替え用)
+        self._slot_of = {} # story_id -> 現在の slot
+        self.dead = 0
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def rebuild(self, records):
+        """
+        レコード (story_id, title, body, created_at を含む dict) の一覧からインデックスを作り直す。
+        作り直している間も、古いインデックスで検索できる。
+        """
+        new = SearchIndex()
+        records = list(records)
+        for start in range(0, len(records), BUILD_CHUNK):
+            new._add(records[start:start + BUILD_CHUNK])
+        with self._lock:
+            for name in ("_postings", "_title_postings", "_slots", "_alive", "_created_at", "_slot_of", "dead"):
+                setattr(self, name, getattr(new, name))
+
+    def upsert(self, record):
+        """
+        ストーリーを追加する。同じ story_id がすでにある場合は上書きする。
+        created_at を含まない場合 (上書き保存時) は、前の値を引き継ぐ。
+        """
+        with self._lock:
+            old = self._slot_of.get(str(record["story_id"]))
+            if old is not None and "created_at" not in record:
+                record = dict(record, created_at=self._created_at[old])
+            self._add([record])
+
+    def _add(self, records):
+        first = len(self._slots)
+        for slot, record in enumerate(records, first):
+            story_id = str(record["story_id"])
+            old = self._slot_of.get(story_id)
+            if old is not None: # 同じIDが複数ある場合は後の行を採用する
+                self._alive[old] = 0
+                self.dead += 1
+            created_at = record.get("created_at", "")
+            self._slots.append(story_id)
+            self._alive.append(1)
+            self._created_at.append(created_at if isinstance(created_at, float) else _timestamp(created_at))
+            self._slot_of[story_id] = slot
+
+        titles = [normalize(record.get("title")) for record in records]
+        bodies = [normalize(record.get("body")) for record in records]
+        # タイトルのキーは本文の方にも入れる (本文の方はタイトルと本文のどちらかに含むもの)
+        title_docs, title_keys = _gram_pairs(titles, unigrams=True)
+        self._extend(self._title_postings, first, title_docs, title_keys)
+        is_bigram = title_keys >= np.uint64(1 << _CODE_BITS)
+        body_docs, body_keys = _gram_pairs(bodies)
+        pairs = _sorted_unique(np.concatenate([
+            (title_keys[is_bigram] << np.uint64(_SLOT_BITS)) | title_docs[is_bigram],
+            (body_keys << np.uint64(_SLOT_BITS)) | body_docs,
+        ]))
+        self._extend(self._postings, first, pairs & np.uint64((1 << _SLOT_BITS) - 1), pairs >> np.uint64(_SLOT_BITS))
+
+    @staticmethod
+    def _extend(postings, first, docs, keys):
+        # keys の昇順に並んでいるので、キーが変わる位置で区切って、キーごとの slot の配列の末尾に追加する
+        slots = (docs + np.uint64(first)).astype(np.uint32)
+        bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = [0] + bounds.tolist()
+        ends = bounds.tolist() + [len(keys)]
+        for key, start, end in zip(keys[starts].tolist() if len(keys) else [], starts, ends):
+            posting = postings.get(key)
+            if posting is None:
+                posting = postings[key] = array("I")
+            posting.frombytes(slots[start:end].tobytes())
+
+    def needs_rebuild(self):
+        """
+        削除済みの slot が増えて、作り直したほうがよいかどうか。
+        """
+        return self.dead > REBUILD_MIN_DEAD and self.dead > len(self._slot_of) * REBUILD_RATIO
+
+    def search(self, query, offset=0, limit=50):
+        """
+        query (空白区切りで複数の語を指定するとすべてを含むもの) に一致するストーリーを関連の高い順に並べ、
+        offset 件目から limit 件の story_id を返す。1文字の語はタイトルだけから探す。
+
+        戻り値: (total, story_ids)
+            total    : 一致した件数
+            story_ids: offset 件目から limit 件の story_id のリスト
+        """
+        keys = query_keys(query)
+        if not keys:
+            return 0, []
+
+        with self._lock:
+            size = len(self._slots)
+            postings = [
+                self._postings.get(key) if key >= 1 << _CODE_BITS else self._title_postings.get(key)
+                for key in keys
+            ]
+            if any(posting is None for posting in postings):
+                return 0, []
+
+            # キーごとに含む slot を数え、すべてのキーを含む slot を候補にする
+            # (配列はロックの外で書き換えられないよう、ロックの中でコピーする)
+            hits = np.zeros(size, dtype=np.uint16)
+            for posting in postings:
+                hits[np.frombuffer(posting, dtype=np.uint32).copy()] += 1
+            matched = (hits == len(keys)) & np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+            candidates = np.flatnonzero(matched)
+            if not len(candidates):
+                return 0, []
+
+            title_hits = np.zeros(size, dtype=np.uint16)
+            for key in keys:
+                posting = self._title_postings.get(key)
+                if posting is not None:
+                    title_hits[np.frombuffer(posting, dtype=np.uint32).copy()] += 1
+            created_at = np.frombuffer(self._created_at, dtype=np.float64)[candidates].copy()
+            slots = self._slots
+
+            title_hits = title_hits[candidates].astype(np.int64)
+            scores = 1 + TITLE_BIGRAM_SCORE * title_hits + TITLE_ALL_SCORE * (title_hits == len(keys))
+            # 点数の高い順、同じ点数なら新しい順 (lexsort は最後のキーから優先して並べる)
+            order = np.lexsort((-created_at, -scores))
+            page = candidates[order[offset:offset + limit]]
+            return len(candidates), [slots[slot] for slot in page]
@@ -0,0 +1,311 @@
+# static_export.py
+#
+# 保存されたストーリーを、1件ずつ静的な HTML ファイル (CSS込みで単体で表示できるもの) に書き出す。
+# QRコードの閲覧用URL (?story_id=...) は毎回 Streamlit のセッションを起動するので重いが、
+# 書き出したファイルは普通の Web サーバー (nginx, GitHub Pages など) でそのまま配信できる。
+#
+#   出力先/
+#     manifest.json            : story_id -> {hash, file, title, created_at} と、次回の差分書き出し用の位置
+#     stories/<story_id>.html  : ストーリー1件分のページ
+#
+# 2回目以降は、前回から追加・更新されたストーリーだけを書き出す (内容のハッシュが同じものは書き直さない)。
+# HTML への変換はプロセスプールで並列に行う。
+#
+# 書き出す前のストーリーのファイルはまだないので、QRコードは manifest.json に載ったストーリーだけを
+# 静的な HTML に向ける (load_exported_ids。それ以外はアプリのURLのまま)。
+#
+# 実行方法 (リポジトリのルートで。保存先の設定は .streamlit/secrets.toml から読む):
+#   python static_export.py --out public
+#   python static_export.py --out public --workers 8 --force   # 全件を書き出し直す
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from storage import SECRETS_PATH, create_backend, load_secrets
+
+# テンプレートや変換処理を変えたら上げる (全件が書き出し直しになる)
+TEMPLATE_VERSION = 1
+
+MANIFEST_NAME = "manifest.json"
+STORIES_DIR = "stories"
+
+# 配信中の manifest.json を読む時のタイムアウト (秒)
+MANIFEST_TIMEOUT = 5
+
+# 書き出しに使う列 (ページに表示する列だけ。chat_history は読まない)
+EXPORT_COLUMNS = ["story_id", "title", "body", "created_at"]
+
+# 書き出す story_id の形 (アプリが振る UUID)。シートは手で編集できるので、それ以外の ID はファイル名に使わない
+STORY_ID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<style>
+  body {{ margin: 0; background: #fafafa; color: #262730;
+         font-family: "Hiragino Sans", "Noto Sans JP", "Yu Gothic", sans-serif; line-height: 1.9; }}
+  main {{ max-width: 720px; margin: 0 auto; padding: 32px 20px 64px; }}
+  h1 {{ font-size: 1.7rem; line-height: 1.4; margin: 0 0 8px; }}
+  .created-at {{ color: #808495; font-style: italic; margin: 0; }}
+  hr {{ border: none; border-top: 1px solid #e6e6e6; margin: 24px 0; }}
+  p {{ margin: 0 0 1.2em; }}
+</style>
+</head>
+<body>
+<main>
+<h1>{title}</h1>
+<p class="created-at">{created_at}</p>
+<hr>
+{body}
+</main>
+</body>
+</html>
+"""
+
+# -----------------------------------------------------------------
+#  HTML への変換
+# -----------------------------------------------------------------
+
+def _inline(text):
+    """
+    1行分のテキストをエスケープし、**太字** と *斜体* だけを HTML にする。
+    """
+    text = html.escape(text)
+    text = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", text)
+    text = re.sub(r"\*(.+?)\*", r"<em>\1</em>", text)
+    return text
+
+
+def markdown_to_html(markdown):
+    """
+    ストーリー本文 (AIが出力する簡単なマークダウン) を HTML にする。
+    対応しているのは見出し (#)・区切り線 (---)・段落・段落内の改行・太字・斜体のみ。
+    """
+    blocks = []
+    for block in re.split(r"\n\s*\n", str(markdown or "").replace("\r\n", "\n").strip()):
+        lines = [line.rstrip() for line in block.split("\n") if line.strip()]
+        if not lines:
+            continue
+        if len(lines) == 1 and re.fullmatch(r"\s*(-{3,}|\*{3,})\s*", lines[0]):
+            blocks.append("<hr>")
+            continue
+        heading = re.match(r"(#{1,6})\s+(.*)", lines[0])
+        if heading:
+            level = min(len(heading.group(1)) + 1, 6) # ページの h1 はタイトルなので1段下げる
+            blocks.append(f"<h{level}>{_inline(heading.group(2))}</h{level}>")
+            lines = lines[1:]
+            if not lines:
+                continue
+        blocks.append("<p>" + "<br>\n".join(_inline(line) for line in lines) + "</p>")
+    return "\n".join(blocks)
+
+
+def render_story(record):
+    """
+    ストーリー1件 (dict) を単体で表示できる HTML 文字列にする。
+    """
+    return PAGE_TEMPLATE.format(
+        title=html.escape(str(record.get("title") or "ストーリー")),
+        created_at=html.escape(str(record.get("created_at") or "")),
+        body=markdown_to_html(record.get("body")) or "<p>本文がありません。</p>",
+    )
+
+
+def content_hash(record):
+    """
+    ページの見た目に関わる列とテンプレートのバージョンから、書き直しが必要かを判定するハッシュを作る。
+    """
+    payload = json.dumps(
+        [TEMPLATE_VERSION, str(record.get("title", "")), str(record.get("created_at", "")), str(record.get("body", ""))],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_exportable_id(story_id):
+    """
+    story_id をファイル名に使えるか (UUID の形か)。
+    """
+    return STORY_ID_PATTERN.fullmatch(str(story_id)) is not None
+
+
+def story_filename(story_id):
+    """
+    ストーリーの HTML ファイルの (出力先からの相対) パス。QRコードのURLもこの形にする。
+    UUID の形でない story_id (出力先の外を指す "../x" など) は ValueError。
+    """
+    if not is_exportable_id(story_id):
+        raise ValueError(f"書き出せない story_id です: {story_id!r}")
+    return f"{STORIES_DIR}/{story_id}.html"
+
+
+def _story_path(out_dir, story_id):
+    # 出力先の中のファイルのパス (story_filename で確認済みだが、念のため出力先の外を指さないことも確かめる)
+    path = os.path.realpath(os.path.join(out_dir, story_filename(story_id)))
+    if os.path.dirname(path) != os.path.realpath(os.path.join(out_dir, STORIES_DIR)):
+        raise ValueError(f"書き出せない story_id です: {story_id!r}")
+    return path
+
+
+def _write_story(out_dir, record):
+    # プロセスプールの各ワーカーで実行する (変換とファイルの書き込みまで行う)
+    path = _story_path(out_dir, record["story_id"])
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_story(record))
+    os.replace(tmp_path, path) # 配信中のファイルが書きかけにならないよう、置き換えで書き込む
+    return record["story_id"]
+
+# -----------------------------------------------------------------
+#  書き出し
+# -----------------------------------------------------------------
+
+def load_manifest(out_dir):
+    """
+    前回の manifest.json を読む。ない場合・テンプレートのバージョンが違う場合は空の manifest。
+    """
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("template_version") == TEMPLATE_VERSION:
+            return manifest
+    return {"template_version": TEMPLATE_VERSION, "cursor": None, "stories": {}}
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def load_exported_ids(source, timeout=MANIFEST_TIMEOUT):
+    """
+    書き出し済みのストーリーの story_id の集合を manifest.json から読む。
+    source は配信先のURL (STATIC_BASE_URL。"<URL>/manifest.json" を読む) か、出力先のディレクトリ。
+    読めなかった場合は空の集合 (QRコードはアプリのURLのままになる)。
+    """
+    try:
+        if source.startswith(("http://", "https://")):
+            # QRコードを作る時にだけ必要なので、ここで読み込む (ページの起動を遅くしない)
+            import requests
+
+            response = requests.get(f"{source.rstrip('/')}/{MANIFEST_NAME}", timeout=timeout)
+            response.raise_for_status()
+            manifest = response.json()
+        else:
+            manifest = load_manifest(source)
+        return {story_id for story_id in manifest.get("stories", {}) if is_exportable_id(story_id)}
+    except Exception as e:
+        metrics.observe("static_export.manifest_failed", 0.0, error=type(e).__name__)
+        return set()
+
+
+def export_stories(backend, out_dir, workers=None, force=False):
+    """
+    バックエンドのストーリーを out_dir に書き出す。
+
+    前回の manifest の位置 (cursor) から追加・更新されたストーリーだけを読み、
+    内容のハッシュが変わったものだけを書き出す。初回・force 指定時・位置が信用できない場合は全件を
+    (EXPORT_COLUMNS の列だけ) 読み直し、保存先から消えたストーリーのファイルも削除する。
+    story_id が UUID の形でないストーリー (シートを手で編集したものなど) は書き出さない。
+
+    戻り値:
+        dict: {"written": 書き出した件数, "skipped": 変更がなく飛ばした件数, "removed": 削除した件数,
+               "invalid": story_id が UUID の形でなく書き出さなかった件数, "full": 全件を読み直したか}
+    """
+    os.makedirs(os.path.join(out_dir, STORIES_DIR), exist_ok=True)
+    manifest = {"template_version": TEMPLATE_VERSION, "cursor": None, "stories": {}} if force else load_manifest(out_dir)
+    stories = manifest["stories"]
+
+    records, cursor = (None, None)
+    if manifest["cursor"] is not None:
+        records, cursor = backend.fetch_changes(manifest["cursor"])
+
+    full = records is None
+    if full:
+        # 先に位置を取ってから全件を読む (その間に保存されたものは次回の差分で拾われる)
+        _, cursor = backend.fetch_changes(None)
+        records = backend.list_stories(columns=EXPORT_COLUMNS)
+
+    targets = []
+    invalid = 0
+    for record in records:
+        story_id = str(record.get("story_id", ""))
+        if not story_id:
+            continue
+        if not is_exportable_id(story_id):
+            invalid += 1
+            continue
+        record = dict(record, story_id=story_id)
+        entry = stories.get(story_id)
+        digest = content_hash(record)
+        if (entry and entry["hash"] == digest
+                and os.path.exists(_story_path(out_dir, story_id))):
+            continue
+        targets.append((record, digest))
+
+    # 全件を読み直した場合は、保存先にないストーリーのファイルを削除する
+    removed = 0
+    if full:
+        current_ids = {str(record.get("story_id", "")) for record in records}
+        for story_id in [sid for sid in stories if sid not in current_ids]:
+            stories.pop(story_id)
+            if not is_exportable_id(story_id):
+                continue # 書き出したファイルではない (manifest を手で編集したものなど)
+            path = _story_path(out_dir, story_id)
+            if os.path.exists(path):
+                os.remove(path)
+            removed += 1
+
+    if targets:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_write_story, [out_dir] * len(targets), [record for record, _ in targets],
+                          chunksize=max(1, len(targets) // ((workers or os.cpu_count() or 1) * 4))))
+        for record, digest in targets:
+            stories[record["story_id"]] = {
+                "hash": digest,
+                "file": story_filename(record["story_id"]),
+                "title": str(record.get("title", "")),
+                "created_at": str(record.get("created_at", "")),
+            }
+
+    manifest["cursor"] = cursor
+    save_manifest(out_dir, manifest)
+    return {
+        "written": len(targets),
+        "skipped": len(records) - len(targets) - invalid,
+        "removed": removed,
+        "invalid": invalid,
+        "full": full,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存されたストーリーを静的な HTML に書き出す")
+    parser.add_argument("--out", default="public", help="出力先のディレクトリ (既定: public)")
+    parser.add_argument("--workers", type=int, default=None, help="変換に使うプロセス数 (既定: CPU数)")
+    parser.add_argument("--force", action="store_true", help="前回の manifest を無視して全件を書き出し直す")
+    parser.add_argument("--secrets", default=SECRETS_PATH, help=f"設定ファイル (既定: {SECRETS_PATH})")
+    args = parser.parse_args()
+
+    backend = create_backend(load_secrets(args.secrets))
+    result = export_stories(backend, args.out, workers=args.workers, force=args.force)
+    print(f"{'全件' if result['full'] else '差分'}: {result['written']} 件を書き出し、"
+          f"{result['skipped']} 件は変更なし、{result['removed']} 件を削除しました ({args.out})")
+    if result["invalid"]:
+        print(f"story_id が UUID の形でない {result['invalid']} 件は書き出していません。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1303 @@
+# storage.py
+#
+# ストーリーの保存先 (ストレージバックエンド) の実装。
+# database.py はこのモジュールのバックエンドを通してデータを読み書きする。
+#   - SheetsBackend : Google Sheets (gspread のワークシート)
+#   - ShardedSheetsBackend : Google Sheets (作成月ごとのワークシートに分けて保存)
+#   - SQLiteBackend : ローカルの SQLite ファイル (WALモード)
+
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from history_codec import decode_history, encode_history, join_cells, split_cells
+from revisions import number_revisions, plan_revisions
+from scheduler import DEFAULT_WINDOW, DEFAULT_WRITES_PER_MINUTE, SAVED, TokenBucket, WriteQueue, call_api, format_error
+
+# -----------------------------------------------------------------
+#  定数
+# -----------------------------------------------------------------
+
+# Google Sheetsで作成したスプレッドシートの名前
+SHEET_NAME = "brand_gen_database"
+
+# secrets の STORAGE_BACKEND が未設定の場合に使う保存先 ("sheets" または "sqlite")
+DEFAULT_BACKEND = "sheets"
+
+# SQLite を使う場合の既定のファイルパス (secrets の SQLITE_PATH で変更可能)
+DEFAULT_SQLITE_PATH = "brand_gen.sqlite3"
+
+# Streamlit の secrets ファイル (コマンドラインツールから設定を読むときに使う)
+SECRETS_PATH = ".streamlit/secrets.toml"
+
+# ストーリーの列構成 (シートのA列〜F列の順)
+COLUMNS = ["story_id", "title", "body", "chat_history", "created_at", "history_summary"]
+
+# chat_history が1セルに収まらない場合に続きを書き込む列 (シートのG列〜J列)
+OVERFLOW_COLUMNS = [f"chat_history_{i}" for i in range(2, 6)]
+
+# シートに実際に並んでいる列
+SHEET_COLUMNS = COLUMNS + OVERFLOW_COLUMNS
+
+# 一覧表示 (ダッシュボード) に使う列。chat_history や body のような大きな列は含めない
+LISTING_COLUMNS = ["story_id", "title", "created_at"]
+
+# 検索用の索引 (search_index.py) を作るのに使う列。chat_history は含めない
+SEARCH_COLUMNS = ["story_id", "title", "body", "created_at"]
+
+# 上書き保存の記録 (story_id, 日時) を追記していくワークシートの名前
+# 差分同期 (fetch_changes) で、前回から更新された行だけを読み込むために使う
+CHANGES_SHEET_NAME = "changes"
+
+# 作成月ごとに分けて保存する場合 (ShardedSheetsBackend) のワークシート名の接頭辞 (例: "stories_2026-10")
+SHARD_PREFIX = "stories_"
+
+# 作成月ごとに分けて保存する場合の、story_id -> ワークシート名の対応表のワークシートの名前
+MANIFEST_SHEET_NAME = "manifest"
+
+# 変更履歴 (revisions.py の版のレコード) を追記していくワークシートの名前と列構成
+# 版の番号は持たず、追記された順に読み込み時に振る。data が1セルに収まらない場合は、続きを data_2 以降の列に書き込む
+REVISIONS_SHEET_NAME = "revisions"
+REVISION_COLUMNS = ["story_id", "revision_id", "base_id", "kind", "created_at", "data"]
+REVISION_SHEET_COLUMNS = REVISION_COLUMNS + [f"data_{i}" for i in range(2, 6)]
+
+
+def column_letter(number):
+    """
+    列番号 (1始まり) をシートの列名 (A, B, ..., Z, AA, ...) に変換する。
+    """
+    letters = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def quote_title(title):
+    """
+    範囲の指定 ("'シート名'!A1:B2") に使う、'...' で囲んだワークシート名 (中の ' は2つ重ねる)。
+    """
+    return "'" + title.replace("'", "''") + "'"
+
+
+def find_worksheet(spreadsheet, title):
+    """
+    スプレッドシートから title のワークシートを返す。ない場合は None (作成はしない)。
+    """
+    return next((ws for ws in spreadsheet.worksheets() if ws.title == title), None)
+
+# -----------------------------------------------------------------
+#  共通インターフェース
+# -----------------------------------------------------------------
+
+class StoryBackend:
+    """
+    ストレージバックエンドの共通インターフェース。
+    レコードは COLUMNS をキーに持つ dict で受け渡しする。
+    chat_history は会話履歴の JSON 文字列のまま受け渡しし、保存時の形式 (history_codec) への変換は
+    各バックエンドの中で行う。
+    """
+
+    def get_all_records(self):
+        """
+        すべてのストーリーを保存順の dict のリストとして返す。
+        """
+        raise NotImplementedError
+
+    def list_stories(self, shard=None, columns=LISTING_COLUMNS):
+        """
+        一覧表示用に、すべてのストーリーの columns (既定は LISTING_COLUMNS) の列だけを
+        保存順の dict のリストとして返す。columns の最初は story_id にすること。
+        shard (shards() の値) を指定した場合は、その分だけを返す。
+        """
+        raise NotImplementedError
+
+    def shards(self):
+        """
+        保存先を分けている単位 (list_stories の shard に渡す値) の新しい順のリスト。
+        分けていないバックエンドでは [None] (全件で1つ)。
+        """
+        return [None]
+
+    def get_record(self, story_id):
+        """
+        story_id に一致するストーリーを1件返す。見つからない場合は None。
+        """
+        raise NotImplementedError
+
+    def append_record(self, record):
+        """
+        新しいストーリーを1件追加する。
+        """
+        raise NotImplementedError
+
+    def append_records(self, records):
+        """
+        新しいストーリーをまとめて追加する (まとめて書き込めるバックエンドでは1回のリクエストで書き込む)。
+        """
+        for record in records:
+            self.append_record(record)
+
+    def update_record(self, story_id, title, body, chat_history, history_summary):
+        """
+        既存のストーリーの title / body / chat_history / history_summary を上書きする。
+
+        戻り値:
+            bool: 該当する story_id が見つかって更新できたかどうか
+        """
+        raise NotImplementedError
+
+    def get_revisions(self, story_id):
+        """
+        story_id の変更履歴 (revisions.py の版のレコード) を、保存先に追加された順に版の番号を振ったリストで返す。
+        """
+        raise NotImplementedError
+
+    def record_revision(self, story_id, previous, content, created_at):
+        """
+        上書き保存した story_id の内容 content を変更履歴に記録する。
+        previous は上書き前のストーリー (分からない場合は None)。
+        追加する版は、保存済みの変更履歴を読んでから revisions.plan_revisions で組み立てる
+        (書き込みをキューに入れるバックエンドでは、キューから送る時に組み立てる)。
+        """
+        raise NotImplementedError
+
+    def fetch_changes(self, cursor):
+        """
+        cursor (前回の fetch_changes が返した読み込み位置) より後に追加・更新されたストーリーを返す。
+
+        戻り値: (records, cursor)
+            records: 追加・更新されたストーリー (全列) のリスト。
+                     cursor が None の場合、または手動編集などで前回の位置が信用できなくなった場合は None
+                     (呼び出し側で全件を読み直すこと)
+            cursor : 次回に渡す読み込み位置。records が None で位置も分からない場合は None
+        """
+        raise NotImplementedError
+
+    def write_status(self, story_id):
+        """
+        story_id の書き込みの状態 (scheduler.PENDING / SAVED / FAILED) とエラーメッセージ (失敗時のみ) を返す。
+        書き込みをすぐに行うバックエンドでは常に保存済み。
+        """
+        return SAVED, None
+
+    def retry_write(self, story_id):
+        """
+        失敗した story_id の書き込みをもう一度行う (書き込み待ちに戻す)。失敗した書き込みがなければ False。
+        """
+        return False
+
+    def tracks_write(self, story_id):
+        """
+        story_id の書き込みの状態 (書き込み待ち・保存済み・失敗) をこのバックエンドが覚えているか。
+        書き込みをすぐに行うバックエンドでは常に False。
+        """
+        return False
+
+    def has_unfinished_writes(self):
+        """
+        書き込み待ち・失敗したままの書き込みが残っているか。
+        """
+        return False
+
+    def flush(self, timeout=None):
+        """
+        書き込み待ちのものをすべて書き込むまで待つ。待ちきれた場合は True。
+        """
+        return True
+
+# -----------------------------------------------------------------
+#  Google Sheets
+# -----------------------------------------------------------------
+
+class SheetsBackend(StoryBackend):
+    """
+    Google Sheets のワークシートをストーリーの保存先にするバックエンド。
+    story_id -> 行番号のマップを持ち、上書き保存時に ws.find() でシート全体を検索しない。
+
+    writes_per_minute を指定すると、保存・上書きはキューに入れてすぐに戻り、
+    window 秒ごとにまとめて (追加は append_rows、上書きは batch_update の1回ずつで) 書き込む。
+    書き込みは1分あたり writes_per_minute 回までに抑え、上限超過などのエラーは再試行する。
+    (bucket を渡すと、その流量制限を他のバックエンドと共有する)
+    
+    on_append を渡すと、行を追加し終えるたびに、追加したストーリーの story_id のリストを渡して呼ぶ。
+    (on_append が失敗しても行の追加は保存済みとして扱うので、on_append の側で後から送り直すこと)
+    """
+
+    def __init__(self, worksheet, writes_per_minute=0, window=DEFAULT_WINDOW, bucket=None, on_append=None):
+        self.ws = worksheet
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._changes_ws = None
+        self._revisions_ws = None
+        self._bucket = bucket or (TokenBucket(writes_per_minute) if writes_per_minute else None)
+        self._writes = WriteQueue(self._flush_writes, window) if writes_per_minute else None
+        self._on_append = on_append
+        self._ensure_header()
+
+    def _ensure_header(self):
+        """
+        後から追加した列 (history_summary など) のヘッダーが1行目になければ書き足す。
+        ヘッダーがないと get_all_records() がその列を読み込まないため。
+        """
+        header = self.ws.row_values(1)
+        if header and len(header) < len(SHEET_COLUMNS) and header == SHEET_COLUMNS[:len(header)]:
+            self.ws.update(f'{column_letter(len(header) + 1)}1', [SHEET_COLUMNS[len(header):]])
+
+    def _get_changes_ws(self, create=True):
+        """
+        上書き保存の記録用のワークシートを返す。
+        ない場合は、create=True (書き込み時) なら作成し、create=False (読み込み時) なら None を返す
+        (読み込みのたびにスプレッドシートを書き換えて、書き込みの上限を使わないように)。
+        """
+        if self._changes_ws is None:
+            spreadsheet = self.ws.spreadsheet
+            ws = find_worksheet(spreadsheet, CHANGES_SHEET_NAME)
+            if ws is None:
+                if not create:
+                    return None
+                ws = spreadsheet.add_worksheet(CHANGES_SHEET_NAME, rows=1000, cols=2)
+                ws.append_row(["story_id", "updated_at"])
+            self._changes_ws = ws
+        return self._changes_ws
+
+    def _get_revisions_ws(self, create=True):
+        """
+        変更履歴用のワークシートを返す。
+        ない場合は、create=True (書き込み時) なら作成し、create=False (読み込み時) なら None を返す。
+        """
+        if self._revisions_ws is None:
+            spreadsheet = self.ws.spreadsheet
+            ws = find_worksheet(spreadsheet, REVISIONS_SHEET_NAME)
+            if ws is None:
+                if not create:
+                    return None
+                ws = spreadsheet.add_worksheet(REVISIONS_SHEET_NAME, rows=1000, cols=len(REVISION_SHEET_COLUMNS))
+                ws.append_row(REVISION_SHEET_COLUMNS)
+            self._revisions_ws = ws
+        return self._revisions_ws
+
+    def get_all_records(self):
+        # .get_all_records() は1行目をヘッダーとして自動的に辞書のリストに変換してくれる
+        records = [self._from_sheet(record) for record in self.ws.get_all_records()]
+
+        # 同じ読み込み結果から行番号マップも作る
+        # (1行目はヘッダーなので、データの i 件目はシートの i+2 行目)
+        rows = {}
+        for i, record in enumerate(records):
+            rows.setdefault(str(record.get("story_id", "")), i + 2)
+        with self._lock:
+            self._rows = rows
+        return records
+
+    def list_stories(self, shard=None, columns=LISTING_COLUMNS):
+        # 必要な列 (既定では A列 story_id, B列 title, E列 created_at) だけを1回のリクエストでまとめて読む
+        letters = [column_letter(SHEET_COLUMNS.index(col) + 1) for col in columns]
+        results = self.ws.batch_get([f"{letter}2:{letter}" for letter in letters])
+
+        records = []
+        rows = {}
+        for i in range(len(results[0])):
+            # 末尾の空セル・空行は返ってこないので補う
+            record = {
+                col: values[i][0] if i < len(values) and values[i] else ""
+                for col, values in zip(columns, results)
+            }
+            records.append(record)
+            # A列を読んだので、行番号マップもここで作り直す
+            rows.setdefault(str(record["story_id"]), i + 2)
+        with self._lock:
+            self._rows = rows
+        return records
+
+    def get_record(self, story_id):
+        # 行番号マップがまだなければ、A列だけを読んで作る
+        if not self._rows:
+            self._load_rows()
+
+        # 行番号が分からないIDのためにシート全体を検索することはしない
+        row_number = self._rows.get(str(story_id))
+        if row_number is None:
+            return None
+
+        values = self.ws.row_values(row_number)
+        if not values or values[0] != str(story_id):
+            return None
+        return self._to_record(values)
+
+    @staticmethod
+    def _to_record(values):
+        """
+        シートの1行分の値のリストを、COLUMNS をキーにした dict にする。
+        """
+        values = list(values) + [""] * (len(SHEET_COLUMNS) - len(values)) # 末尾の空セルは返ってこないので補う
+        return SheetsBackend._from_sheet(dict(zip(SHEET_COLUMNS, values)))
+
+    @staticmethod
+    def _from_sheet(record):
+        """
+        シートの列 (SHEET_COLUMNS) の dict を、分けて保存していた chat_history をつなげて戻した
+        COLUMNS の dict にする。
+        """
+        cells = [record.get("chat_history", "")] + [record.get(col, "") for col in OVERFLOW_COLUMNS]
+        record = {col: record.get(col, "") for col in COLUMNS}
+        record["chat_history"] = decode_history(join_cells(cells))
+        return record
+
+    @staticmethod
+    def _history_cells(chat_history):
+        """
+        chat_history を保存形式にして、D列と続きの列 (OVERFLOW_COLUMNS) に書き込む値のリストにする。
+        """
+        return split_cells(encode_history(chat_history), 1 + len(OVERFLOW_COLUMNS))
+
+    def _sheet_row(self, record):
+        # テーブル設計のA列〜F列の順に並べ、chat_history の続きを G列以降に入れた、シートの1行分の値
+        cells = self._history_cells(record["chat_history"])
+        row = [record[col] for col in COLUMNS]
+        row[COLUMNS.index("chat_history")] = cells[0]
+        return row + cells[1:]
+
+    def append_record(self, record):
+        # シートの末尾に行を追加
+        row = self._sheet_row(record)
+
+        if self._writes is not None:
+            # キューに入れてすぐに戻る (行番号は書き込んだ時に記録する)
+            self._writes.put(str(record["story_id"]), ("append", row))
+            return
+
+        response = self.ws.append_row(row)
+
+        # 追加された行番号も記録し、上書き保存時の検索を不要にする
+        row_number = self._appended_row(response)
+        if row_number is not None:
+            with self._lock:
+                self._rows[str(record["story_id"])] = row_number
+        self._notify_append([str(record["story_id"])])
+
+    def append_records(self, records):
+        appends = [(str(record["story_id"]), self._sheet_row(record)) for record in records]
+        if self._writes is not None:
+            for key, row in appends:
+                self._writes.put(key, ("append", row)) # 同じ window の間に入ったものは1回で書き込まれる
+            return
+        if appends:
+            self._append_rows(appends)
+
+    def update_record(self, story_id, title, body, chat_history, history_summary):
+        cells = self._history_cells(chat_history)
+
+        if self._writes is not None:
+            key = str(story_id)
+            # まだ書き込んでいない追加・上書きがあれば、その中身を書き換える (書き込みは1回で済む)
+            if self._writes.merge(key, lambda op: self._merge_update(op, title, body, cells, history_summary)):
+                return True
+            # 送信中の追加があれば、行番号が分かるまで待つ
+            self._writes.wait_for(key)
+
+        row_number = self._find_row(story_id)
+        if not row_number:
+            return False
+
+        if self._writes is not None:
+            self._writes.put(str(story_id), ("update", (row_number, title, body, cells, history_summary)))
+            return True
+
+        # B列〜D列 (例: "B5:D5") と F列〜J列 (要約と chat_history の続き) を1回のリクエストでまとめて更新
+        # (E列の created_at は変更しない。使わない続きの列は空にする)
+        self.ws.batch_update(self._update_ranges(row_number, title, body, cells, history_summary))
+
+        # 差分同期のために、更新したIDを記録する
+        self._get_changes_ws().append_row([str(story_id), datetime.now().isoformat()])
+        return True
+
+    @staticmethod
+    def _update_ranges(row_number, title, body, cells, history_summary):
+        """
+        上書き保存で書き込む範囲 (batch_update に渡すリスト)。
+        """
+        last = column_letter(len(SHEET_COLUMNS))
+        return [
+            {"range": f'B{row_number}:D{row_number}', "values": [[title, body, cells[0]]]}, # 2次元配列で渡す
+            {"range": f'F{row_number}:{last}{row_number}', "values": [[history_summary] + cells[1:]]},
+        ]
+
+    @staticmethod
+    def _merge_update(op, title, body, cells, history_summary):
+        # 書き込み待ちの op に上書きの内容を反映したものを返す
+        kind, payload = op
+        if kind == "append":
+            row = list(payload)
+            row[1:4] = [title, body, cells[0]] # B列〜D列
+            row[5:] = [history_summary] + cells[1:] # F列〜J列 (E列の created_at はそのまま)
+            return "append", row
+        return "update", (payload[0], title, body, cells, history_summary)
+
+    def _flush_writes(self, ops):
+        """
+        キューにたまった書き込みをまとめて送る (WriteQueue のスレッドから呼ばれる)。
+        追加は append_rows の1回、上書きは batch_update の1回と更新記録の append_rows の1回、
+        変更履歴は append_rows の1回にまとめる。変更履歴の版は、上書きを送る前に保存済みの変更履歴を読んで組み立てる。
+
+        種類ごとに送り、失敗した呼び出しのキーだけを {key: エラーメッセージ} で返す
+        (上書きが失敗しても、同じまとまりで追加できた行は保存済みのままにして、再試行で二重に追加しない)。
+        """
+        appends = [(key, payload) for key, (kind, payload) in ops if kind == "append"]
+        revisions = [(key, payload) for key, (kind, payload) in ops if kind == "revisions"]
+        updates = {}
+        for key, (kind, payload) in ops:
+            if kind == "update":
+                updates[key] = payload # 同じ行への上書きは最後のものだけを送る
+
+        failed = {}
+        revision_rows = []
+        if revisions:
+            try:
+                revision_rows = self._plan_revision_rows([payload for _, payload in revisions])
+            except Exception as e:
+                failed.update(dict.fromkeys((key for key, _ in revisions), format_error(e)))
+
+        if appends:
+            try:
+                self._append_rows(appends, notify=False)
+            except Exception as e:
+                failed.update(dict.fromkeys((key for key, _ in appends), format_error(e)))
+            else:
+                self._notify_append([key for key, _ in appends])
+
+        if updates:
+            data = []
+            for payload in updates.values():
+                data.extend(self._update_ranges(*payload))
+            try:
+                call_api(lambda: self.ws.batch_update(data), self._bucket)
+
+                # 差分同期のために、更新したIDを記録する
+                # (ここで失敗した場合も失敗として残す。上書きは同じ内容の書き込みなので、再試行しても二重にならない)
+                now = datetime.now().isoformat()
+                changes_ws = self._get_changes_ws()
+                call_api(lambda: changes_ws.append_rows([[key, now] for key in updates]), self._bucket)
+            except Exception as e:
+                failed.update(dict.fromkeys(updates, format_error(e)))
+
+        if revision_rows:
+            try:
+                revisions_ws = self._get_revisions_ws()
+                call_api(lambda: revisions_ws.append_rows(revision_rows, value_input_option="RAW"), self._bucket)
+            except Exception as e:
+                failed.update(dict.fromkeys((key for key, _ in revisions), format_error(e)))
+
+        return failed
+
+    def _append_rows(self, appends, notify=True):
+        """
+        (story_id, シートの1行分の値) のリストを append_rows の1回で末尾に追加し、行番号マップに記録する。
+        notify=True の場合は、追加し終えてから on_append を呼ぶ。
+        """
+        response = call_api(
+            lambda: self.ws.append_rows([row for _, row in appends], value_input_option="RAW"), self._bucket
+        )
+        first_row = self._appended_row(response)
+        if first_row is not None:
+            with self._lock:
+                for i, (key, _) in enumerate(appends):
+                    self._rows[key] = first_row + i
+        if notify:
+            self._notify_append([key for key, _ in appends])
+
+    def _notify_append(self, story_ids):
+        """
+        行を追加し終えたことを on_append に知らせる。
+        on_append が失敗しても行は追加できているので保存済みのまま (例外は投げずに計測結果に記録し、
+        on_append の側で後から送り直す)。保存に失敗したと扱って再度保存すると、行が二重に追加されるため。
+        """
+        if self._on_append is None:
+            return
+        try:
+            self._on_append(story_ids)
+        except Exception as e:
+            metrics.observe("storage.on_append_failed", 0.0, error=type(e).__name__)
+
+    def get_revisions(self, story_id):
+        # 書き込み待ちの版は含まない (待たずに読む)
+        return self._read_revisions([story_id])[str(story_id)]
+
+    def _read_revisions(self, story_ids):
+        """
+        story_ids の変更履歴を読み、story_id -> 版のレコードのリスト (get_revisions と同じ形) の dict を返す。
+        A列だけを読んで該当する行を探し、その行だけを1回のリクエストでまとめて読む
+        (他のプロセスが追記した行もあるので、行番号は覚えておかずに毎回読む)。
+        """
+        found = {str(story_id): [] for story_id in story_ids}
+        revisions_ws = self._get_revisions_ws(create=False)
+        if revisions_ws is None:
+            return found
+        row_numbers = [i + 2 for i, value in enumerate(revisions_ws.col_values(1)[1:]) if str(value) in found]
+        if row_numbers:
+            last = column_letter(len(REVISION_SHEET_COLUMNS))
+            for values in revisions_ws.batch_get([f"A{row}:{last}{row}" for row in row_numbers]):
+                if not values or not values[0] or str(values[0][0]) not in found:
+                    continue
+                values = list(values[0]) + [""] * (len(REVISION_SHEET_COLUMNS) - len(values[0]))
+                found[str(values[0])].append({
+                    "revision_id": values[1],
+                    "base_id": values[2],
+                    "kind": values[3],
+                    "created_at": values[4],
+                    "data": join_cells(values[5:]),
+                })
+        return {story_id: number_revisions(rows) for story_id, rows in found.items()}
+
+    def record_revision(self, story_id, previous, content, created_at):
+        version = (created_at, content)
+        if self._writes is None:
+            planned = plan_revisions(self.get_revisions(story_id), previous, [version])
+            if planned:
+                self._get_revisions_ws().append_rows(self._revision_rows(story_id, planned), value_input_option="RAW")
+            return
+
+        # 版の組み立て (変更履歴の読み込み) は、キューから送る時に行う。
+        # 失敗したままの版があれば入れ直し、まだ送っていない版があればそこに足す
+        key = self._revisions_key(story_id)
+        self._writes.retry(key)
+        if not self._writes.merge(key, lambda op: ("revisions", dict(op[1], versions=op[1]["versions"] + [version]))):
+            self._writes.put(key, ("revisions", {"story_id": str(story_id), "previous": previous, "versions": [version]}))
+
+    def _plan_revision_rows(self, payloads):
+        """
+        書き込み待ちの変更履歴 ({"story_id", "previous", "versions"} のリスト) から、追加する行を組み立てる。
+        保存済みの変更履歴は全員分をまとめて読む。上書き前の内容が分からず、版もまだないストーリーは、
+        上書きを送る前のシートの行を上書き前の内容とする。
+        """
+        existing = self._read_revisions([payload["story_id"] for payload in payloads])
+        unknown = [payload for payload in payloads if payload["previous"] is None and not existing[payload["story_id"]]]
+        if unknown:
+            records = self.get_records_by_id([payload["story_id"] for payload in unknown], reload_missing=False)
+            for payload, record in zip(unknown, records or []):
+                payload["previous"] = record # 再試行する場合も同じ内容を使う
+
+        rows = []
+        for payload in payloads:
+            planned = plan_revisions(existing[payload["story_id"]], payload["previous"], payload["versions"])
+            rows.extend(self._revision_rows(payload["story_id"], planned))
+        return rows
+
+    @staticmethod
+    def _revision_rows(story_id, planned):
+        # 版のレコードを、変更履歴のワークシートの行にする
+        cell_count = len(REVISION_SHEET_COLUMNS) - len(REVISION_COLUMNS) + 1
+        return [
+            [str(story_id), revision["revision_id"], revision["base_id"], revision["kind"], revision["created_at"]]
+            + split_cells(revision["data"], cell_count)
+            for revision in planned
+        ]
+
+    @staticmethod
+    def _revisions_key(story_id):
+        # 書き込み待ちのキー。ストーリー本体の書き込み (キーは story_id) とはまとめず、同じストーリーの版は1つの op にまとめる
+        return f"revisions:{story_id}"
+
+    def write_status(self, story_id):
+        if self._writes is None:
+            return SAVED, None
+        return self._writes.status(str(story_id))
+
+    def retry_write(self, story_id):
+        if self._writes is None:
+            return False
+        return self._writes.retry(str(story_id))
+
+    def tracks_write(self, story_id):
+        return self._writes is not None and self._writes.knows(str(story_id))
+
+    def has_unfinished_writes(self):
+        return self._writes is not None and self._writes.unfinished_count() > 0
+
+    def flush(self, timeout=None):
+        if self._writes is None:
+            return True
+        return self._writes.flush(timeout)
+
+    def fetch_changes(self, cursor):
+        # cursor = {"rows": 読み込み済みのデータ行数, "last_id": その最後の行のID, "changes": 読み込み済みの更新記録の件数}
+        data_sheet = quote_title(self.ws.title)
+        # 更新記録のワークシートがまだない (一度も上書きされていない) 場合は、更新記録なしとして扱う
+        changes_ws = self._get_changes_ws(create=False)
+        changes_sheet = quote_title(changes_ws.title) if changes_ws is not None else None
+
+        if cursor is None:
+            # 現在の位置だけを調べる (中身は呼び出し側が全件読み直す)
+            ranges = [f"{data_sheet}!A2:A"] + ([f"{changes_sheet}!A2:A"] if changes_sheet else [])
+            values = self._batch_values(ranges)
+            ids, change_ids = values[0], values[1] if changes_sheet else []
+            last_id = ids[-1][0] if ids and ids[-1] else ""
+            return None, {"rows": len(ids), "last_id": last_id, "changes": len(change_ids)}
+
+        # 1回のリクエストで、前回の最後の行のID・その後に追加された行・その後の更新記録を読む
+        rows = cursor["rows"]
+        ranges = [
+            f"{data_sheet}!A{rows + 1}", # rows が 0 の場合はヘッダー
+            f"{data_sheet}!A{rows + 2}:{column_letter(len(SHEET_COLUMNS))}",
+        ]
+        if changes_sheet:
+            ranges.append(f"{changes_sheet}!A{cursor['changes'] + 2}:A")
+        values = self._batch_values(ranges)
+        last_values, new_rows, change_rows = values[0], values[1], values[2] if changes_sheet else []
+
+        # 前回の最後の行のIDが変わっていたら、行の削除や並べ替えがあったので位置は信用できない
+        last_id = last_values[0][0] if last_values and last_values[0] else ""
+        if last_id != (cursor["last_id"] if rows else COLUMNS[0]):
+            return None, None
+
+        records = []
+        with self._lock:
+            for i, values in enumerate(new_rows):
+                record = self._to_record(values)
+                records.append(record)
+                self._rows.setdefault(str(record["story_id"]), rows + 2 + i)
+
+        # 更新された行 (今回追加された行は除く) だけを読む
+        seen = {str(record["story_id"]) for record in records}
+        changed_ids = []
+        for values in change_rows:
+            if values and values[0] not in seen:
+                seen.add(values[0])
+                changed_ids.append(values[0])
+        if changed_ids:
+            changed_records = self.get_records_by_id(changed_ids, reload_missing=False)
+            if changed_records is None:
+                return None, None
+            records.extend(changed_records)
+
+        return records, {
+            "rows": rows + len(new_rows),
+            "last_id": new_rows[-1][0] if new_rows and new_rows[-1] else cursor["last_id"],
+            "changes": cursor["changes"] + len(change_rows),
+        }
+
+    def get_records_by_id(self, story_ids, reload_missing=True):
+        """
+        行番号マップを使って、複数のIDの行を1回のリクエストでまとめて読み、story_ids の順のレコードのリストを返す。
+        reload_missing=True の場合、行番号が分からないID (他のプロセスが追加した行など) があれば A列だけを読み直す。
+        それでも行番号が分からないID・A列の値が一致しない行がある場合は None。
+        """
+        if reload_missing and any(str(story_id) not in self._rows for story_id in story_ids):
+            self._load_rows()
+        row_numbers = [self._rows.get(str(story_id)) for story_id in story_ids]
+        if None in row_numbers:
+            return None
+
+        last = column_letter(len(SHEET_COLUMNS))
+        results = self.ws.batch_get([f"A{row}:{last}{row}" for row in row_numbers])
+
+        records = []
+        for story_id, values in zip(story_ids, results):
+            if not values or not values[0] or values[0][0] != str(story_id):
+                return None
+            records.append(self._to_record(values[0]))
+        return records
+
+    def _batch_values(self, ranges):
+        """
+        シート名付きの複数の範囲を1回のリクエストで読み、範囲ごとの値 (2次元リスト) のリストを返す。
+        """
+        response = self.ws.spreadsheet.values_batch_get(ranges)
+        return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+
+    def _find_row(self, story_id):
+        """
+        story_id が書かれているシートの行番号を返す。見つからない場合は None。
+
+        ws.find() のようにシート全体を検索せず、行番号マップの行のA列 (1セル) だけを読んで確認する。
+        値が一致しない場合 (手動で行を挿入・削除・並べ替えた場合など) は、
+        A列だけを読み直してマップを作り直す。
+        """
+        row_number = self._rows.get(str(story_id))
+        if row_number is not None and self.ws.acell(f'A{row_number}').value == str(story_id):
+            return row_number
+
+        # マップが古くなっているので作り直す
+        return self._load_rows().get(str(story_id))
+
+    def _load_rows(self):
+        """
+        A列だけを読み直して行番号マップを作り直し、そのマップを返す。
+        """
+        rows = {}
+        for i, value in enumerate(self.ws.col_values(1)[1:]):
+            rows.setdefault(str(value), i + 2)
+        with self._lock:
+            self._rows = rows
+        return rows
+
+    @staticmethod
+    def _appended_row(response):
+        """
+        append_row のレスポンス (updates.updatedRange, 例: "'シート1'!A12:E12") から
+        追加された行番号を取り出す。取り出せない場合は None。
+        """
+        try:
+            updated_range = response["updates"]["updatedRange"]
+        except (TypeError, KeyError):
+            return None
+        match = re.search(r'![A-Z]+(\d+)', updated_range)
+        return int(match.group(1)) if match else None
+
+class ShardedSheetsBackend(StoryBackend):
+    """
+    ストーリーを作成月 (created_at) ごとのワークシート (例: "stories_2026-10") に分けて保存するバックエンド。
+    1枚のワークシートが大きくなり続けて、全件の読み込みが遅くなるのを防ぐ。
+    ワークシートごとの読み書きは SheetsBackend に任せ、どのストーリーがどのワークシートにあるかは
+    対応表のワークシート (MANIFEST_SHEET_NAME: story_id, shard) に記録する。
+
+      - 追加は作成月のワークシート (なければ作成する) に書き込み、対応表にも1行追加する
+      - 1件の読み込み・上書きは、対応表で調べたワークシートだけを読む
+      - 一覧は shards() の新しい月から順に、1か月分ずつ読み込める
+
+    分ける前から使っていたワークシート (legacy_worksheet。シート1) は最も古い分として扱い、
+    対応表にないストーリーはそこから探す (ストーリーを移す必要はない)。
+    """
+
+    def __init__(self, spreadsheet, legacy_worksheet=None, writes_per_minute=0, window=DEFAULT_WINDOW):
+        self.spreadsheet = spreadsheet
+        self.legacy_ws = legacy_worksheet
+        self.writes_per_minute = writes_per_minute
+        self.window = window
+        self._lock = threading.Lock()
+        # 書き込みの上限はスプレッドシート単位ではなくプロジェクト単位なので、すべてのワークシートで共有する
+        self._bucket = TokenBucket(writes_per_minute) if writes_per_minute else None
+        self._backends = {} # ワークシート名 -> SheetsBackend
+        self._manifest = None # story_id -> ワークシート名 (最初に必要になった時に読み込む)
+        self._manifest_ws = None
+        self._manifest_backlog = [] # 対応表に書き込めなかった [story_id, ワークシート名] (次の書き込みで送り直す)
+        self._worksheets = {}
+        self._refresh_worksheets()
+
+    def _refresh_worksheets(self):
+        # 他のプロセスが作成したワークシートも見えるように、ワークシートの一覧を読み直す
+        worksheets = {ws.title: ws for ws in self.spreadsheet.worksheets()}
+        with self._lock:
+            self._worksheets = worksheets
+
+    def shards(self):
+        titles = sorted((title for title in self._worksheets if title.startswith(SHARD_PREFIX)), reverse=True)
+        if self.legacy_ws is not None:
+            titles.append(self.legacy_ws.title)
+        return titles
+
+    @staticmethod
+    def shard_title(created_at):
+        """
+        created_at (ISO形式の日時) の月のワークシート名。日時として読めない場合は現在の月。
+        """
+        month = str(created_at)[:7]
+        if not re.fullmatch(r"\d{4}-\d{2}", month):
+            month = datetime.now().strftime("%Y-%m")
+        return SHARD_PREFIX + month
+
+    def _backend(self, title, create=False):
+        """
+        ワークシート名の SheetsBackend を返す。ワークシートがなければ create=True の場合だけ作成する (それ以外は None)。
+        """
+        backend = self._backends.get(title)
+        if backend is not None:
+            return backend
+
+        if self.legacy_ws is not None and title == self.legacy_ws.title:
+            ws = self.legacy_ws
+        else:
+            if title not in self._worksheets:
+                self._refresh_worksheets()
+            ws = self._worksheets.get(title)
+            if ws is None:
+                if not create:
+                    return None
+                ws = self.spreadsheet.add_worksheet(title, rows=1000, cols=len(SHEET_COLUMNS))
+                ws.append_row(SHEET_COLUMNS)
+                with self._lock:
+                    self._worksheets[title] = ws
+
+        with self._lock:
+            if title not in self._backends:
+                self._backends[title] = SheetsBackend(
+                    ws, self.writes_per_minute, self.window, bucket=self._bucket,
+                    on_append=lambda story_ids: self._append_manifest(title, story_ids),
+                )
+            return self._backends[title]
+
+    def _get_manifest_ws(self, create=True):
+        """
+        対応表のワークシートを返す。
+        ない場合は、create=True (書き込み時) なら作成し、create=False (読み込み時) なら None を返す。
+        """
+        if self._manifest_ws is None:
+            ws = self._find_worksheet(MANIFEST_SHEET_NAME)
+            if ws is None:
+                if not create:
+                    return None
+                ws = self.spreadsheet.add_worksheet(MANIFEST_SHEET_NAME, rows=1000, cols=2)
+                ws.append_row(["story_id", "shard"])
+            self._manifest_ws = ws
+        return self._manifest_ws
+
+    def _find_worksheet(self, title):
+        # 他のプロセスが作成したかもしれないので、覚えている一覧になければ読み直す
+        if title not in self._worksheets:
+            self._refresh_worksheets()
+        return self._worksheets.get(title)
+
+    def _get_manifest(self):
+        """
+        story_id -> ワークシート名の対応表を返す。まだ読み込んでいなければ A列〜B列だけを読み込む。
+        (対応表のワークシートがまだない場合は空。その後に追加された分は fetch_changes で読み込む)
+        """
+        if self._manifest is None:
+            manifest_ws = self._get_manifest_ws(create=False)
+            (values,) = manifest_ws.batch_get(["A2:B"]) if manifest_ws is not None else ([],)
+            manifest = {}
+            for row in values:
+                if len(row) >= 2:
+                    manifest.setdefault(str(row[0]), row[1])
+            with self._lock:
+                if self._manifest is None:
+                    self._manifest = manifest
+        return self._manifest
+
+    def _append_manifest(self, title, story_ids):
+        # 行を追加し終えてから対応表に書き込む (対応表にあるストーリーは、必ずワークシートにもある)
+        # 書き込めなかった分は残しておき、次に追加した時か flush() の時に一緒に送り直す
+        with self._lock:
+            rows = self._manifest_backlog + [[story_id, title] for story_id in story_ids]
+            self._manifest_backlog = []
+        if not rows:
+            return
+        try:
+            manifest_ws = self._get_manifest_ws()
+            call_api(lambda: manifest_ws.append_rows(rows, value_input_option="RAW"), self._bucket)
+        except Exception:
+            with self._lock:
+                self._manifest_backlog = rows + self._manifest_backlog
+            raise
+
+    def _shard_of(self, story_id):
+        """
+        story_id のあるワークシートの SheetsBackend。対応表になければ分ける前のワークシート (なければ None)。
+        """
+        title = self._get_manifest().get(str(story_id))
+        if title is None:
+            return self._backend(self.legacy_ws.title) if self.legacy_ws is not None else None
+        return self._backend(title)
+
+    def get_all_records(self):
+        records = []
+        for title in reversed(self.shards()): # 古い月から順に (保存順)
+            records.extend(self._backend(title).get_all_records())
+        return records
+
+    def list_stories(self, shard=None, columns=LISTING_COLUMNS):
+        if shard is not None:
+            backend = self._backend(shard)
+            return backend.list_stories(columns=columns) if backend is not None else []
+        records = []
+        for title in reversed(self.shards()):
+            records.extend(self._backend(title).list_stories(columns=columns))
+        return records
+
+    def get_record(self, story_id):
+        backend = self._shard_of(story_id)
+        return backend.get_record(story_id) if backend is not None else None
+
+    def append_record(self, record):
+        title = self.shard_title(record["created_at"])
+        backend = self._backend(title, create=True)
+        manifest = self._get_manifest()
+        with self._lock:
+            # 対応表への書き込みは行の追加の後だが、このプロセスからはすぐに上書きできるように先に覚えておく
+            manifest[str(record["story_id"])] = title
+        backend.append_record(record)
+
+    def append_records(self, records):
+        # 作成月のワークシートごとにまとめて追加する
+        by_shard = {}
+        for record in records:
+            by_shard.setdefault(self.shard_title(record["created_at"]), []).append(record)
+        manifest = self._get_manifest()
+        for title, shard_records in by_shard.items():
+            backend = self._backend(title, create=True)
+            with self._lock:
+                for record in shard_records:
+                    manifest[str(record["story_id"])] = title
+            backend.append_records(shard_records)
+
+    def update_record(self, story_id, title, body, chat_history, history_summary):
+        backend = self._shard_of(story_id)
+        if backend is None:
+            return False
+        return backend.update_record(story_id, title, body, chat_history, history_summary)
+
+    def write_status(self, story_id):
+        backend = self._shard_of(story_id)
+        return backend.write_status(story_id) if backend is not None else (SAVED, None)
+
+    def retry_write(self, story_id):
+        backend = self._shard_of(story_id)
+        return backend.retry_write(story_id) if backend is not None else False
+
+    def tracks_write(self, story_id):
+        backend = self._shard_of(story_id)
+        return backend.tracks_write(story_id) if backend is not None else False
+
+    def has_unfinished_writes(self):
+        return bool(self._manifest_backlog) or any(
+            backend.has_unfinished_writes() for backend in list(self._backends.values())
+        )
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        flushed = True
+        for backend in list(self._backends.values()):
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            flushed = backend.flush(remaining) and flushed
+        if self._manifest_backlog:
+            try:
+                self._append_manifest(None, [])
+            except Exception:
+                flushed = False
+        return flushed
+
+    def fetch_changes(self, cursor):
+        # cursor = {"manifest": 読み込み済みの対応表の行数, "last_id": その最後の行のID, "changes": 読み込み済みの更新記録の件数}
+        # 追加されたストーリーは対応表の続きから、上書きされたストーリーは更新記録 (全ワークシート共通) から分かる
+        # 対応表・更新記録のワークシートがまだない場合は、それぞれ追加・更新なしとして扱う (読み込みでは作成しない)
+        if cursor is None:
+            self._refresh_worksheets()
+        manifest_ws = self._get_manifest_ws(create=False)
+        changes_ws = self._find_worksheet(CHANGES_SHEET_NAME)
+        manifest_sheet = quote_title(manifest_ws.title) if manifest_ws is not None else None
+        changes_sheet = quote_title(changes_ws.title) if changes_ws is not None else None
+
+        if cursor is None:
+            ranges = [f"{manifest_sheet}!A2:A"] if manifest_sheet else []
+            ranges += [f"{changes_sheet}!A2:A"] if changes_sheet else []
+            values = self._batch_values(ranges) if ranges else []
+            ids = values.pop(0) if manifest_sheet else []
+            change_ids = values.pop(0) if changes_sheet else []
+            last_id = ids[-1][0] if ids and ids[-1] else ""
+            return None, {"manifest": len(ids), "last_id": last_id, "changes": len(change_ids)}
+
+        # 1回のリクエストで、前回の対応表の最後の行のID・その後の対応表・その後の更新記録を読む
+        rows = cursor["manifest"]
+        ranges = []
+        if manifest_sheet:
+            ranges += [
+                f"{manifest_sheet}!A{rows + 1}", # rows が 0 の場合はヘッダー
+                f"{manifest_sheet}!A{rows + 2}:B",
+            ]
+        if changes_sheet:
+            ranges.append(f"{changes_sheet}!A{cursor['changes'] + 2}:A")
+        values = self._batch_values(ranges) if ranges else []
+        last_values, new_entries = (values.pop(0), values.pop(0)) if manifest_sheet else ([], [])
+        change_rows = values.pop(0) if changes_sheet else []
+
+        if manifest_sheet:
+            last_id = last_values[0][0] if last_values and last_values[0] else ""
+            if last_id != (cursor["last_id"] if rows else "story_id"):
+                return None, None
+        elif rows:
+            return None, None # 読み込んだはずの対応表がなくなっている
+
+        manifest = self._get_manifest()
+        new_ids = []
+        with self._lock:
+            for values in new_entries:
+                if len(values) >= 2:
+                    manifest.setdefault(str(values[0]), values[1])
+                    new_ids.append(str(values[0]))
+
+        seen = set(new_ids)
+        changed_ids = []
+        for values in change_rows:
+            if values and values[0] not in seen:
+                seen.add(values[0])
+                changed_ids.append(values[0])
+
+        # ワークシートごとに、該当する行だけをまとめて読む
+        by_shard = {}
+        for story_id in new_ids + changed_ids:
+            backend = self._shard_of(story_id)
+            if backend is None:
+                return None, None
+            by_shard.setdefault(backend, []).append(story_id)
+        found = {}
+        for backend, story_ids in by_shard.items():
+            # 他のプロセスが追加した行の行番号は分からないので、その場合は A列だけ読み直してから読む
+            records = backend.get_records_by_id(story_ids)
+            if records is None:
+                return None, None
+            found.update(zip(story_ids, records))
+
+        return [found[story_id] for story_id in new_ids + changed_ids], {
+            "manifest": rows + len(new_entries),
+            "last_id": new_entries[-1][0] if new_entries and new_entries[-1] else cursor["last_id"],
+            "changes": cursor["changes"] + len(change_rows),
+        }
+
+    def get_revisions(self, story_id):
+        backend = self._shard_of(story_id)
+        return backend.get_revisions(story_id) if backend is not None else []
+
+    def record_revision(self, story_id, previous, content, created_at):
+        # 変更履歴のワークシートは全ワークシートで共通だが、ストーリーのあるワークシートの SheetsBackend を通して書き込む
+        # (同じストーリーの版が1つのキューに並ぶので、プロセス内では前の版を書き込み終えてから次の版を組み立てる)
+        backend = self._shard_of(story_id)
+        if backend is not None:
+            backend.record_revision(story_id, previous, content, created_at)
+
+    def _batch_values(self, ranges):
+        response = self.spreadsheet.values_batch_get(ranges)
+        return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+
+# -----------------------------------------------------------------
+#  SQLite
+# -----------------------------------------------------------------
+
+class SQLiteBackend(StoryBackend):
+    """
+    ローカルの SQLite ファイルをストーリーの保存先にするバックエンド。
+    WALモードで開くので、読み込み中の閲覧セッションが書き込みにブロックされない。
+    story_id は主キーなので1件の検索は索引で行われる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Streamlit は複数のスレッドからセッションを実行するため、接続をスレッド間で共有する
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS stories (
+                    story_id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL DEFAULT '',
+                    body TEXT NOT NULL DEFAULT '',
+                    chat_history TEXT NOT NULL DEFAULT '',
+                    created_at TEXT NOT NULL DEFAULT '',
+                    history_summary TEXT NOT NULL DEFAULT ''
+                )
+                """
+            )
+            # 差分同期 (fetch_changes) のための、上書き保存の記録
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS story_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    story_id TEXT NOT NULL
+                )
+                """
+            )
+            # 変更履歴 (revisions.py の版のレコード)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS story_revisions (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    story_id TEXT NOT NULL,
+                    revision_id TEXT NOT NULL,
+                    base_id TEXT NOT NULL DEFAULT '',
+                    kind TEXT NOT NULL,
+                    created_at TEXT NOT NULL DEFAULT '',
+                    data TEXT NOT NULL DEFAULT ''
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS story_revisions_story_id ON story_revisions (story_id, seq)"
+            )
+            # 古いファイルには後から追加した列がないので足しておく
+            existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(stories)")}
+            for col in COLUMNS:
+                if col not in existing:
+                    self._conn.execute(f"ALTER TABLE stories ADD COLUMN {col} TEXT NOT NULL DEFAULT ''")
+
+    def get_all_records(self):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM stories ORDER BY rowid"
+            ).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    @staticmethod
+    def _from_row(row):
+        """
+        stories テーブルの1行を、chat_history を JSON 文字列に戻した dict にする。
+        """
+        record = {col: row[col] for col in COLUMNS}
+        record["chat_history"] = decode_history(record["chat_history"])
+        return record
+
+    def list_stories(self, shard=None, columns=LISTING_COLUMNS):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(columns)} FROM stories ORDER BY rowid"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_record(self, story_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM stories WHERE story_id = ?",
+                (str(story_id),),
+            ).fetchone()
+        return self._from_row(row) if row else None
+
+    def append_record(self, record):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO stories ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [encode_history(record[col]) if col == "chat_history" else record[col] for col in COLUMNS],
+            )
+
+    def append_records(self, records):
+        # 1つのトランザクションでまとめて追加する
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO stories ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [
+                    [encode_history(record[col]) if col == "chat_history" else record[col] for col in COLUMNS]
+                    for record in records
+                ],
+            )
+
+    def update_record(self, story_id, title, body, chat_history, history_summary):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE stories SET title = ?, body = ?, chat_history = ?, history_summary = ? WHERE story_id = ?",
+                (title, body, encode_history(chat_history), history_summary, str(story_id)),
+            )
+            if cursor.rowcount > 0:
+                self._conn.execute("INSERT INTO story_changes (story_id) VALUES (?)", (str(story_id),))
+        return cursor.rowcount > 0
+
+    def get_revisions(self, story_id):
+        with self._lock:
+            return self._select_revisions(story_id)
+
+    def _select_revisions(self, story_id):
+        rows = self._conn.execute(
+            "SELECT revision_id, base_id, kind, created_at, data FROM story_revisions WHERE story_id = ? ORDER BY seq",
+            (str(story_id),),
+        ).fetchall()
+        return number_revisions([dict(row) for row in rows])
+
+    def record_revision(self, story_id, previous, content, created_at):
+        # 読み込みと追加を同じロック・トランザクションの中で行う
+        with self._lock, self._conn:
+            planned = plan_revisions(self._select_revisions(story_id), previous, [(created_at, content)])
+            self._conn.executemany(
+                "INSERT INTO story_revisions (story_id, revision_id, base_id, kind, created_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        str(story_id), revision["revision_id"], revision["base_id"],
+                        revision["kind"], revision["created_at"], revision["data"],
+                    )
+                    for revision in planned
+                ],
+            )
+
+    def fetch_changes(self, cursor):
+        # cursor = {"rowid": 読み込み済みの最後の rowid, "count": それまでの件数, "seq": 読み込み済みの更新記録の番号}
+        columns = ', '.join(COLUMNS)
+        with self._lock:
+            if cursor is None:
+                max_rowid, count = self._conn.execute(
+                    "SELECT COALESCE(MAX(rowid), 0), COUNT(*) FROM stories"
+                ).fetchone()
+                seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM story_changes").fetchone()[0]
+                return None, {"rowid": max_rowid, "count": count, "seq": seq}
+
+            # 読み込み済みの範囲の件数が変わっていたら、削除などがあったので位置は信用できない
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM stories WHERE rowid <= ?", (cursor["rowid"],)
+            ).fetchone()[0]
+            if count != cursor["count"]:
+                return None, None
+
+            new_rows = self._conn.execute(
+                f"SELECT rowid, {columns} FROM stories WHERE rowid > ? ORDER BY rowid", (cursor["rowid"],)
+            ).fetchall()
+            changes = self._conn.execute(
+                "SELECT seq, story_id FROM story_changes WHERE seq > ? ORDER BY seq", (cursor["seq"],)
+            ).fetchall()
+
+            records = [self._from_row(row) for row in new_rows]
+            seen = {record["story_id"] for record in records}
+            changed_ids = list(dict.fromkeys(row["story_id"] for row in changes if row["story_id"] not in seen))
+            if changed_ids:
+                changed_rows = self._conn.execute(
+                    f"SELECT {columns} FROM stories WHERE story_id IN ({', '.join('?' * len(changed_ids))})",
+                    changed_ids,
+                ).fetchall()
+                records.extend(self._from_row(row) for row in changed_rows)
+
+        return records, {
+            "rowid": new_rows[-1]["rowid"] if new_rows else cursor["rowid"],
+            "count": cursor["count"] + len(new_rows),
+            "seq": changes[-1]["seq"] if changes else cursor["seq"],
+        }
+
+# -----------------------------------------------------------------
+#  接続 (コマンドラインツールなど、Streamlit の外から使う場合)
+# -----------------------------------------------------------------
+
+def open_worksheet(creds_dict, sheet_name=SHEET_NAME):
+    """
+    サービスアカウントの認証情報 (dict) で Google Sheets に接続し、
+    指定した名前のスプレッドシートの最初のワークシート (シート1) を返す。
+    """
+    import gspread
+
+    gc = gspread.service_account_from_dict(creds_dict)
+    return gc.open(sheet_name).sheet1
+
+
+def load_secrets(path=SECRETS_PATH):
+    """
+    Streamlit の secrets ファイル (TOML) を読み込み、st.secrets と同じ形の dict を返す。
+    """
+    import toml
+
+    return toml.load(path)
+
+
+def create_backend(secrets, worksheet=None):
+    """
+    secrets (st.secrets と同じ形の dict) の STORAGE_BACKEND に従ってバックエンドを作成する。
+    Streamlit のアプリからは database.get_backend() を使うこと。
+      - "sheets" (既定): Google Sheets。SHEETS_SHARDING が True なら作成月ごとのワークシートに分けて保存する
+                         (それまでのシート1のストーリーはそのまま読める)
+      - "sqlite"       : ローカルの SQLite ファイル (SQLITE_PATH)
+
+    worksheet を渡した場合は、Google Sheets に接続せずにそのワークシートをシート1として使う
+    (Streamlit のアプリではキャッシュした接続、ベンチマークでは偽物のワークシートを渡す)。
+    不明な STORAGE_BACKEND の場合は ValueError。
+    """
+    backend_name = secrets.get("STORAGE_BACKEND", DEFAULT_BACKEND)
+    if backend_name == "sqlite":
+        return SQLiteBackend(secrets.get("SQLITE_PATH", DEFAULT_SQLITE_PATH))
+    if worksheet is None:
+        if backend_name != "sheets":
+            raise ValueError(f"不明なストレージバックエンド '{backend_name}' が指定されています。")
+        worksheet = open_worksheet(dict(secrets["gcp_service_account"]))
+
+    # Sheets への書き込みは1分あたりの上限に合わせてまとめて送る (0 にするとその場で1件ずつ書き込む)
+    writes_per_minute = secrets.get("SHEETS_WRITES_PER_MINUTE", DEFAULT_WRITES_PER_MINUTE)
+    if secrets.get("SHEETS_SHARDING", False):
+        return ShardedSheetsBackend(worksheet.spreadsheet, legacy_worksheet=worksheet, writes_per_minute=writes_per_minute)
+    return SheetsBackend(worksheet, writes_per_minute=writes_per_minute)
@@ -0,0 +1,8 @@
+# tests/conftest.py
+#
+# テストからリポジトリ直下のモジュール (storage.py など) を読み込めるようにする。
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
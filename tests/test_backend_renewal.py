@@ -0,0 +1,94 @@
+# tests/test_backend_renewal.py
+#
+# バックエンドの差し替え (database.BackendHolder.renew) の前に書き込んだストーリーの、
+# 書き込みの状態の確認と再試行のテスト。保存先は fakes.FakeSpreadsheet (メモリ上の偽物) を使う。
+
+import threading
+
+import database
+from fakes import FakeSpreadsheet
+from scheduler import FAILED, PENDING, SAVED
+from storage import SHEET_COLUMNS, SheetsBackend
+
+
+def make_record(story_id):
+    return {
+        "story_id": story_id,
+        "title": "タイトル",
+        "body": "本文",
+        "chat_history": "[]",
+        "created_at": "2026-10-01T00:00:00",
+        "history_summary": "",
+    }
+
+
+def broken_append_rows(values, **kwargs):
+    raise RuntimeError("append_rows failed")
+
+
+def make_holder(monkeypatch):
+    spreadsheet = FakeSpreadsheet()
+    ws = spreadsheet.sheet1
+    ws.append_row(SHEET_COLUMNS)
+    monkeypatch.setattr(database, "create_backend", lambda: SheetsBackend(ws, writes_per_minute=6000, window=0.01))
+    monkeypatch.setattr(database, "RENEW_FLUSH_TIMEOUT", 0.1)
+    holder = database.BackendHolder()
+    holder.renew()
+    return ws, holder
+
+
+def test_pending_write_stays_pending_after_renew(monkeypatch):
+    ws, holder = make_holder(monkeypatch)
+    release = threading.Event()
+    original_append_rows = ws.append_rows
+
+    def slow_append_rows(values, **kwargs):
+        release.wait(5)
+        return original_append_rows(values, **kwargs)
+
+    ws.append_rows = slow_append_rows
+    holder.backend.append_record(make_record("s1"))
+    old = holder.backend
+
+    holder.renew() # 古いキューの書き込みは待ちきれずに残る
+    assert holder.backend is not old
+    assert holder.write_status("s1") == (PENDING, None)
+
+    release.set()
+    assert old.flush(timeout=5)
+    assert holder.write_status("s1") == (SAVED, None)
+    assert holder.retired == [] # 書き込みが終わったので手放す
+
+
+def test_failed_write_can_be_retried_after_renew(monkeypatch):
+    ws, holder = make_holder(monkeypatch)
+    original_append_rows = ws.append_rows
+    ws.append_rows = broken_append_rows
+    holder.backend.append_record(make_record("s1"))
+    assert holder.backend.flush(timeout=5)
+
+    holder.renew()
+    status, error = holder.write_status("s1")
+    assert status == FAILED
+    assert "append_rows failed" in error
+
+    ws.append_rows = original_append_rows
+    assert holder.retry_write("s1")
+    assert holder.retired[0].flush(timeout=5)
+    assert holder.write_status("s1") == (SAVED, None)
+    assert [row[0] for row in ws.rows[1:]] == ["s1"]
+
+
+def test_newer_write_wins_over_retired_backend(monkeypatch):
+    ws, holder = make_holder(monkeypatch)
+    original_append_rows = ws.append_rows
+    ws.append_rows = broken_append_rows
+    holder.backend.append_record(make_record("s1"))
+    assert holder.backend.flush(timeout=5)
+    holder.renew()
+
+    # 差し替え後に同じストーリーを書き込み直した場合は、新しいバックエンドの状態を返す
+    ws.append_rows = original_append_rows
+    holder.backend.append_record(make_record("s1"))
+    assert holder.backend.flush(timeout=5)
+    assert holder.write_status("s1") == (SAVED, None)
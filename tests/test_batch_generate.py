@@ -0,0 +1,47 @@
+# tests/test_batch_generate.py
+#
+# コマンドラインのバッチ処理 (batch_generate.py) のテスト。AI は fakes の偽物のモデルを使う。
+
+import os
+import uuid
+
+import batch_generate
+import llm
+from fakes import FAKE_STORY_JSON, FakeChunk, FakeGenerativeModel
+
+
+class CountingBucket:
+    # 使ったトークンの数を数えるだけの流量制限
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+class RepairingModel(FakeGenerativeModel):
+    # 1回目は読めない出力を返し、形式の直しでは読める出力を返す
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.prompts.append(prompt)
+        return FakeChunk("これは JSON ではありません" if len(self.prompts) == 1 else FAKE_STORY_JSON)
+
+
+def test_repair_call_takes_its_own_token():
+    model = RepairingModel()
+    bucket = CountingBucket()
+    messages = [{"role": "user", "content": "トマトを育てています"}]
+
+    title, _, from_cache = batch_generate.generate_story(model, messages, bucket, None, llm.STORY_FORMAT_JSON)
+    assert title
+    assert not from_cache
+    assert len(model.prompts) == 2
+    assert bucket.acquired == 2 # 形式の直しの呼び出しも数える
+
+
+def test_qr_png_is_named_by_story_id(tmp_path):
+    story_id = str(uuid.uuid4())
+    entries = [{"id": "../../outside", "story_id": story_id, "title": "タイトル"}]
+
+    batch_generate.write_outputs(str(tmp_path), entries, "https://example.com", "")
+    assert os.listdir(tmp_path / batch_generate.QR_DIR) == [f"{story_id}.png"]
+    assert not (tmp_path.parent / "outside.png").exists()
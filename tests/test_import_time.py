@@ -0,0 +1,20 @@
+# tests/test_import_time.py
+#
+# QRコードからの閲覧・ストーリー作成ページの起動時に、重いライブラリ (Gemini, qrcode, gspread など) を
+# 読み込んでいないかのテスト。新しいプロセスで読み込み (python -X importtime) を行い、
+# Streamlit 本体だけの場合より後に読み込まれたモジュールを benchmarks/bench_import_time.py と同じ一覧で確かめる。
+
+import pytest
+
+from benchmarks.bench_import_time import BASELINE, TARGETS, heavy_modules, import_time
+
+
+@pytest.fixture(scope="module")
+def baseline_modules():
+    return import_time(TARGETS[BASELINE])[1]
+
+
+@pytest.mark.parametrize("target", [name for name in TARGETS if name != BASELINE])
+def test_startup_does_not_import_heavy_modules(target, baseline_modules):
+    _, modules = import_time(TARGETS[target])
+    assert heavy_modules(modules, baseline_modules) == []
@@ -0,0 +1,31 @@
+# tests/test_qr_codes.py
+#
+# QRコードの一括作成 (qr_codes.generate_batch) のテスト。
+
+import uuid
+
+import qr_codes
+
+
+def make_items(count):
+    items = []
+    for _ in range(count):
+        story_id = str(uuid.uuid4())
+        items.append({"story_id": story_id, "title": "タイトル", "url": qr_codes.story_url(story_id)})
+    return items
+
+
+def test_small_batch_does_not_start_process_pool(monkeypatch):
+    # ダッシュボードの1ページ分は、プロセスを起動せずに1件ずつ作る
+    def no_pool(*args, **kwargs):
+        raise AssertionError("process pool started")
+
+    monkeypatch.setattr(qr_codes, "ProcessPoolExecutor", no_pool)
+    items = make_items(50)
+    pngs, stats = qr_codes.generate_batch(items)
+    assert len(pngs) == 50
+    assert all(png.startswith(b"\x89PNG") for png in pngs)
+    assert stats["cache_hits"] == 0
+
+    _, stats = qr_codes.generate_batch(items)
+    assert stats["cache_hits"] == 50
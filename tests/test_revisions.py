@@ -0,0 +1,125 @@
+# tests/test_revisions.py
+#
+# 変更履歴 (revisions.plan_revisions / rebuild / replay と、保存先の record_revision / get_revisions) のテスト。
+# 組み立てた版を保存した順に並べ、どの版も上書きした時の内容に戻せることを確かめる。
+
+from fakes import FakeSpreadsheet
+from revisions import DELTA, SNAPSHOT, SNAPSHOT_EVERY, number_revisions, plan_revisions, rebuild, replay
+from storage import SHEET_COLUMNS, SheetsBackend, SQLiteBackend
+
+
+def make_content(i):
+    return {
+        "title": f"タイトル{i}",
+        "body": "むかしむかし、あるところに。\n" * 3 + f"第{i}版の本文。\n",
+        "chat_history": f'[{{"role": "user", "content": "{i}回目"}}]',
+        "history_summary": "" if i % 2 else f"要約{i}",
+    }
+
+
+def record(saved, previous, versions):
+    # 保存先に追加するのと同じように、組み立てた版を末尾に足す
+    saved = saved + plan_revisions(number_revisions(saved), previous, versions)
+    return saved
+
+
+def test_sequential_updates_round_trip():
+    saved = []
+    previous = make_content(0)
+    for i in range(1, 26):
+        saved = record(saved, previous, [(f"2026-10-01T00:00:{i:02}", make_content(i))])
+        previous = make_content(i)
+
+    numbered = number_revisions(saved)
+    # 1版目は上書き前の内容、以降は上書きした順
+    assert len(numbered) == 26
+    for number in range(1, 27):
+        assert rebuild(numbered, number) == make_content(number - 1)
+    assert [content for _, content in replay(numbered)] == [make_content(i) for i in range(26)]
+
+    # 全文は SNAPSHOT_EVERY 版ごと、差分は直前の版に対するもの
+    kinds = [revision["kind"] for revision in numbered]
+    assert kinds == [SNAPSHOT if i % SNAPSHOT_EVERY == 0 else DELTA for i in range(26)]
+    for prev, revision in zip(numbered, numbered[1:]):
+        if revision["kind"] == DELTA:
+            assert revision["base_id"] == prev["revision_id"]
+
+
+def test_unchanged_content_adds_nothing():
+    saved = record([], make_content(0), [("t1", make_content(1))])
+    assert plan_revisions(number_revisions(saved), make_content(1), [("t2", make_content(1))]) == []
+    assert plan_revisions([], make_content(0), [("t1", make_content(0))]) == []
+
+
+def test_batched_versions_round_trip():
+    # キューにたまった複数回の上書きを1回で組み立てる
+    versions = [(f"t{i}", make_content(i)) for i in range(1, 13)]
+    numbered = number_revisions(record([], make_content(0), versions))
+    assert [content for _, content in replay(numbered)] == [make_content(i) for i in range(13)]
+    assert rebuild(numbered, 13) == make_content(12)
+
+
+def test_concurrent_planners_round_trip():
+    # 2つのプロセスが同じ保存済みの変更履歴を読んでから、それぞれの版を追加する
+    saved = record([], make_content(0), [("t1", make_content(1))])
+    first = plan_revisions(number_revisions(saved), make_content(1), [("t2a", make_content(2))])
+    second = plan_revisions(number_revisions(saved), make_content(1), [("t2b", make_content(3))])
+    saved = saved + first + second
+
+    numbered = number_revisions(saved)
+    assert [revision["revision"] for revision in numbered] == [1, 2, 3, 4] # 番号は追加された順で重ならない
+    assert rebuild(numbered, 3) == make_content(2)
+    assert rebuild(numbered, 4) == make_content(3)
+
+    # 次の版は最後に追加された版に対する差分になる
+    saved = record(saved, make_content(3), [("t3", make_content(4))])
+    numbered = number_revisions(saved)
+    assert numbered[-1]["base_id"] == numbered[-2]["revision_id"]
+    assert [content for _, content in replay(numbered)] == [make_content(i) for i in range(5)]
+
+
+def test_missing_base_is_skipped():
+    saved = record([], make_content(0), [("t1", make_content(1)), ("t2", make_content(2))])
+    numbered = number_revisions(saved[1:]) # 全文の版が消えた
+    assert rebuild(numbered, 1) is None
+    assert replay(numbered) == []
+
+
+def test_sqlite_record_revision_round_trip(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "stories.sqlite3"))
+    for i in range(1, 13):
+        backend.record_revision("s1", make_content(i - 1), make_content(i), f"t{i}")
+    revisions = backend.get_revisions("s1")
+    assert [revision["revision"] for revision in revisions] == list(range(1, 14))
+    assert [content for _, content in replay(revisions)] == [make_content(i) for i in range(13)]
+    assert backend.get_revisions("other") == []
+
+
+def test_sheets_queue_plans_revisions_when_flushing():
+    spreadsheet = FakeSpreadsheet()
+    ws = spreadsheet.sheet1
+    ws.append_row(SHEET_COLUMNS)
+    backend = SheetsBackend(ws, writes_per_minute=6000, window=0.01)
+    content = make_content(0)
+    backend.append_record(dict(content, story_id="s1", created_at="2026-10-01T00:00:00"))
+    assert backend.flush(timeout=5)
+
+    # 読み込みではワークシートを作らない
+    assert backend.get_revisions("s1") == []
+    assert "revisions" not in [sheet.title for sheet in spreadsheet.worksheets()]
+
+    # 上書き前の内容が分からない場合は、上書きを送る前の行を読んで全文の版にする
+    for i in (1, 2):
+        content = make_content(i)
+        assert backend.update_record("s1", content["title"], content["body"], content["chat_history"],
+                                     content["history_summary"])
+        backend.record_revision("s1", None, content, f"t{i}")
+    assert backend.flush(timeout=5)
+
+    revisions = backend.get_revisions("s1")
+    assert [content for _, content in replay(revisions)] == [make_content(i) for i in range(3)]
+
+    backend.record_revision("s1", make_content(2), make_content(3), "t3")
+    assert backend.flush(timeout=5)
+    revisions = backend.get_revisions("s1")
+    assert rebuild(revisions, 4) == make_content(3)
@@ -0,0 +1,44 @@
+# tests/test_sharded_backend.py
+#
+# 作成月ごとに分けて保存するバックエンド (storage.ShardedSheetsBackend) のテスト。
+# 保存先は fakes.FakeSpreadsheet (メモリ上の偽物のスプレッドシート) を使う。
+
+from fakes import FakeSpreadsheet
+from storage import MANIFEST_SHEET_NAME, ShardedSheetsBackend, find_worksheet
+
+
+def make_record(story_id):
+    return {
+        "story_id": story_id,
+        "title": "タイトル",
+        "body": "本文",
+        "chat_history": "[]",
+        "created_at": "2026-10-01T00:00:00",
+        "history_summary": "",
+    }
+
+
+def test_failed_manifest_append_does_not_fail_sync_save():
+    spreadsheet = FakeSpreadsheet()
+    backend = ShardedSheetsBackend(spreadsheet) # 書き込みをすぐに行う (キューなし)
+    original_get_manifest_ws = backend._get_manifest_ws
+
+    def broken_get_manifest_ws(create=True):
+        if create: # 対応表への書き込みだけが失敗する
+            raise RuntimeError("manifest unavailable")
+        return original_get_manifest_ws(create)
+
+    backend._get_manifest_ws = broken_get_manifest_ws
+
+    # 行は書き込めているので、対応表に書き込めなくても保存は成功として扱う (例外を投げない)
+    backend.append_record(make_record("s1"))
+    shard = find_worksheet(spreadsheet, "stories_2026-10")
+    assert [row[0] for row in shard.rows[1:]] == ["s1"]
+    assert backend.has_unfinished_writes()
+
+    # 書き込めなかった対応表の行は、flush() で送り直す
+    backend._get_manifest_ws = original_get_manifest_ws
+    assert backend.flush(timeout=5)
+    assert not backend.has_unfinished_writes()
+    manifest_ws = find_worksheet(spreadsheet, MANIFEST_SHEET_NAME)
+    assert [row[:2] for row in manifest_ws.rows[1:]] == [["s1", "stories_2026-10"]]
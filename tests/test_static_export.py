@@ -0,0 +1,81 @@
+# tests/test_static_export.py
+#
+# 静的な HTML への書き出し (static_export.export_stories) のテスト。保存先は SQLite のバックエンドを使う。
+
+import json
+import os
+import uuid
+
+import pytest
+
+import qr_codes
+import static_export
+from storage import SQLiteBackend
+
+
+def make_record(story_id):
+    return {
+        "story_id": story_id,
+        "title": "タイトル",
+        "body": "本文",
+        "chat_history": "[]",
+        "created_at": "2026-10-01T00:00:00",
+        "history_summary": "",
+    }
+
+
+def test_story_filename_rejects_ids_outside_out_dir():
+    with pytest.raises(ValueError):
+        static_export.story_filename("../../etc/passwd")
+
+
+def test_export_skips_ids_that_are_not_uuids(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "stories.db"))
+    story_id = str(uuid.uuid4())
+    backend.append_records([make_record(story_id), make_record("../outside")])
+    out_dir = tmp_path / "public"
+
+    result = static_export.export_stories(backend, str(out_dir), workers=1)
+    assert result["written"] == 1
+    assert result["invalid"] == 1
+    assert os.listdir(out_dir / "stories") == [f"{story_id}.html"]
+    assert not (tmp_path / "outside.html").exists()
+
+
+def test_full_export_ignores_tampered_manifest_entries(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "stories.db"))
+    out_dir = tmp_path / "public"
+    static_export.export_stories(backend, str(out_dir), workers=1)
+
+    # 手で編集された manifest の、出力先の外を指すエントリで外のファイルを削除しない
+    victim = tmp_path / "victim.txt"
+    victim.write_text("keep")
+    manifest_path = out_dir / static_export.MANIFEST_NAME
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    manifest["cursor"] = None
+    manifest["stories"]["../../victim"] = {"hash": "", "file": "../victim.txt", "title": "", "created_at": ""}
+    manifest_path.write_text(json.dumps(manifest), encoding="utf-8")
+
+    result = static_export.export_stories(backend, str(out_dir), workers=1)
+    assert result["removed"] == 0
+    assert victim.exists()
+    assert static_export.load_manifest(str(out_dir))["stories"] == {}
+
+
+def test_story_url_points_at_static_page_only_after_export(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "stories.db"))
+    exported_id, new_id = str(uuid.uuid4()), str(uuid.uuid4())
+    backend.append_records([make_record(exported_id)])
+    out_dir = tmp_path / "public"
+    static_export.export_stories(backend, str(out_dir), workers=1)
+    backend.append_records([make_record(new_id)]) # 次の書き出しまでファイルがない
+
+    exported_ids = static_export.load_exported_ids(str(out_dir))
+    assert exported_ids == {exported_id}
+    base = "https://example.com/stories-site"
+    assert qr_codes.story_url(exported_id, static_base_url=base, exported_ids=exported_ids) == (
+        f"{base}/stories/{exported_id}.html"
+    )
+    assert qr_codes.story_url(new_id, static_base_url=base, exported_ids=exported_ids) == (
+        f"{qr_codes.DEFAULT_APP_URL}/?story_id={new_id}"
+    )
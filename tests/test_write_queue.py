@@ -0,0 +1,137 @@
+# tests/test_write_queue.py
+#
+# Sheets への書き込みのキュー (scheduler.WriteQueue と storage.SheetsBackend._flush_writes) のテスト。
+# 保存先は fakes.FakeWorksheet (メモリ上の偽物のワークシート) を使う。
+
+import requests
+
+from fakes import FakeSpreadsheet
+from scheduler import FAILED, PENDING, SAVED, WriteQueue, call_api, is_retryable
+from storage import SHEET_COLUMNS, SheetsBackend
+
+
+def make_backend():
+    spreadsheet = FakeSpreadsheet()
+    ws = spreadsheet.sheet1
+    ws.append_row(SHEET_COLUMNS)
+    return ws, SheetsBackend(ws, writes_per_minute=6000, window=0.01)
+
+
+def make_record(story_id, title="タイトル"):
+    return {
+        "story_id": story_id,
+        "title": title,
+        "body": "本文",
+        "chat_history": "[]",
+        "created_at": "2026-10-01T00:00:00",
+        "history_summary": "",
+    }
+
+
+def story_ids(ws):
+    return [row[0] for row in ws.rows[1:]]
+
+
+def test_failed_update_does_not_fail_append_in_same_batch():
+    ws, backend = make_backend()
+    backend.append_record(make_record("s0"))
+    assert backend.flush(timeout=5)
+
+    def broken_batch_update(data):
+        raise RuntimeError("batch_update failed")
+
+    original_batch_update = ws.batch_update
+    ws.batch_update = broken_batch_update
+
+    # 同じまとまりで送られる、新しい行の追加と既存の行の上書き
+    backend.append_record(make_record("s1"))
+    assert backend.update_record("s0", "新しいタイトル", "新しい本文", "[]", "")
+    assert backend.write_status("s1")[0] == PENDING
+    assert backend.flush(timeout=5)
+
+    # 追加は書き込めているので保存済み、上書きだけが失敗
+    assert backend.write_status("s1") == (SAVED, None)
+    status, error = backend.write_status("s0")
+    assert status == FAILED
+    assert "batch_update failed" in error
+    assert story_ids(ws) == ["s0", "s1"]
+
+    # 追加した行は再試行の対象にならない (二重に追加されない)
+    assert not backend.retry_write("s1")
+
+    # 上書きは再試行で書き込める
+    ws.batch_update = original_batch_update
+    assert backend.retry_write("s0")
+    assert backend.flush(timeout=5)
+    assert backend.write_status("s0") == (SAVED, None)
+    assert story_ids(ws) == ["s0", "s1"]
+    assert backend.get_record("s0")["title"] == "新しいタイトル"
+
+
+def test_failed_append_is_retried_once():
+    ws, backend = make_backend()
+    original_append_rows = ws.append_rows
+
+    def broken_append_rows(values, **kwargs):
+        raise RuntimeError("append_rows failed")
+
+    ws.append_rows = broken_append_rows
+    backend.append_record(make_record("s1"))
+    assert backend.flush(timeout=5)
+    assert backend.write_status("s1")[0] == FAILED
+    assert story_ids(ws) == []
+
+    ws.append_rows = original_append_rows
+    assert backend.retry_write("s1")
+    assert backend.flush(timeout=5)
+    assert backend.write_status("s1") == (SAVED, None)
+    assert story_ids(ws) == ["s1"]
+
+
+def test_flush_fn_reports_failures_per_key():
+    def flush_fn(ops):
+        return {key: "error" for key, op in ops if op == "bad"}
+
+    queue = WriteQueue(flush_fn, window=0.01)
+    queue.put("a", "good")
+    queue.put("b", "bad")
+    assert queue.flush(timeout=5)
+    assert queue.status("a") == (SAVED, None)
+    assert queue.status("b") == (FAILED, "error")
+    assert not queue.retry("a")
+    assert queue.retry("b")
+
+
+def test_exception_from_flush_fn_fails_whole_batch():
+    def flush_fn(ops):
+        raise RuntimeError("down")
+
+    queue = WriteQueue(flush_fn, window=0.01)
+    queue.put("a", 1)
+    queue.put("b", 2)
+    assert queue.flush(timeout=5)
+    assert queue.status("a")[0] == FAILED
+    assert queue.status("b") == (FAILED, "RuntimeError: down")
+
+
+def test_network_errors_from_requests_are_retryable():
+    # gspread の通信エラーは requests の例外で、組み込みの ConnectionError / TimeoutError のサブクラスではない
+    assert is_retryable(requests.exceptions.ConnectionError("connection aborted"))
+    assert is_retryable(requests.exceptions.ReadTimeout("read timed out"))
+    assert is_retryable(requests.exceptions.ChunkedEncodingError("connection broken"))
+    assert is_retryable(ConnectionResetError())
+    assert not is_retryable(ValueError("bad value"))
+
+
+def test_call_api_retries_dropped_connection(monkeypatch):
+    monkeypatch.setattr("scheduler.MAX_BACKOFF", 0)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise requests.exceptions.ConnectionError("connection aborted")
+        return "ok"
+
+    assert call_api(flaky) == "ok"
+    assert len(calls) == 3